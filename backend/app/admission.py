@@ -0,0 +1,259 @@
+"""Admission control: per-client rate limits, concurrency limits, load shedding.
+
+Every request is put in a route class (`route_class`). Per client and class a
+token bucket limits the request rate (429 when empty). Each class except
+`stream` then needs a slot from its concurrency limiter; a request that cannot
+get one within the class's queue budget is shed with 503. Both carry a
+`Retry-After` header.
+
+Limits adapt to latency: a completion slower than the class's latency target
+shrinks its limit multiplicatively, fast ones grow it back additively (AIMD),
+so a backed-up database sheds browsing quickly instead of letting every
+request time out. Checkout and payment routes have their own, larger budget,
+and while checkouts are queueing, browsing runs at half its limit.
+
+`/health` and the payment webhook are exempt. Off by default; enable it with ADMISSION_CONTROL=1. Clients are keyed by the
+peer address, so behind a proxy or load balancer also set
+TRUST_FORWARDED_FOR=1, or every user shares one set of buckets. Configure
+rates as `class=rate:burst` pairs, e.g. RATE_LIMITS="browse=10:40,checkout=2:10".
+"""
+from __future__ import annotations
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "0") == "1"
+RATE_LIMITS = os.getenv("RATE_LIMITS", "browse=20:60,images=100:300,checkout=3:15,write=5:20,admin=10:30")
+# Honour X-Forwarded-For only behind a proxy that sets it.
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+MAX_TRACKED_CLIENTS = 100_000
+
+# Razorpay's webhooks come in bursts from a few gateway addresses; the route
+# only verifies a signature and appends to the durable queue, and a 429 there
+# just makes the gateway redeliver.
+EXEMPT_PATHS = {"/health", "/payments/webhook"}
+# The server-sent event streams; long-lived, so not rate or concurrency limited.
+STREAM_PATHS = re.compile(r"/orders/[^/]+/events|/admin/orders/events")
+
+
+def route_class(method: str, path: str) -> str:
+  if method == "GET" and STREAM_PATHS.fullmatch(path):
+    return "stream"
+  if path.startswith("/payments") or (method == "POST" and path in ("/orders", "/cart/quote")):
+    return "checkout"
+  if path.startswith("/admin"):
+    return "admin"
+  if path.startswith("/images/"):
+    # A product grid loads dozens of thumbnails at once; mostly cache hits.
+    return "images"
+  if method in ("GET", "HEAD") or path == "/products:batch":
+    return "browse"
+  return "write"
+
+
+def parse_rate_limits(spec: str) -> dict[str, tuple[float, float]]:
+  limits = {}
+  for part in filter(None, (p.strip() for p in spec.split(","))):
+    name, _, value = part.partition("=")
+    rate, _, burst = value.partition(":")
+    limits[name.strip()] = (float(rate), float(burst or rate))
+  return limits
+
+
+class TokenBuckets:
+  """Token buckets keyed by (client, route class), bounded in number."""
+
+  def __init__(self, limits: dict[str, tuple[float, float]], max_keys: int = MAX_TRACKED_CLIENTS):
+    self.limits = limits
+    self.max_keys = max_keys
+    self._buckets: OrderedDict[tuple[str, str], tuple[float, float]] = OrderedDict()
+
+  def take(self, client: str, cls: str, now: float | None = None) -> float:
+    """Take a token; returns 0 on success or the seconds until one is available."""
+    if cls not in self.limits:
+      return 0.0
+    rate, burst = self.limits[cls]
+    now = time.monotonic() if now is None else now
+    key = (client, cls)
+    tokens, updated = self._buckets.pop(key, (burst, now))
+    tokens = min(burst, tokens + (now - updated) * rate)
+    wait = 0.0
+    if tokens >= 1:
+      tokens -= 1
+    else:
+      wait = (1 - tokens) / rate
+    self._buckets[key] = (tokens, now)
+    if len(self._buckets) > self.max_keys:
+      self._buckets.popitem(last=False)
+    return wait
+
+
+@dataclass
+class ClassPolicy:
+  max_limit: int
+  min_limit: int
+  queue_budget: float  # seconds a request may wait for a slot
+  latency_target: float  # seconds; slower completions shrink the limit
+
+
+POLICIES = {
+  "checkout": ClassPolicy(max_limit=16, min_limit=4, queue_budget=5.0, latency_target=2.0),
+  "browse": ClassPolicy(max_limit=24, min_limit=2, queue_budget=0.25, latency_target=0.5),
+  "images": ClassPolicy(max_limit=32, min_limit=4, queue_budget=2.0, latency_target=2.0),
+  "write": ClassPolicy(max_limit=4, min_limit=1, queue_budget=2.0, latency_target=2.0),
+  "admin": ClassPolicy(max_limit=4, min_limit=1, queue_budget=1.0, latency_target=5.0),
+}
+
+
+class AdaptiveLimiter:
+  """Concurrency limit with a bounded wait and AIMD adjustment on latency."""
+
+  def __init__(self, policy: ClassPolicy):
+    self.policy = policy
+    self.limit = float(policy.max_limit)
+    self.active = 0
+    self.waiters: deque[asyncio.Future] = deque()
+    self.throttled = False  # set while a higher-priority class is queueing
+    self.admitted = 0
+    self.shed = 0
+
+  def capacity(self) -> int:
+    limit = self.limit / 2 if self.throttled else self.limit
+    return max(self.policy.min_limit, int(limit))
+
+  async def acquire(self) -> bool:
+    if self.active < self.capacity() and not self.waiters:
+      self.active += 1
+      self.admitted += 1
+      return True
+    waiter = asyncio.get_running_loop().create_future()
+    self.waiters.append(waiter)
+    try:
+      await asyncio.wait_for(waiter, self.policy.queue_budget)
+    except asyncio.TimeoutError:
+      self.shed += 1
+      return False
+    except asyncio.CancelledError:
+      if waiter.done() and not waiter.cancelled():
+        # Handed a slot just as the client went away; pass it on.
+        self.active -= 1
+        self.wake()
+      raise
+    finally:
+      if waiter in self.waiters:
+        self.waiters.remove(waiter)
+    self.admitted += 1
+    return True
+
+  def release(self, latency: float) -> None:
+    self.active -= 1
+    if latency > self.policy.latency_target:
+      self.limit = max(self.policy.min_limit, self.limit * 0.9)
+    else:
+      self.limit = min(self.policy.max_limit, self.limit + 1 / self.limit)
+    self.wake()
+
+  def wake(self) -> None:
+    # Slots are handed over directly, so a new arrival cannot jump the queue.
+    while self.waiters and self.active < self.capacity():
+      waiter = self.waiters.popleft()
+      if not waiter.done():
+        waiter.set_result(None)
+        self.active += 1
+
+  def stats(self) -> dict:
+    return {
+      "limit": self.capacity(),
+      "active": self.active,
+      "waiting": len(self.waiters),
+      "admitted": self.admitted,
+      "shed": self.shed,
+    }
+
+
+class AdmissionMiddleware:
+  """ASGI middleware applying rate limits and adaptive concurrency limits."""
+
+  def __init__(self, app, rate_limits: str = RATE_LIMITS, policies: dict[str, ClassPolicy] | None = None):
+    self.app = app
+    self.buckets = TokenBuckets(parse_rate_limits(rate_limits))
+    self.limiters = {name: AdaptiveLimiter(policy) for name, policy in (policies or POLICIES).items()}
+    self.rate_limited = 0
+    admission_state.append(self)
+
+  def client_key(self, scope) -> str:
+    if TRUST_FORWARDED_FOR:
+      forwarded = dict(scope.get("headers") or []).get(b"x-forwarded-for")
+      if forwarded:
+        return forwarded.split(b",")[0].strip().decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in EXEMPT_PATHS:
+      await self.app(scope, receive, send)
+      return
+
+    cls = route_class(scope["method"], scope["path"])
+    wait = self.buckets.take(self.client_key(scope), cls)
+    if wait:
+      self.rate_limited += 1
+      await _reject(send, 429, "Too many requests", wait)
+      return
+
+    limiter = self.limiters.get(cls)
+    if limiter is None:
+      await self.app(scope, receive, send)
+      return
+
+    self._update_priority()
+    admitted = await limiter.acquire()
+    self._update_priority()
+    if not admitted:
+      await _reject(send, 503, "Server busy, retry shortly", limiter.policy.queue_budget)
+      return
+    started = time.monotonic()
+    try:
+      await self.app(scope, receive, send)
+    finally:
+      limiter.release(time.monotonic() - started)
+      self._update_priority()
+
+  def _update_priority(self) -> None:
+    checkout, browse = self.limiters.get("checkout"), self.limiters.get("browse")
+    if checkout is None or browse is None:
+      return
+    throttled = bool(checkout.waiters)
+    if browse.throttled and not throttled:
+      browse.throttled = False
+      browse.wake()
+    browse.throttled = throttled
+
+  def stats(self) -> dict:
+    return {
+      "rateLimited": self.rate_limited,
+      "classes": {name: limiter.stats() for name, limiter in self.limiters.items()},
+    }
+
+
+async def _reject(send, status: int, detail: str, retry_after: float) -> None:
+  body = json.dumps({"detail": detail}).encode()
+  await send({
+    "type": "http.response.start",
+    "status": status,
+    "headers": [
+      (b"content-type", b"application/json"),
+      (b"content-length", str(len(body)).encode()),
+      (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+    ],
+  })
+  await send({"type": "http.response.body", "body": body})
+
+
+# Middleware instances created by Starlette, for the stats endpoint.
+admission_state: list[AdmissionMiddleware] = []
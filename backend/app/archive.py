@@ -0,0 +1,224 @@
+"""Order archival into compressed NDJSON segments.
+
+Orders placed more than `ARCHIVE_AFTER_DAYS` ago whose payment is settled
+(paid or expired) are moved out of `orders`/`order_items` into gzip-compressed
+NDJSON segment files under ARCHIVE_DIR, one or more per order month. Each
+archived order ID is recorded in `order_archive_index` with its segment, so
+`find_archived_order` resolves it by ID with one indexed lookup and one
+segment read. The sales summary tables keep counting archived orders, and
+`stats.rebuild` reads them back from the segments (`archived_orders`).
+
+A segment is written and fsynced before the rows are deleted, in one
+transaction with the manifest entries; a crash in between leaves an unused
+segment file and the orders still in place. Archival is reversible:
+
+    python -m app.archive archive --older-than-days 365
+    python -m app.archive restore --month 2025-01
+    python -m app.archive restore --order ORD-1738400000000-a1b2c3
+"""
+from __future__ import annotations
+import argparse
+import gzip
+import json
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, inspect
+from sqlalchemy.orm import Session
+
+from .cache import LRUCache
+from .crud import UNPAID_STATUSES
+from .database import SessionLocal
+from .models import ArchivedOrderDB, OrderDB, OrderItemDB
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./order_archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = 5000
+
+ORDER_COLUMNS = [column.key for column in inspect(OrderDB).columns]
+
+# Segments never change once written, so decoded ones can be kept.
+_segments = LRUCache(maxsize=8)
+
+
+def _segment_path(segment: str) -> str:
+  return os.path.join(ARCHIVE_DIR, segment)
+
+
+def _write_segment(month: str, records: list[dict]) -> str:
+  os.makedirs(ARCHIVE_DIR, exist_ok=True)
+  segment = f"orders-{month}-{datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:6]}.ndjson.gz"
+  path = _segment_path(segment)
+  with open(path + ".tmp", "wb") as raw:
+    with gzip.GzipFile(fileobj=raw, mode="wb") as out:
+      for record in records:
+        out.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+    raw.flush()
+    os.fsync(raw.fileno())
+  os.replace(path + ".tmp", path)
+  return segment
+
+
+def read_segment(segment: str) -> dict[str, dict]:
+  """All orders in a segment, keyed by order ID."""
+  records = _segments.get(segment)
+  if records is None:
+    with gzip.open(_segment_path(segment), "rt") as f:
+      records = {record["id"]: record for record in map(json.loads, f)}
+    _segments.set(segment, records)
+  return records
+
+
+def _records(db: Session, orders: list[OrderDB]) -> list[dict]:
+  items = defaultdict(list)
+  rows = (
+    db.query(OrderItemDB.order_id, OrderItemDB.product_id, OrderItemDB.quantity)
+    .filter(OrderItemDB.order_id.in_([o.id for o in orders]))
+    .all()
+  )
+  for order_id, product_id, quantity in rows:
+    items[order_id].append({"productId": product_id, "quantity": quantity})
+  return [
+    {**{column: getattr(order, column) for column in ORDER_COLUMNS}, "items": items[order.id]}
+    for order in orders
+  ]
+
+
+def archive_orders(db: Session, older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+  """Move settled orders placed before the cutoff into segments. Returns how many moved."""
+  cutoff = (datetime.utcnow() - timedelta(days=older_than_days)).strftime("%Y-%m-%d")
+  moved = 0
+  while True:
+    orders = (
+      db.query(OrderDB)
+      .filter(OrderDB.date < cutoff, OrderDB.payment_status.notin_(UNPAID_STATUSES))
+      .order_by(OrderDB.date, OrderDB.id)
+      .limit(batch_size)
+      .all()
+    )
+    if not orders:
+      return moved
+
+    by_month = defaultdict(list)
+    for record in _records(db, orders):
+      by_month[record["date"][:7]].append(record)
+    archived_at = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+    manifest = []
+    for month, records in by_month.items():
+      segment = _write_segment(month, records)
+      manifest += [
+        {"order_id": r["id"], "month": month, "segment": segment, "archived_at": archived_at}
+        for r in records
+      ]
+
+    ids = [o.id for o in orders]
+    try:
+      db.execute(insert(ArchivedOrderDB), manifest)
+      db.execute(delete(OrderItemDB).where(OrderItemDB.order_id.in_(ids)))
+      db.execute(delete(OrderDB).where(OrderDB.id.in_(ids)))
+      db.commit()
+    except Exception:
+      db.rollback()
+      raise
+    db.expunge_all()
+    moved += len(ids)
+
+
+def archived_orders(db: Session):
+  """Every archived order record, one segment at a time."""
+  segments = [segment for (segment,) in db.query(ArchivedOrderDB.segment).distinct().order_by(ArchivedOrderDB.segment)]
+  for segment in segments:
+    ids = {order_id for (order_id,) in db.query(ArchivedOrderDB.order_id).filter(ArchivedOrderDB.segment == segment)}
+    # Read without the segment cache: a rebuild walks every segment once.
+    with gzip.open(_segment_path(segment), "rt") as f:
+      for record in map(json.loads, f):
+        if record["id"] in ids:  # orders restored since are back in `orders`
+          yield record
+
+
+def find_archived_order(db: Session, order_id: str) -> dict | None:
+  """The archived record for `order_id` (order columns plus `items`), if any."""
+  entry = db.get(ArchivedOrderDB, order_id)
+  if entry is None:
+    return None
+  return read_segment(entry.segment).get(order_id)
+
+
+def restore_orders(db: Session, month: str | None = None, order_ids: list[str] | None = None) -> int:
+  """Move archived orders (a whole month, or specific IDs) back into `orders`.
+
+  Segments with no remaining manifest entries are deleted. Returns the
+  number of orders restored.
+  """
+  query = db.query(ArchivedOrderDB)
+  if month:
+    query = query.filter(ArchivedOrderDB.month == month)
+  if order_ids:
+    query = query.filter(ArchivedOrderDB.order_id.in_(order_ids))
+  entries = query.all()
+  if not entries:
+    return 0
+
+  by_segment = defaultdict(set)
+  for entry in entries:
+    by_segment[entry.segment].add(entry.order_id)
+  orders, items = [], []
+  for segment, ids in by_segment.items():
+    for order_id in ids:
+      record = dict(read_segment(segment)[order_id])
+      items += [
+        {"order_id": order_id, "product_id": item["productId"], "quantity": item["quantity"]}
+        for item in record.pop("items")
+      ]
+      orders.append(record)
+
+  restored_ids = [entry.order_id for entry in entries]
+  try:
+    db.execute(insert(OrderDB), orders)
+    if items:
+      db.execute(insert(OrderItemDB), items)
+    db.execute(delete(ArchivedOrderDB).where(ArchivedOrderDB.order_id.in_(restored_ids)))
+    db.commit()
+  except Exception:
+    db.rollback()
+    raise
+
+  for segment in by_segment:
+    if db.query(ArchivedOrderDB.order_id).filter(ArchivedOrderDB.segment == segment).first() is None:
+      os.remove(_segment_path(segment))
+  return len(restored_ids)
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Archive or restore old orders.")
+  commands = parser.add_subparsers(dest="command", required=True)
+  archive = commands.add_parser("archive", help="move old settled orders into archive segments")
+  archive.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+  restore = commands.add_parser("restore", help="move archived orders back")
+  restore.add_argument("--month", help="order month, YYYY-MM")
+  restore.add_argument("--order", action="append", dest="orders", help="order ID (repeatable)")
+  lookup = commands.add_parser("lookup", help="print an archived order")
+  lookup.add_argument("order_id")
+  args = parser.parse_args()
+
+  from .database import Base, engine
+
+  Base.metadata.create_all(bind=engine)
+  db = SessionLocal()
+  try:
+    if args.command == "archive":
+      print(f"Archived {archive_orders(db, args.older_than_days)} orders into {ARCHIVE_DIR}")
+    elif args.command == "restore":
+      if not args.month and not args.orders:
+        parser.error("restore needs --month or --order")
+      print(f"Restored {restore_orders(db, args.month, args.orders)} orders")
+    else:
+      print(json.dumps(find_archived_order(db, args.order_id), indent=2))
+  finally:
+    db.close()
+
+
+if __name__ == "__main__":
+  main()
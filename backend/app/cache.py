@@ -0,0 +1,110 @@
+"""Catalog version counter and small in-process memo caches.
+
+Anything derived from catalog rows (prices, listings, serialized responses)
+can be memoized under the current catalog version. Every endpoint that
+mutates products, brands or manufacturers calls `bump_catalog_version()`,
+which makes all previously cached entries unreachable.
+
+The version lives in a small memory-mapped file (CATALOG_VERSION_FILE), so
+all worker processes on a host see a bump made by any of them on their very
+next read; reading it is a struct unpack, cheap enough to do per request.
+Where `fcntl` is unavailable (Windows) it falls back to a per-process counter.
+"""
+from __future__ import annotations
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+try:
+  import fcntl
+except ImportError:  # not available on Windows
+  fcntl = None
+
+CATALOG_VERSION_FILE = os.getenv("CATALOG_VERSION_FILE", "./catalog_version")
+
+
+class SharedCounter:
+  """64-bit counter in a memory-mapped file shared by every process that opens it.
+
+  Increments take a POSIX record lock, which is held per process and so
+  stays exclusive across forked workers.
+  """
+
+  def __init__(self, path: str):
+    self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    if os.fstat(self._fd).st_size < 8:
+      os.ftruncate(self._fd, 8)
+    self._map = mmap.mmap(self._fd, 8)
+    self._lock = threading.Lock()
+
+  def value(self) -> int:
+    return struct.unpack_from("<Q", self._map)[0]
+
+  def increment(self) -> int:
+    with self._lock:
+      fcntl.lockf(self._fd, fcntl.LOCK_EX)
+      try:
+        value = self.value() + 1
+        struct.pack_into("<Q", self._map, 0, value)
+        return value
+      finally:
+        fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+class LocalCounter:
+  def __init__(self) -> None:
+    self._value = 0
+    self._lock = threading.Lock()
+
+  def value(self) -> int:
+    return self._value
+
+  def increment(self) -> int:
+    with self._lock:
+      self._value += 1
+      return self._value
+
+
+_catalog_version = SharedCounter(CATALOG_VERSION_FILE) if fcntl is not None else LocalCounter()
+
+
+def catalog_version() -> int:
+  return _catalog_version.value()
+
+
+def bump_catalog_version() -> int:
+  return _catalog_version.increment()
+
+
+class LRUCache:
+  """Thread-safe bounded mapping that evicts the least recently used key."""
+
+  def __init__(self, maxsize: int = 1024) -> None:
+    self.maxsize = maxsize
+    self._data: OrderedDict[Hashable, Any] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self) -> int:
+    return len(self._data)
+
+  def get(self, key: Hashable, default: Any = None) -> Any:
+    with self._lock:
+      try:
+        self._data.move_to_end(key)
+      except KeyError:
+        return default
+      return self._data[key]
+
+  def set(self, key: Hashable, value: Any) -> None:
+    with self._lock:
+      self._data[key] = value
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._data.clear()
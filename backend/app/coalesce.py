@@ -0,0 +1,98 @@
+"""Single-flight request coalescing.
+
+When many identical requests arrive together (a promo email going out), only
+the first one runs the query and serialization; the others wait for it and
+receive the same result object, typically the encoded response bytes. Nothing
+is kept once the computation finishes, so this never serves stale data: keys
+include the catalog version, and a request that arrives after the computation
+finished starts a new one.
+"""
+from __future__ import annotations
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Call:
+  __slots__ = ("done", "value", "error")
+
+  def __init__(self) -> None:
+    self.done = threading.Event()
+    self.value: Any = None
+    self.error: BaseException | None = None
+
+
+class SingleFlight:
+  """Deduplicates concurrent calls with the same key, for threads and asyncio."""
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self._calls: dict[Hashable, _Call] = {}
+    self._tasks: dict[Hashable, asyncio.Future] = {}
+    self.leaders = 0
+    self.followers = 0
+    self.errors = 0
+
+  def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+    """Run `fn` unless an identical call is already running in another thread."""
+    with self._lock:
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        call = self._calls[key] = _Call()
+        self.leaders += 1
+      else:
+        self.followers += 1
+
+    if not leader:
+      call.done.wait()
+      if call.error is not None:
+        raise call.error
+      return call.value
+
+    try:
+      call.value = fn()
+      return call.value
+    except BaseException as e:
+      call.error = e
+      self.errors += 1
+      raise
+    finally:
+      with self._lock:
+        del self._calls[key]
+      call.done.set()
+
+  async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Await `fn()` unless an identical call is already in flight on this loop.
+
+    The computation runs as its own task, so a disconnecting client does not
+    cancel it for everyone else waiting on the same key.
+    """
+    task = self._tasks.get(key)
+    if task is None:
+      task = asyncio.ensure_future(fn())
+      self._tasks[key] = task
+      self.leaders += 1
+      task.add_done_callback(lambda t, key=key: self._finish_task(key, t))
+    else:
+      self.followers += 1
+    return await asyncio.shield(task)
+
+  def _finish_task(self, key: Hashable, task: asyncio.Future) -> None:
+    if self._tasks.get(key) is task:
+      del self._tasks[key]
+    if not task.cancelled() and task.exception() is not None:
+      self.errors += 1
+
+  def stats(self) -> dict:
+    total = self.leaders + self.followers
+    return {
+      "executions": self.leaders,
+      "coalesced": self.followers,
+      "errors": self.errors,
+      "inFlight": len(self._calls) + len(self._tasks),
+      "coalescedRatio": round(self.followers / total, 4) if total else 0.0,
+    }
+
+
+catalog_flights = SingleFlight()
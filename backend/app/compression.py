@@ -0,0 +1,151 @@
+"""Negotiated response compression (brotli or gzip) for JSON payloads.
+
+Only complete, single-message bodies above a size threshold are compressed;
+streamed responses (e.g. server-sent events) pass through untouched. Brotli is
+used when the optional `brotli` package is installed and the client accepts it.
+Large bodies are compressed in the thread pool, off the event loop.
+
+Endpoints whose bodies are shared by coalesced requests (the product list)
+compress them once per encoding with `compressed_response` instead, and the
+middleware leaves responses that already carry a Content-Encoding alone.
+"""
+from __future__ import annotations
+import gzip
+from typing import Awaitable, Callable, Hashable
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+
+from .coalesce import SingleFlight
+
+try:
+  import brotli
+except ImportError:  # optional dependency
+  brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+# Bodies at least this large are compressed in the thread pool.
+OFFLOAD_MIN_BYTES = 64 * 1024
+
+compressed_flights = SingleFlight()
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+  accepted = {}
+  for part in accept_encoding.split(","):
+    name, _, params = part.strip().partition(";")
+    q = 1.0
+    if params.strip().startswith("q="):
+      try:
+        q = float(params.strip()[2:])
+      except ValueError:
+        q = 0.0
+    accepted[name.strip().lower()] = q
+  if brotli is not None and accepted.get("br", 0) > 0:
+    return "br"
+  if accepted.get("gzip", 0) > 0:
+    return "gzip"
+  return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+  if encoding == "br":
+    return brotli.compress(body, quality=5)
+  return gzip.compress(body, compresslevel=6)
+
+
+def _with_vary(headers: list[tuple[bytes, bytes]]) -> list[tuple[bytes, bytes]]:
+  for i, (name, value) in enumerate(headers):
+    if name.lower() == b"vary":
+      if b"accept-encoding" not in value.lower() and value.strip() != b"*":
+        headers[i] = (name, value + b", Accept-Encoding")
+      return headers
+  return headers + [(b"vary", b"Accept-Encoding")]
+
+
+async def compressed_response(
+  request: Request,
+  key: Hashable,
+  body_flight: Callable[[], Awaitable[bytes]],
+  minimum_size: int,
+  media_type: str = "application/json",
+) -> Response:
+  """A response for a coalesced body, compressed once per (key, encoding).
+
+  `body_flight` returns the shared uncompressed body; concurrent requests for
+  the same key and encoding share one compression of it as well.
+  """
+  encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+  if encoding is None:
+    body, used = await body_flight(), None
+  else:
+    async def compress_body() -> tuple[bytes, str | None]:
+      body = await body_flight()
+      if len(body) < minimum_size:
+        return body, None
+      return await run_in_threadpool(compress, body, encoding), encoding
+
+    body, used = await compressed_flights.do_async((key, encoding), compress_body)
+  headers = {"Vary": "Accept-Encoding"}
+  if used:
+    headers["Content-Encoding"] = used
+  return Response(content=body, media_type=media_type, headers=headers)
+
+
+class CompressionMiddleware:
+  """ASGI middleware compressing eligible responses once they exceed `minimum_size`.
+
+  Every compressible response gets `Vary: Accept-Encoding`, compressed or not,
+  so shared caches keep the encodings apart.
+  """
+
+  def __init__(self, app, minimum_size: int = 1024):
+    self.app = app
+    self.minimum_size = minimum_size
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    headers = dict(scope.get("headers") or [])
+    encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+
+    start = None
+
+    async def send_wrapper(message):
+      nonlocal start
+      if message["type"] == "http.response.start":
+        start = message
+        return
+      if message["type"] != "http.response.body" or start is None:
+        await send(message)
+        return
+
+      pending, start = start, None
+      body = message.get("body", b"")
+      response_headers = [(k, v) for k, v in pending["headers"]]
+      names = {k.lower(): v for k, v in response_headers}
+      content_type = names.get(b"content-type", b"").decode("latin-1")
+      if content_type.startswith(COMPRESSIBLE_TYPES):
+        response_headers = _with_vary(response_headers)
+        eligible = (
+          encoding is not None
+          and not message.get("more_body", False)
+          and len(body) >= self.minimum_size
+          and b"content-encoding" not in names
+        )
+        if eligible:
+          if len(body) >= OFFLOAD_MIN_BYTES:
+            body = await run_in_threadpool(compress, body, encoding)
+          else:
+            body = compress(body, encoding)
+          response_headers = [(k, v) for k, v in response_headers if k.lower() != b"content-length"]
+          response_headers += [
+            (b"content-encoding", encoding.encode()),
+            (b"content-length", str(len(body)).encode()),
+          ]
+          message = {**message, "body": body}
+      await send({**pending, "headers": response_headers})
+      await send(message)
+
+    await self.app(scope, receive, send_wrapper)
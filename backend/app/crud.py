@@ -1,12 +1,87 @@
 from __future__ import annotations
-from sqlalchemy.orm import Session
-from .models import ProductDB, BrandDB, OrderDB, OrderItemDB, ManufacturerDB
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, func, literal, or_, tuple_, update
+from sqlalchemy.orm import Session, load_only, selectinload
+from .models import ProductDB, BrandDB, OrderDB, OrderItemDB, ManufacturerDB, effective_price
+from .models import CATALOG_MODELS, CatalogSequenceDB, change_timestamp, next_change_seq
 from .data import products, brands, manufacturers
+from .cache import LRUCache, catalog_version
+from .events import record_order_event
+from .stats import record_order_created, record_order_paid, record_status_change
+from .stats import backfill as backfill_sales_stats
+
+# How long an unpaid order holds its stock before the sweeper releases it.
+RESERVATION_TTL = timedelta(minutes=int(os.getenv("RESERVATION_TTL_MINUTES", "15")))
+RESERVATION_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+UNPAID_STATUSES = ("pending", "failed")
+# A payment has been captured: the order is confirmed, or awaits a refund.
+CAPTURED_STATUSES = ("paid", "refund_due")
+
+# Slug IDs used by older frontends, mapped to the current prod_X IDs.
+LEGACY_PRODUCT_IDS = {
+  'turbocharger': 'prod_1',
+  'brake-kit': 'prod_2',
+  'suspension': 'prod_3',
+  'exhaust': 'prod_4',
+  'racing-seat': 'prod_5',
+  'carbon-hood': 'prod_6',
+  'intercooler': 'prod_7',
+  'racing-wheel': 'prod_8',
+}
+
+
+class OutOfStockError(Exception):
+  """Raised when a product cannot cover the requested quantity."""
+
+  def __init__(self, product_id: str):
+    super().__init__(f"Insufficient stock for product: {product_id}")
+    self.product_id = product_id
+
+
+def backfill_effective_prices(db: Session) -> int:
+  """Fill `effective_price` for rows written before the column existed."""
+  result = db.execute(
+    update(ProductDB)
+    .where(ProductDB.effective_price.is_(None))
+    .values(effective_price=func.round(ProductDB.price * (1 - func.coalesce(ProductDB.discount, 0) / 100.0), 2))
+    .execution_options(synchronize_session=False)
+  )
+  db.commit()
+  return result.rowcount
+
+
+def backfill_change_tracking(db: Session) -> int:
+  """Give catalog rows written before change tracking existed a change sequence."""
+  pending = [
+    model for model in CATALOG_MODELS
+    if db.query(model.id).filter(model.change_seq.is_(None)).first() is not None
+  ]
+  if not pending:
+    return 0
+  seq = next_change_seq(db.connection())
+  now = change_timestamp()
+  updated = 0
+  for model in pending:
+    result = db.execute(
+      update(model)
+      .where(model.change_seq.is_(None))
+      .values(change_seq=seq, updated_at=now)
+      .execution_options(synchronize_session=False)
+    )
+    updated += result.rowcount
+  db.commit()
+  return updated
 
 
 def init_db(db: Session):
   """Seed database with initial data if empty."""
   if db.query(ProductDB).first() is not None:
+    backfill_effective_prices(db)
+    backfill_change_tracking(db)
+    backfill_sales_stats(db)
     return
 
   for product in products:
@@ -47,8 +122,49 @@ def init_db(db: Session):
   db.commit()
 
 
+def resolve_product_id(product_id: str) -> str:
+  return LEGACY_PRODUCT_IDS.get(product_id, product_id)
+
+
 def get_product_by_id(db: Session, product_id: str) -> ProductDB | None:
-  return db.query(ProductDB).filter(ProductDB.id == product_id).first()
+  return db.query(ProductDB).filter(ProductDB.id == product_id, ProductDB.deleted_at.is_(None)).first()
+
+
+def get_products_by_ids(db: Session, product_ids: list[str]) -> dict[str, ProductDB]:
+  """Load several products in a single query, keyed by ID."""
+  if not product_ids:
+    return {}
+  rows = db.query(ProductDB).filter(ProductDB.id.in_(set(product_ids)), ProductDB.deleted_at.is_(None)).all()
+  return {p.id: p for p in rows}
+
+
+def get_stock_levels(db: Session, product_ids: list[str]) -> dict[str, int | None]:
+  """Current stock for several products in one query (None = untracked)."""
+  if not product_ids:
+    return {}
+  rows = db.query(ProductDB.id, ProductDB.stock).filter(ProductDB.id.in_(set(product_ids))).all()
+  return {product_id: stock for product_id, stock in rows}
+
+
+# Categories are matched exactly when the value is a known category so that the
+# (category, effective_price) index can serve the query; anything else falls
+# back to the original case-insensitive substring match.
+_known_categories = LRUCache(maxsize=4)
+
+PRODUCT_SORTS = {
+  "price-asc": lambda price_col: (price_col.asc(), ProductDB.id),
+  "price-desc": lambda price_col: (price_col.desc(), ProductDB.id),
+  "rating-desc": lambda price_col: (ProductDB.rating.desc(), ProductDB.id),
+}
+
+
+def known_categories(db: Session) -> frozenset[str]:
+  version = catalog_version()
+  categories = _known_categories.get(version)
+  if categories is None:
+    categories = frozenset(get_categories(db))
+    _known_categories.set(version, categories)
+  return categories
 
 
 def list_products(
@@ -59,8 +175,20 @@ def list_products(
   category: str | None = None,
   min_price: float | None = None,
   max_price: float | None = None,
+  sort: str | None = None,
+  price_basis: str = "effective",
+  columns: list[str] | None = None,
 ) -> list[ProductDB]:
-  query = db.query(ProductDB)
+  """Filter and sort products in SQL.
+
+  `price_basis` selects whether `min_price`/`max_price` and the price sorts use
+  the discounted `effective_price` (default) or the list `price`. `columns`
+  limits the loaded attributes; other attributes must not be accessed.
+  """
+  query = db.query(ProductDB).filter(ProductDB.deleted_at.is_(None))
+  if columns:
+    query = query.options(load_only(*(getattr(ProductDB, c) for c in columns)))
+  price_col = ProductDB.price if price_basis == "list" else ProductDB.effective_price
 
   if q:
     term = f"%{q.lower()}%"
@@ -77,46 +205,428 @@ def list_products(
     query = query.filter(ProductDB.manufacturer.ilike(f"%{manufacturer}%"))
 
   if category:
-    query = query.filter(ProductDB.category.ilike(f"%{category}%"))
+    if category in known_categories(db):
+      query = query.filter(ProductDB.category == category)
+    else:
+      query = query.filter(ProductDB.category.ilike(f"%{category}%"))
 
   if min_price is not None:
-    query = query.filter(ProductDB.price >= min_price)
+    query = query.filter(price_col >= min_price)
 
   if max_price is not None:
-    query = query.filter(ProductDB.price <= max_price)
+    query = query.filter(price_col <= max_price)
+
+  if sort in PRODUCT_SORTS:
+    query = query.order_by(*PRODUCT_SORTS[sort](price_col))
 
   return query.all()
 
 
+# Keeps IN lists and executemany batches well under SQLite's bound-parameter limit.
+BULK_CHUNK_SIZE = 500
+
+
+def _chunks(items: list, size: int = BULK_CHUNK_SIZE):
+  for start in range(0, len(items), size):
+    yield items[start:start + size]
+
+
+def bulk_update_products_by_filter(
+  db: Session,
+  filters: dict[str, str | None],
+  changes: dict,
+  dry_run: bool = False,
+) -> tuple[int, int]:
+  """Apply one set operation to every product matching `filters` (exact match on
+  category/brand/manufacturer) with a single UPDATE. Returns (matched, updated).
+
+  `changes` holds only the keys being set: `price`, `priceMultiplier` and/or
+  `discount`. `effective_price` is recomputed in the same statement.
+  """
+  clauses = [getattr(ProductDB, field) == value for field, value in filters.items() if value]
+  clauses.append(ProductDB.deleted_at.is_(None))
+  matched = db.query(func.count(ProductDB.id)).filter(*clauses).scalar()
+  if dry_run or not matched:
+    return matched, 0
+
+  price = ProductDB.price
+  if "price" in changes:
+    price = literal(changes["price"])
+  elif "priceMultiplier" in changes:
+    price = func.round(ProductDB.price * changes["priceMultiplier"], 2)
+  discount = literal(changes["discount"]) if "discount" in changes else ProductDB.discount
+
+  values = {
+    "effective_price": func.round(price * (1 - func.coalesce(discount, 0) / 100.0), 2),
+    "change_seq": next_change_seq(db.connection()),
+    "updated_at": change_timestamp(),
+  }
+  if "price" in changes or "priceMultiplier" in changes:
+    values["price"] = price
+  if "discount" in changes:
+    values["discount"] = changes["discount"]
+
+  try:
+    result = db.execute(update(ProductDB).where(*clauses).values(**values).execution_options(synchronize_session=False))
+    db.commit()
+  except Exception:
+    db.rollback()
+    raise
+  return matched, result.rowcount
+
+
+def bulk_update_products_by_id(db: Session, items: list[dict], dry_run: bool = False) -> tuple[int, int, list[str]]:
+  """Apply per-product changes with one executemany UPDATE in a single transaction.
+
+  Each item is `{"id": ..., **changes}` using the same keys as
+  `bulk_update_products_by_filter`; later items for the same ID build on
+  earlier ones. Returns (matched, updated, missing_ids).
+  """
+  ids = list(dict.fromkeys(item["id"] for item in items))
+  current: dict[str, tuple[float, int | None]] = {}
+  for chunk in _chunks(ids):
+    rows = (
+      db.query(ProductDB.id, ProductDB.price, ProductDB.discount)
+      .filter(ProductDB.id.in_(chunk), ProductDB.deleted_at.is_(None))
+      .all()
+    )
+    current.update({product_id: (price, discount) for product_id, price, discount in rows})
+  missing = [product_id for product_id in ids if product_id not in current]
+  if dry_run or not current:
+    return len(current), 0, missing
+
+  for item in items:
+    if item["id"] not in current:
+      continue
+    price, discount = current[item["id"]]
+    if "price" in item:
+      price = item["price"]
+    elif "priceMultiplier" in item:
+      price = round(price * item["priceMultiplier"], 2)
+    if "discount" in item:
+      discount = item["discount"]
+    current[item["id"]] = (price, discount)
+
+  table = ProductDB.__table__
+  statement = (
+    update(table)
+    .where(table.c.id == bindparam("_id"))
+    .values(
+      price=bindparam("_price"),
+      discount=bindparam("_discount"),
+      effective_price=bindparam("_effective_price"),
+      change_seq=bindparam("_change_seq"),
+      updated_at=bindparam("_updated_at"),
+    )
+  )
+  try:
+    seq, now = next_change_seq(db.connection()), change_timestamp()
+    params = [
+      {
+        "_id": product_id,
+        "_price": price,
+        "_discount": discount,
+        "_effective_price": effective_price(price, discount),
+        "_change_seq": seq,
+        "_updated_at": now,
+      }
+      for product_id, (price, discount) in current.items()
+    ]
+    for chunk in _chunks(params):
+      db.execute(statement, chunk)
+    db.commit()
+  except Exception:
+    db.rollback()
+    raise
+  return len(current), len(params), missing
+
+
 def get_categories(db: Session) -> list[str]:
-  categories = db.query(ProductDB.category).distinct().all()
+  categories = db.query(ProductDB.category).filter(ProductDB.deleted_at.is_(None)).distinct().all()
   return sorted([cat[0] for cat in categories if cat[0]])
 
 
 def get_brands(db: Session) -> list[BrandDB]:
-  return db.query(BrandDB).all()
+  return db.query(BrandDB).filter(BrandDB.deleted_at.is_(None)).all()
 
 
 def get_manufacturers(db: Session) -> list[ManufacturerDB]:
-  return db.query(ManufacturerDB).all()
+  return db.query(ManufacturerDB).filter(ManufacturerDB.deleted_at.is_(None)).all()
+
+
+def tombstone(obj: ProductDB | BrandDB | ManufacturerDB) -> None:
+  """Soft-delete a catalog row; the change feed reports it as a deletion."""
+  obj.deleted_at = change_timestamp()
+  if isinstance(obj, (BrandDB, ManufacturerDB)):
+    # Names are unique; free this one so it can be used again.
+    obj.name = f"{obj.name}~deleted~{obj.id}"
+
+
+CHANGE_FEED_LIMIT = 500
+CHANGE_KINDS = {"brand": BrandDB, "manufacturer": ManufacturerDB, "product": ProductDB}
+
 
+def current_change_seq(db: Session) -> int:
+  value = db.query(CatalogSequenceDB.value).filter(CatalogSequenceDB.id == 1).scalar()
+  return value or 0
 
-def create_order(db: Session, order_id: str, date: str, total: float, product_ids: list[tuple[str, int]]) -> OrderDB:
-  """Create an order with products and quantities."""
-  order = OrderDB(id=order_id, date=date, status="Processing", total=total)
+
+def list_changes(
+  db: Session,
+  since: tuple[int, str, str] = (0, "", ""),
+  limit: int = CHANGE_FEED_LIMIT,
+  kinds: tuple[str, ...] = tuple(CHANGE_KINDS),
+) -> tuple[list[tuple[int, str, ProductDB | BrandDB | ManufacturerDB]], bool]:
+  """Catalog rows changed after the cursor `since`, oldest first.
+
+  Rows are ordered by (change_seq, kind, id), which is also the cursor, so
+  pages stay stable when one change touched many rows. Returns the rows as
+  (seq, kind, row) and whether more remain.
+  """
+  seq, after_kind, after_id = since
+  found = []
+  for kind in kinds:
+    model = CHANGE_KINDS[kind]
+    if kind < after_kind:
+      clause = model.change_seq > seq
+    elif kind == after_kind:
+      clause = or_(model.change_seq > seq, (model.change_seq == seq) & (model.id > after_id))
+    else:
+      clause = model.change_seq >= seq
+    rows = db.query(model).filter(clause).order_by(model.change_seq, model.id).limit(limit + 1).all()
+    found.extend((row.change_seq, kind, row) for row in rows)
+  found.sort(key=lambda entry: (entry[0], entry[1], entry[2].id))
+  return found[:limit], len(found) > limit
+
+
+def reserve_stock(db: Session, quantities: dict[str, int]) -> None:
+  """Take stock for every line with one conditional UPDATE each.
+
+  `stock >= :q` is checked and decremented in the same statement, so concurrent
+  checkouts can never both claim the last unit. Lines are applied in ID order
+  to keep lock acquisition consistent across transactions. Products with no
+  tracked stock (NULL) always succeed and stay NULL. On OutOfStockError the
+  lines already taken are put back, so the transaction can carry on.
+  """
+  taken: dict[str, int] = {}
+  for product_id in sorted(quantities):
+    quantity = quantities[product_id]
+    result = db.execute(
+      update(ProductDB)
+      .where(ProductDB.id == product_id, or_(ProductDB.stock.is_(None), ProductDB.stock >= quantity))
+      .values(stock=ProductDB.stock - quantity)
+      .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+      restock(db, taken)
+      raise OutOfStockError(product_id)
+    taken[product_id] = quantity
+
+
+def restock(db: Session, quantities: dict[str, int]) -> None:
+  """Return previously reserved units to stock."""
+  for product_id in sorted(quantities):
+    db.execute(
+      update(ProductDB)
+      .where(ProductDB.id == product_id)
+      .values(stock=ProductDB.stock + quantities[product_id])
+      .execution_options(synchronize_session=False)
+    )
+
+
+def order_quantities(db: Session, order_id: str) -> dict[str, int]:
+  rows = db.query(OrderItemDB.product_id, OrderItemDB.quantity).filter(OrderItemDB.order_id == order_id).all()
+  return {product_id: quantity for product_id, quantity in rows}
+
+
+def normalize_email(email: str | None) -> str | None:
+  """Emails are stored lower-cased so that account lookups match exactly."""
+  return email.strip().lower() if email else None
+
+
+def add_order(
+  db: Session,
+  order_id: str,
+  date: str,
+  total: float,
+  product_ids: list[tuple[str, int]],
+  customer: dict | None = None,
+) -> OrderDB:
+  """Reserve stock and add an order with its items, without committing.
+
+  `customer` holds OrderDB customer/shipping columns known at checkout.
+  OutOfStockError propagates if any line is short; the caller must roll back.
+  """
+  quantities: Counter = Counter()
+  for product_id, quantity in product_ids:
+    quantities[product_id] += quantity
+
+  reserved_until = (datetime.utcnow() + RESERVATION_TTL).strftime(RESERVATION_TIME_FORMAT)
+  reserve_stock(db, quantities)
+  order = OrderDB(id=order_id, date=date, status="Processing", total=total, reserved_until=reserved_until, **(customer or {}))
   db.add(order)
   db.flush()  # Flush to ensure order is created before adding items
 
-  for product_id, quantity in product_ids:
-    product = get_product_by_id(db, product_id)
-    if product:
-      order_item = OrderItemDB(order_id=order_id, product_id=product_id, quantity=quantity)
-      db.add(order_item)
+  for product_id, quantity in quantities.items():
+    db.add(OrderItemDB(order_id=order_id, product_id=product_id, quantity=quantity))
 
-  db.commit()
+  record_order_created(db, date)
+  return order
+
+
+def create_order(
+  db: Session,
+  order_id: str,
+  date: str,
+  total: float,
+  product_ids: list[tuple[str, int]],
+  customer: dict | None = None,
+) -> OrderDB:
+  """Create an order with products and quantities, reserving stock for it.
+
+  Stock reservations and the order rows are written in one transaction; if any
+  line is short the whole order is rolled back and OutOfStockError propagates.
+  """
+  try:
+    order = add_order(db, order_id, date, total, product_ids, customer)
+    db.commit()
+  except Exception:
+    db.rollback()
+    raise
   db.refresh(order)
   return order
 
 
+def find_order_for_payment(db: Session, razorpay_order_id: str | None, receipt: str | None = None) -> OrderDB | None:
+  """Resolve a gateway order to ours, by stored Razorpay order ID or by receipt (our order ID)."""
+  if razorpay_order_id:
+    order = db.query(OrderDB).filter(OrderDB.razorpay_order_id == razorpay_order_id).first()
+    if order:
+      return order
+  if receipt:
+    return db.query(OrderDB).filter(OrderDB.id == receipt).first()
+  return None
+
+
+def mark_order_paid(
+  db: Session,
+  order: OrderDB,
+  razorpay_order_id: str | None,
+  razorpay_payment_id: str | None,
+  razorpay_signature: str | None = None,
+  amount: int | None = None,
+) -> bool:
+  """Record a successful payment on `order` without committing.
+
+  Idempotent: returns False if the payment was already recorded. `amount` is
+  the captured amount in paise, when the caller knows it. If it does not match
+  the order total, or the sweeper already released the reservation and the
+  stock has since sold, the payment is still stored but the order is cancelled
+  with payment status "refund_due" instead of confirmed.
+  """
+  if order.payment_status in CAPTURED_STATUSES:
+    return False
+  quantities = order_quantities(db, order.id)
+  problem = None
+  if amount is not None and abs(amount - order.total * 100) >= 1:
+    problem = f"captured {amount / 100:.2f} for a total of {order.total:.2f}"
+  elif order.payment_status == "expired":
+    try:
+      reserve_stock(db, quantities)
+    except OutOfStockError as e:
+      problem = f"reservation expired: {e}"
+
+  order.razorpay_order_id = razorpay_order_id or order.razorpay_order_id
+  order.razorpay_payment_id = razorpay_payment_id or order.razorpay_payment_id
+  order.razorpay_signature = razorpay_signature or order.razorpay_signature
+  order.reserved_until = None
+  if problem is not None:
+    if order.payment_status in UNPAID_STATUSES:
+      restock(db, quantities)
+    record_status_change(db, order.date, order.payment_status, "refund_due")
+    order.payment_status = "refund_due"
+    order.status = "Cancelled"
+    print(f"Order {order.id} was paid but cannot be fulfilled and needs a refund: {problem}")
+    return True
+
+  record_order_paid(db, order, order.payment_status, quantities)
+  order.payment_status = "paid"
+  order.status = "confirmed"
+  return True
+
+
+def mark_order_payment_failed(db: Session, order: OrderDB, razorpay_order_id: str | None, razorpay_payment_id: str | None) -> bool:
+  """Record a failed payment attempt without committing; paid orders are left alone.
+
+  The reservation is kept so the customer can retry until it lapses.
+  """
+  if order.payment_status != "pending":
+    return False
+  record_status_change(db, order.date, "pending", "failed")
+  order.payment_status = "failed"
+  order.razorpay_order_id = razorpay_order_id or order.razorpay_order_id
+  order.razorpay_payment_id = razorpay_payment_id or order.razorpay_payment_id
+  return True
+
+
+def release_expired_reservations(db: Session, now: datetime | None = None) -> int:
+  """Cancel unpaid (pending or failed) orders whose reservation lapsed and put
+  their stock back.
+
+  Each order is claimed with a conditional UPDATE on `payment_status`, so a
+  payment landing at the same moment (or a second sweeper) wins or loses
+  cleanly and stock is never released twice. Returns the number released.
+  """
+  cutoff = (now or datetime.utcnow()).strftime(RESERVATION_TIME_FORMAT)
+  expired = (
+    db.query(OrderDB.id, OrderDB.date, OrderDB.payment_status)
+    .filter(OrderDB.payment_status.in_(UNPAID_STATUSES), OrderDB.reserved_until < cutoff)
+    .all()
+  )
+  released = 0
+  for order_id, date, payment_status in expired:
+    claimed = db.execute(
+      update(OrderDB)
+      .where(OrderDB.id == order_id, OrderDB.payment_status == payment_status, OrderDB.reserved_until < cutoff)
+      .values(payment_status="expired", status="Cancelled", reserved_until=None)
+      .execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount == 1:
+      restock(db, order_quantities(db, order_id))
+      record_status_change(db, date, payment_status, "expired")
+      record_order_event(db, order_id, "Cancelled", "expired")
+      released += 1
+  db.commit()
+  return released
+
+
 def list_orders(db: Session) -> list[OrderDB]:
   return db.query(OrderDB).all()
+
+
+ACCOUNT_ORDERS_LIMIT = 20
+
+
+def list_customer_orders(
+  db: Session,
+  email: str,
+  limit: int = ACCOUNT_ORDERS_LIMIT,
+  before: tuple[str, str] | None = None,
+) -> tuple[list[OrderDB], bool]:
+  """One customer's orders, newest first, with items and products loaded.
+
+  Pages are keyed on (date, id) and `before` is the last row of the previous
+  page, so each page is a range scan of ix_orders_customer_email_date_id.
+  Returns the orders and whether more remain.
+  """
+  query = db.query(OrderDB).filter(OrderDB.customer_email == normalize_email(email))
+  if before is not None:
+    date, order_id = before
+    query = query.filter(tuple_(OrderDB.date, OrderDB.id) < (date, order_id))
+  orders = (
+    query.options(selectinload(OrderDB.order_items).selectinload(OrderItemDB.product))
+    .order_by(OrderDB.date.desc(), OrderDB.id.desc())
+    .limit(limit + 1)
+    .all()
+  )
+  return orders[:limit], len(orders) > limit
@@ -1,17 +1,45 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./gtr_motors.db")
+# How long a SQLite connection waits for another writer before "database is locked".
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+  # WAL lets readers in every worker carry on while one connection writes;
+  # writers still take turns, each waiting up to the busy timeout for the lock.
+  dbapi_connection.execute("PRAGMA journal_mode=WAL")
+  dbapi_connection.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+
 
 engine = create_engine(
   DATABASE_URL,
   connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
 )
 
+if "sqlite" in DATABASE_URL:
+  event.listen(engine, "connect", _sqlite_pragmas)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Inbound event queue (payment webhooks). Kept in its own database so that
+# accepting an event never waits on, or holds, the catalog/order write lock.
+QUEUE_DATABASE_URL = os.getenv("QUEUE_DATABASE_URL", "sqlite:///./gtr_queue.db")
+
+queue_engine = create_engine(
+  QUEUE_DATABASE_URL,
+  connect_args={"check_same_thread": False} if "sqlite" in QUEUE_DATABASE_URL else {}
+)
+
+if "sqlite" in QUEUE_DATABASE_URL:
+  event.listen(queue_engine, "connect", _sqlite_pragmas)
+
+QueueSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=queue_engine)
+QueueBase = declarative_base()
+
 
 def get_db():
   db = SessionLocal()
@@ -19,3 +47,28 @@ def get_db():
     yield db
   finally:
     db.close()
+
+
+def upgrade_schema(bind=engine, metadata=None) -> None:
+  """Add columns and indexes that were introduced after a database was created.
+
+  `create_all` only creates missing tables, so existing databases (including the
+  bundled gtr_motors.db) get new nullable columns and indexes added in place.
+  `metadata` defaults to the order database's; pass `QueueBase.metadata` with
+  `queue_engine` for the queue database.
+  """
+  metadata = metadata if metadata is not None else Base.metadata
+  inspector = inspect(bind)
+  with bind.begin() as conn:
+    for table in metadata.sorted_tables:
+      if not inspector.has_table(table.name):
+        continue
+      existing = {c["name"] for c in inspector.get_columns(table.name)}
+      for column in table.columns:
+        if column.name not in existing:
+          col_type = column.type.compile(dialect=bind.dialect)
+          conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {col_type}'))
+      indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+      for index in table.indexes:
+        if index.name not in indexes:
+          index.create(bind=conn)
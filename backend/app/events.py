@@ -0,0 +1,265 @@
+"""Live order status events for the server-sent event streams.
+
+Order changes are captured from the ORM session: every committed flush that
+creates an order or changes its `status`/`payment_status` publishes one event
+after the commit, so order creation, `/payments/verify`, webhook batches and
+reconciliation all publish without extra calls. Bulk SQL updates that bypass
+the ORM (the reservation sweeper) call `record_order_event` instead.
+
+Events go through a broker to the in-process `EventHub`, which fans them out
+to subscribed streams. `LocalBroker` delivers directly and is enough for a
+single worker; `SQLiteBroker` appends events to the queue database and every
+worker tails it, so a payment applied in one worker reaches streams held by
+the others. Select it with EVENT_BROKER=sqlite.
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from .database import QueueSessionLocal
+from .models import OrderDB, OrderEventDB
+
+EVENT_BROKER = os.getenv("EVENT_BROKER", "local")
+EVENT_POLL_SECONDS = float(os.getenv("EVENT_POLL_SECONDS", "0.2"))
+EVENT_RETENTION = timedelta(minutes=10)
+# Events buffered per stream before a slow client is dropped.
+SUBSCRIBER_QUEUE_SIZE = 100
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def order_event(order_id: str, status: str, payment_status: str | None, kind: str = "updated") -> dict:
+  return {
+    "type": kind,
+    "orderId": order_id,
+    "status": status,
+    "paymentStatus": payment_status,
+    "at": datetime.utcnow().strftime(TIME_FORMAT),
+  }
+
+
+class Subscription:
+  """One stream's view of the hub: an asyncio queue fed from any thread."""
+
+  def __init__(self, hub: "EventHub", order_id: str | None):
+    self.hub = hub
+    self.order_id = order_id
+    self.loop = asyncio.get_running_loop()
+    self.queue: asyncio.Queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+    self.overflowed = False
+
+  def _put(self, item: tuple[int, dict]) -> None:
+    try:
+      self.queue.put_nowait(item)
+    except asyncio.QueueFull:
+      self.overflowed = True
+      self.hub.unsubscribe(self)
+
+  async def get(self, timeout: float) -> tuple[int, dict] | None:
+    try:
+      return await asyncio.wait_for(self.queue.get(), timeout)
+    except asyncio.TimeoutError:
+      return None
+
+  def close(self) -> None:
+    self.hub.unsubscribe(self)
+
+
+class EventHub:
+  """Thread-safe fan-out of order events to the streams of this process.
+
+  A subscription for an order ID receives that order's events; a
+  subscription for None receives every event (the admin stream).
+  """
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self._subscribers: dict[str | None, set[Subscription]] = {}
+    self._ids = itertools.count(1)
+    self.delivered = 0
+
+  def subscribe(self, order_id: str | None = None) -> Subscription:
+    subscription = Subscription(self, order_id)
+    with self._lock:
+      self._subscribers.setdefault(order_id, set()).add(subscription)
+    return subscription
+
+  def unsubscribe(self, subscription: Subscription) -> None:
+    with self._lock:
+      subscribers = self._subscribers.get(subscription.order_id)
+      if subscribers is not None:
+        subscribers.discard(subscription)
+        if not subscribers:
+          del self._subscribers[subscription.order_id]
+
+  def deliver(self, payload: dict, event_id: int | None = None) -> None:
+    event_id = event_id if event_id is not None else next(self._ids)
+    with self._lock:
+      targets = [*self._subscribers.get(payload["orderId"], ()), *self._subscribers.get(None, ())]
+    for subscription in targets:
+      subscription.loop.call_soon_threadsafe(subscription._put, (event_id, payload))
+    self.delivered += len(targets)
+
+  def stats(self) -> dict:
+    with self._lock:
+      streams = sum(len(s) for s in self._subscribers.values())
+    return {"streams": streams, "delivered": self.delivered, "broker": type(broker).__name__}
+
+
+class LocalBroker:
+  """Delivers events to this process's hub only."""
+
+  def __init__(self, hub: EventHub):
+    self.hub = hub
+
+  def publish(self, payloads: list[dict]) -> None:
+    for payload in payloads:
+      self.hub.deliver(payload)
+
+  async def run(self) -> None:
+    return None
+
+
+class SQLiteBroker:
+  """Shares events between workers through the `order_events` queue table.
+
+  Publishing appends rows; each worker's `run` loop tails the table by ID and
+  hands new rows to its local hub, and trims rows older than EVENT_RETENTION.
+  """
+
+  def __init__(self, hub: EventHub, poll_seconds: float = EVENT_POLL_SECONDS):
+    self.hub = hub
+    self.poll_seconds = poll_seconds
+    self.last_id: int | None = None
+
+  def publish(self, payloads: list[dict]) -> None:
+    db = QueueSessionLocal()
+    try:
+      db.add_all(
+        OrderEventDB(order_id=p["orderId"], payload=json.dumps(p), created_at=p["at"])
+        for p in payloads
+      )
+      db.commit()
+    finally:
+      db.close()
+
+  def _poll(self) -> int:
+    db = QueueSessionLocal()
+    try:
+      if self.last_id is None:
+        self.last_id = db.execute(select(func.coalesce(func.max(OrderEventDB.id), 0))).scalar_one()
+        return 0
+      rows = db.execute(
+        select(OrderEventDB.id, OrderEventDB.payload)
+        .where(OrderEventDB.id > self.last_id)
+        .order_by(OrderEventDB.id)
+      ).all()
+      for event_id, payload in rows:
+        self.hub.deliver(json.loads(payload), event_id)
+        self.last_id = event_id
+      return len(rows)
+    finally:
+      db.close()
+
+  def _trim(self) -> None:
+    db = QueueSessionLocal()
+    try:
+      cutoff = (datetime.utcnow() - EVENT_RETENTION).strftime(TIME_FORMAT)
+      db.execute(delete(OrderEventDB).where(OrderEventDB.created_at < cutoff))
+      db.commit()
+    finally:
+      db.close()
+
+  async def run(self) -> None:
+    loop = asyncio.get_running_loop()
+    polls = 0
+    while True:
+      try:
+        await loop.run_in_executor(None, self._poll)
+        polls += 1
+        if polls % 300 == 0:
+          await loop.run_in_executor(None, self._trim)
+      except Exception as e:
+        print(f"Order event poll failed: {e}")
+      await asyncio.sleep(self.poll_seconds)
+
+
+BROKERS = {"local": LocalBroker, "sqlite": SQLiteBroker}
+
+hub = EventHub()
+broker = BROKERS[EVENT_BROKER](hub)
+
+
+def publish(payloads: list[dict]) -> None:
+  if not payloads:
+    return
+  try:
+    broker.publish(payloads)
+  except Exception as e:
+    # The order change is already committed; a lost event only delays the UI.
+    print(f"Publishing order events failed: {e}")
+
+
+def record_order_event(db: Session, order_id: str, status: str, payment_status: str | None) -> None:
+  """Publish an order change made with SQL rather than the ORM once `db` commits."""
+  db.info.setdefault("order_events", []).append(order_event(order_id, status, payment_status))
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_order_events(session: Session, flush_context) -> None:
+  pending = session.info.setdefault("order_events", [])
+  for obj in session.new:
+    if isinstance(obj, OrderDB):
+      pending.append(order_event(obj.id, obj.status, obj.payment_status, kind="created"))
+  for obj in session.dirty:
+    if not isinstance(obj, OrderDB):
+      continue
+    attrs = inspect(obj).attrs
+    if attrs.status.history.has_changes() or attrs.payment_status.history.has_changes():
+      pending.append(order_event(obj.id, obj.status, obj.payment_status))
+
+
+# Savepoints fire after_commit/after_rollback too, so events are published
+# only when the outermost transaction commits. Each savepoint remembers how
+# many events were pending when it began; rolling it back drops only the
+# events collected inside it.
+@event.listens_for(Session, "after_transaction_create")
+def _mark_savepoint(session: Session, transaction) -> None:
+  if transaction.nested:
+    session.info.setdefault("order_event_marks", []).append(len(session.info.get("order_events", ())))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_order_events(session: Session) -> None:
+  if session.in_nested_transaction():
+    return
+  publish(session.info.pop("order_events", []))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_order_events(session: Session) -> None:
+  if not session.in_nested_transaction():
+    session.info.pop("order_events", None)
+    return
+  marks = session.info.get("order_event_marks")
+  if marks:
+    del session.info.get("order_events", [])[marks[-1]:]
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _end_transaction(session: Session, transaction) -> None:
+  if transaction.nested:
+    marks = session.info.get("order_event_marks")
+    if marks:
+      marks.pop()
+  elif transaction.parent is None:
+    # Whatever is still pending was never committed (rollback or close).
+    session.info.pop("order_events", None)
+    session.info.pop("order_event_marks", None)
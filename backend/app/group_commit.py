@@ -0,0 +1,240 @@
+"""Group commit: order writes from concurrent requests share one transaction.
+
+On SQLite every commit takes the database write lock and syncs the journal to
+disk, so one commit per checkout caps order throughput at the disk's sync rate.
+With GROUP_COMMIT=1, order creation and payment verification hand their writes
+to a single writer thread instead. It collects the operations that arrive
+within GROUP_COMMIT_WINDOW_MS (up to GROUP_COMMIT_MAX_BATCH), applies them in
+one session and commits once; each caller then gets its own result.
+
+Operations are functions of a session that must not commit. Each one runs in
+a savepoint, so an operation that raises (for example out of stock, common in
+the flash sales this is for) is rolled back alone and only fails its own
+caller; the rest of the batch still commits once. Only if that commit itself
+fails are the successful operations replayed in transactions of their own.
+
+Measure the effect against a scratch database:
+
+    DATABASE_URL=sqlite:///./bench.db python -m app.group_commit bench --orders 2000 --threads 32
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable
+
+from sqlalchemy.orm import Session
+
+from .database import Base, SessionLocal, engine
+from .crud import add_order, create_order, init_db
+from .models import ProductDB
+
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64"))
+
+
+class GroupCommitter:
+  """A writer thread that applies submitted operations in shared transactions."""
+
+  def __init__(
+    self,
+    session_factory=SessionLocal,
+    window: float = GROUP_COMMIT_WINDOW_MS / 1000,
+    max_batch: int = GROUP_COMMIT_MAX_BATCH,
+  ):
+    self.session_factory = session_factory
+    self.window = window
+    self.max_batch = max_batch
+    self._queue: queue.Queue = queue.Queue()
+    self._thread: threading.Thread | None = None
+    self._lock = threading.Lock()
+    self.batches = 0
+    self.operations = 0
+    self.replayed = 0
+
+  def submit(self, operation: Callable[[Session], Any]) -> Any:
+    """Run `operation(session)` in the next batch; blocks until it is committed.
+
+    Returns the operation's result or raises its exception. ORM objects in the
+    result are detached but keep their loaded attributes.
+    """
+    future: Future = Future()
+    self._ensure_started()
+    self._queue.put((operation, future))
+    return future.result()
+
+  def _ensure_started(self) -> None:
+    # Started on first use, so preforked servers get one writer per worker.
+    if self._thread is not None and self._thread.is_alive():
+      return
+    with self._lock:
+      if self._thread is None or not self._thread.is_alive():
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+  def stop(self) -> None:
+    if self._thread is not None and self._thread.is_alive():
+      self._queue.put(None)
+      self._thread.join()
+
+  def _run(self) -> None:
+    while True:
+      item = self._queue.get()
+      if item is None:
+        return
+      batch = [item]
+      deadline = time.monotonic() + self.window
+      stopping = False
+      while len(batch) < self.max_batch:
+        try:
+          item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+          break
+        if item is None:
+          stopping = True
+          break
+        batch.append(item)
+      try:
+        self._apply(batch)
+      except BaseException as e:  # never leave a caller waiting
+        for _, future in batch:
+          if not future.done():
+            future.set_exception(e)
+      if stopping:
+        return
+
+  def _apply(self, batch: list[tuple[Callable[[Session], Any], Future]]) -> None:
+    self.batches += 1
+    self.operations += len(batch)
+    if len(batch) == 1:
+      self._apply_one(*batch[0])
+      return
+    db = self.session_factory(expire_on_commit=False)
+    applied, failed = [], []
+    try:
+      _begin(db)
+      for operation, future in batch:
+        savepoint = db.begin_nested()
+        try:
+          result = operation(db)
+          savepoint.commit()
+        except Exception as e:
+          savepoint.rollback()
+          failed.append((future, e))
+        else:
+          applied.append((operation, future, result))
+      db.commit()
+    except Exception:
+      db.rollback()
+      committed = False
+    else:
+      committed = True
+    finally:
+      db.close()
+
+    for future, error in failed:
+      future.set_exception(error)
+    if not committed:
+      self.replayed += 1
+      for operation, future, _ in applied:
+        self._apply_one(operation, future)
+      return
+    for _, future, result in applied:
+      future.set_result(result)
+
+  def _apply_one(self, operation: Callable[[Session], Any], future: Future) -> None:
+    db = self.session_factory(expire_on_commit=False)
+    try:
+      result = operation(db)
+      db.commit()
+    except Exception as e:
+      db.rollback()
+      future.set_exception(e)
+    else:
+      future.set_result(result)
+    finally:
+      db.close()
+
+  def stats(self) -> dict:
+    return {
+      "enabled": GROUP_COMMIT,
+      "batches": self.batches,
+      "operations": self.operations,
+      "replayedBatches": self.replayed,
+      "averageBatch": round(self.operations / self.batches, 2) if self.batches else 0,
+    }
+
+
+def _begin(db: Session) -> None:
+  # pysqlite only opens a transaction before DML, so the first SAVEPOINT would
+  # start one itself and releasing it would commit. Open the transaction first.
+  if db.get_bind().dialect.name == "sqlite":
+    db.connection().exec_driver_sql("BEGIN")
+
+
+order_writer = GroupCommitter()
+
+
+def benchmark(orders: int, threads: int) -> dict:
+  """Orders per second placed by `threads` threads, with and without group commit."""
+  Base.metadata.create_all(bind=engine)
+  db = SessionLocal()
+  try:
+    init_db(db)
+    # Untracked stock, so the benchmark never runs out.
+    product_ids = [
+      product_id
+      for (product_id,) in db.query(ProductDB.id).filter(ProductDB.stock.is_(None), ProductDB.deleted_at.is_(None)).limit(3)
+    ]
+  finally:
+    db.close()
+  lines = [(product_id, 1) for product_id in product_ids]
+  date = datetime.utcnow().strftime("%Y-%m-%d")
+  committer = GroupCommitter()
+
+  def place(grouped: bool) -> None:
+    order_id = f"BENCH-{uuid.uuid4().hex}"
+    if grouped:
+      committer.submit(lambda session: add_order(session, order_id, date, 1.0, lines))
+      return
+    session = SessionLocal()
+    try:
+      create_order(session, order_id, date, 1.0, lines)
+    finally:
+      session.close()
+
+  results = {}
+  for grouped in (False, True):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+      for future in [pool.submit(place, grouped) for _ in range(orders)]:
+        future.result()
+    elapsed = time.perf_counter() - started
+    results["groupCommit" if grouped else "perRequestCommit"] = {
+      "seconds": round(elapsed, 2),
+      "ordersPerSecond": round(orders / elapsed, 1),
+    }
+  committer.stop()
+  results["groupCommit"]["averageBatch"] = committer.stats()["averageBatch"]
+  return results
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Group commit for order writes.")
+  commands = parser.add_subparsers(dest="command", required=True)
+  bench = commands.add_parser("bench", help="compare order throughput with and without group commit")
+  bench.add_argument("--orders", type=int, default=2000, help="orders to place in each run")
+  bench.add_argument("--threads", type=int, default=32, help="concurrent callers")
+  args = parser.parse_args()
+  print(json.dumps(benchmark(args.orders, args.threads), indent=2))
+
+
+if __name__ == "__main__":
+  main()
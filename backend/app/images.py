@@ -0,0 +1,321 @@
+"""Resized image variants for product images and brand logos.
+
+`GET /images/{key}?w=&h=&fmt=` serves a resized copy of a catalog image. The
+key is a hash of the original URL (`image_key`), and only URLs that appear in
+the catalog resolve, so the endpoint cannot be used to fetch arbitrary URLs.
+Originals come from a pluggable source: `HTTPImageSource` downloads them,
+`LocalImageSource` reads files from a directory (IMAGE_SOURCE=local, for
+tests and offline development). Resizing runs in a process pool so the event
+loop and the request threads stay free. Originals and variants are stored in
+a size-bounded disk cache evicted least-recently-used first, and variants are
+served with immutable cache headers: a changed image URL gets a new key.
+
+Resizing needs the optional Pillow package; without it the endpoint answers
+501.
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+import threading
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+from fastapi.concurrency import run_in_threadpool
+
+from .cache import catalog_version
+from .coalesce import SingleFlight
+from .database import SessionLocal
+from .models import BrandDB, ProductDB
+
+try:
+  from PIL import Image, ImageOps
+except ImportError:  # optional dependency
+  Image = None
+
+IMAGE_SOURCE = os.getenv("IMAGE_SOURCE", "http")
+IMAGE_DIR = os.getenv("IMAGE_DIR", "./images")
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "./image_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# Prefix for variant URLs in API responses, e.g. "https://api.example.com".
+IMAGE_BASE_URL = os.getenv("IMAGE_BASE_URL", "")
+MAX_ORIGINAL_BYTES = 20 * 1024 * 1024
+
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png")}
+
+# Widths emitted in product and brand responses.
+PRODUCT_VARIANTS = {"thumb": 200, "card": 400, "large": 1080}
+LOGO_VARIANTS = {"small": 96, "large": 256}
+# The only sizes rendered: any other requested size is rounded up to one of
+# these, so the variants per image (and the disk cache) stay bounded.
+VARIANT_SIZES = sorted({*PRODUCT_VARIANTS.values(), *LOGO_VARIANTS.values()})
+
+
+class ImageNotFoundError(Exception):
+  pass
+
+
+class ImageSourceError(Exception):
+  pass
+
+
+class ResizingUnavailableError(Exception):
+  pass
+
+
+def image_key(url: str) -> str:
+  return hashlib.sha256(url.encode()).hexdigest()[:16]
+
+
+def variant_urls(url: str | None, widths: dict[str, int], fmt: str = "webp") -> dict[str, str]:
+  if not url:
+    return {}
+  key = image_key(url)
+  return {name: f"{IMAGE_BASE_URL}/images/{key}?w={width}&fmt={fmt}" for name, width in widths.items()}
+
+
+def check_public_url(url: str) -> None:
+  """Raise ImageSourceError unless `url` is http(s) on a publicly routable host.
+
+  Catalog URLs can be set by whoever edits products, so they must not reach
+  local files or services on the internal network.
+  """
+  parsed = urlparse(url)
+  if parsed.scheme not in ("http", "https") or not parsed.hostname:
+    raise ImageSourceError(f"Refusing to fetch {url}: only http and https URLs are allowed")
+  try:
+    addresses = socket.getaddrinfo(parsed.hostname, parsed.port or parsed.scheme, type=socket.SOCK_STREAM)
+  except (socket.gaierror, ValueError) as e:
+    raise ImageSourceError(f"Fetching {url} failed: {e}")
+  for *_, sockaddr in addresses:
+    if not ipaddress.ip_address(sockaddr[0].split("%")[0]).is_global:
+      raise ImageSourceError(f"Refusing to fetch {url}: {parsed.hostname} is not a public address")
+
+
+class _CheckedRedirects(urllib.request.HTTPRedirectHandler):
+  def redirect_request(self, req, fp, code, msg, headers, newurl):
+    check_public_url(newurl)
+    return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def _http_opener() -> urllib.request.OpenerDirector:
+  # Only HTTP(S) handlers: unlike build_opener(), no file:// or ftp:// support.
+  opener = urllib.request.OpenerDirector()
+  for handler in (
+    urllib.request.HTTPHandler(),
+    urllib.request.HTTPSHandler(),
+    _CheckedRedirects(),
+    urllib.request.HTTPDefaultErrorHandler(),
+    urllib.request.HTTPErrorProcessor(),
+  ):
+    opener.add_handler(handler)
+  return opener
+
+
+class HTTPImageSource:
+  """Downloads originals from their catalog URL, public http(s) hosts only."""
+
+  def __init__(self, timeout: float = 10.0):
+    self.timeout = timeout
+    self.opener = _http_opener()
+
+  def fetch(self, key: str, url: str) -> bytes:
+    check_public_url(url)
+    try:
+      with self.opener.open(url, timeout=self.timeout) as response:
+        data = response.read(MAX_ORIGINAL_BYTES + 1)
+    except ImageSourceError:
+      raise
+    except Exception as e:
+      raise ImageSourceError(f"Fetching {url} failed: {e}")
+    if len(data) > MAX_ORIGINAL_BYTES:
+      raise ImageSourceError(f"{url} is larger than {MAX_ORIGINAL_BYTES} bytes")
+    return data
+
+
+class LocalImageSource:
+  """Reads originals from a directory, as `<key>` or as the URL's file name."""
+
+  def __init__(self, directory: str):
+    self.directory = directory
+
+  def fetch(self, key: str, url: str) -> bytes:
+    for name in (key, os.path.basename(urlparse(url).path)):
+      path = os.path.join(self.directory, name)
+      if name and os.path.isfile(path):
+        with open(path, "rb") as f:
+          return f.read()
+    raise ImageNotFoundError(key)
+
+
+class DiskCache:
+  """Files under `directory`, evicted oldest-access first above `max_bytes`.
+
+  Hits refresh the file's mtime, which is the recency used for eviction.
+  """
+
+  def __init__(self, directory: str, max_bytes: int):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self._lock = threading.Lock()
+    self._size: int | None = None  # measured on the first write
+
+  def get(self, name: str) -> bytes | None:
+    path = os.path.join(self.directory, name)
+    try:
+      with open(path, "rb") as f:
+        data = f.read()
+      os.utime(path)
+      return data
+    except FileNotFoundError:
+      return None
+
+  def put(self, name: str, data: bytes) -> None:
+    os.makedirs(self.directory, exist_ok=True)
+    path = os.path.join(self.directory, name)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+      f.write(data)
+    os.replace(tmp, path)
+    with self._lock:
+      if self._size is None:
+        self._size = sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file())
+      else:
+        self._size += len(data)
+      if self._size > self.max_bytes:
+        self._evict()
+
+  def _evict(self) -> None:
+    entries = sorted(
+      (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+      for entry in os.scandir(self.directory)
+      if entry.is_file() and not entry.name.endswith(".tmp")
+    )
+    size = sum(entry[1] for entry in entries)
+    target = self.max_bytes * 0.9
+    for _, entry_size, path in entries:
+      if size <= target:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      size -= entry_size
+    self._size = size
+
+
+def render_variant(original: bytes, width: int | None, height: int | None, fmt: str) -> bytes:
+  """Resize `original` to fit (or, given both sides, cover) width x height."""
+  image = Image.open(io.BytesIO(original))
+  image = ImageOps.exif_transpose(image)
+  if width and height:
+    image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+  elif width or height:
+    image.thumbnail((width or image.width, height or image.height), Image.LANCZOS)
+  pil_format = FORMATS[fmt][0]
+  if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+    image = image.convert("RGB")
+  out = io.BytesIO()
+  image.save(out, pil_format, quality=80, optimize=pil_format != "WEBP")
+  return out.getvalue()
+
+
+SOURCES = {"http": lambda: HTTPImageSource(), "local": lambda: LocalImageSource(IMAGE_DIR)}
+
+source = SOURCES[IMAGE_SOURCE]()
+cache = DiskCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+image_flights = SingleFlight()
+
+_pool: ProcessPoolExecutor | None = None
+_key_index: tuple[int, dict[str, str]] = (-1, {})
+_key_index_lock = threading.Lock()
+
+
+def _process_pool() -> ProcessPoolExecutor:
+  # Created on first use, so preforked servers start it in each worker.
+  global _pool
+  if _pool is None:
+    _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+  return _pool
+
+
+def shutdown() -> None:
+  if _pool is not None:
+    _pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _image_index() -> dict[str, str]:
+  """Key -> URL of every catalog image, rebuilt only when the catalog version changes.
+
+  Every catalog edit bumps the version, so a key missing from the current
+  index is answered without touching the database: unknown keys cost a dict
+  lookup, not a scan of the product and brand tables.
+  """
+  global _key_index
+  version = catalog_version()
+  if _key_index[0] == version:
+    return _key_index[1]
+  with _key_index_lock:
+    if _key_index[0] != version:
+      db = SessionLocal()
+      try:
+        urls = [u for (u,) in db.query(ProductDB.imageUrl)] + [u for (u,) in db.query(BrandDB.logoUrl)]
+      finally:
+        db.close()
+      _key_index = (version, {image_key(url): url for url in urls if url})
+    return _key_index[1]
+
+
+def resolve_key(key: str) -> str:
+  """The catalog image URL with this key, including deleted products' images."""
+  url = _image_index().get(key)
+  if url is None:
+    raise ImageNotFoundError(key)
+  return url
+
+
+def snap_size(size: int | None) -> int | None:
+  """The smallest advertised size at least `size`, or the largest one."""
+  if size is None:
+    return None
+  return next((s for s in VARIANT_SIZES if s >= size), VARIANT_SIZES[-1])
+
+
+def variant_name(key: str, width: int | None, height: int | None, fmt: str) -> str:
+  return f"{key}-{width or 0}x{height or 0}.{fmt}"
+
+
+def _original(key: str) -> bytes:
+  name = f"{key}.orig"
+  data = cache.get(name)
+  if data is None:
+    data = source.fetch(key, resolve_key(key))
+    cache.put(name, data)
+  return data
+
+
+async def _render(key: str, width: int | None, height: int | None, fmt: str) -> bytes:
+  original = await run_in_threadpool(_original, key)
+  loop = asyncio.get_running_loop()
+  try:
+    data = await loop.run_in_executor(_process_pool(), render_variant, original, width, height, fmt)
+  except (OSError, ValueError, Image.DecompressionBombError) as e:  # includes PIL.UnidentifiedImageError
+    raise ImageSourceError(f"Image {key} could not be decoded: {e}")
+  await run_in_threadpool(cache.put, variant_name(key, width, height, fmt), data)
+  return data
+
+
+async def get_variant(key: str, width: int | None, height: int | None, fmt: str) -> bytes:
+  """Encoded variant bytes, from the disk cache or rendered once per key."""
+  if Image is None:
+    raise ResizingUnavailableError("Image resizing requires Pillow")
+  name = variant_name(key, width, height, fmt)
+  data = await run_in_threadpool(cache.get, name)
+  if data is None:
+    data = await image_flights.do_async(name, lambda: _render(key, width, height, fmt))
+  return data
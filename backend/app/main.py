@@ -2,36 +2,99 @@
 
 
 from __future__ import annotations
-from datetime import datetime
-from typing import List, Optional
-
-from fastapi import FastAPI, HTTPException, Query, Depends
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Literal, Optional
+
+from fastapi import FastAPI, HTTPException, Header, Path, Query, Depends, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import EmailStr, TypeAdapter
+from pydantic_core import to_json
 from sqlalchemy.orm import Session
 
-from .database import engine, get_db, Base
-from .crud import init_db, list_products, get_product_by_id, get_categories, get_brands, get_manufacturers, create_order, list_orders
+from .database import engine, get_db, Base, SessionLocal, upgrade_schema, queue_engine, QueueBase
+from .crud import init_db, list_products, get_product_by_id, get_products_by_ids, get_categories, get_brands, get_manufacturers, create_order, list_orders
+from .crud import bulk_update_products_by_filter, bulk_update_products_by_id, PRODUCT_SORTS
+from .crud import OutOfStockError, mark_order_paid, release_expired_reservations, order_quantities, add_order
+from .crud import normalize_email, list_customer_orders, ACCOUNT_ORDERS_LIMIT, resolve_product_id, get_stock_levels
+from .crud import tombstone, list_changes, current_change_seq, CHANGE_FEED_LIMIT
 from .schemas import (
   Product,
+  product_from_db,
+  product_fields_from_db,
+  PRODUCT_FIELD_COLUMNS,
+  PRODUCT_VIEWS,
   Brand,
   Order,
   OrderCreateRequest,
   OrderCreateResponse,
+  AccountOrdersResponse,
+  ShippingQuoteResponse,
   ProductsResponse,
+  ProductBatchRequest,
+  ProductBatchResponse,
+  PRODUCT_BATCH_LIMIT,
   RazorpayOrderRequest,
   RazorpayOrderResponse,
   PaymentVerificationRequest,
+  CartQuoteRequest,
+  CartQuoteResponse,
+  BulkProductUpdateRequest,
+  BulkProductUpdateResponse,
+  CatalogChange,
+  ChangesResponse,
 )
 from .schemas import BrandCreateRequest, ProductCreateRequest
 from .schemas import ManufacturerCreateRequest
 from .models import ProductDB, BrandDB, OrderDB, ManufacturerDB
-from .razorpay_utils import create_razorpay_order, verify_payment_signature, RAZORPAY_KEY_ID
+from .razorpay_utils import create_razorpay_order, verify_payment_signature, verify_webhook_signature, RAZORPAY_KEY_ID
+from .similarity import similar_index
+from .cache import bump_catalog_version, catalog_version
+from .pricing import UnknownProductError, price_cart, quote_cart
+from .webhooks import enqueue_event as enqueue_webhook_event, process_batch as process_webhook_batch
+from .reconcile import reconcile_pending_orders
+from .coalesce import catalog_flights
+from .compression import CompressionMiddleware, compressed_response
+from .events import broker as event_broker, hub as event_hub
+from .stats import check_database, sales_summary
+from .archive import find_archived_order
+from .profiling import ProfilingMiddleware, install_slow_query_log, profiles, slow_queries, token_is_valid
+from .admission import ADMISSION_CONTROL, AdmissionMiddleware, admission_state
+from . import images
+from .group_commit import GROUP_COMMIT, order_writer
+from .shipping import SHIPPING_FREE_ABOVE, InvalidPinError, pin_table, quote_shipping
 
 app = FastAPI(title="GTR Motors API", version="0.1.0")
 
 # Create tables on startup
+check_database(engine)
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
+QueueBase.metadata.create_all(bind=queue_engine)
+upgrade_schema(queue_engine, QueueBase.metadata)
+install_slow_query_log(engine)
+
+RESERVATION_SWEEP_SECONDS = float(os.getenv("RESERVATION_SWEEP_SECONDS", "60"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "1"))
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("RECONCILE_INTERVAL_SECONDS", "0"))  # 0 disables
+
+# Set whenever a webhook is queued so idle workers pick it up without waiting a poll interval.
+webhook_wakeup = asyncio.Event()
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
 
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_BYTES)
+if ADMISSION_CONTROL:
+  app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
   CORSMiddleware,
   allow_origins=["*"],
@@ -39,25 +102,186 @@ app.add_middleware(
   allow_methods=["*"],
   allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware)
+
+
+_similar_index_state = {"version": None, "seq": 0}
+_similar_index_lock = threading.Lock()
+
+
+def prepare_app() -> None:
+  """Seed the database and build in-memory indexes.
+
+  Runs at startup, or once in the master process before workers are forked
+  (see gunicorn.conf.py), in which case workers inherit the built index.
+  """
+  if _similar_index_state["version"] is not None:
+    return
+  db = SessionLocal()
+  try:
+    init_db(db)
+    _similar_index_state["seq"] = current_change_seq(db)
+    # Only the indexed columns: loading 100k full ORM rows costs more than the build.
+    similar_index.build(
+      db.query(ProductDB.id, ProductDB.name, ProductDB.category, ProductDB.description)
+      .filter(ProductDB.deleted_at.is_(None))
+    )
+    _similar_index_state["version"] = catalog_version()
+  finally:
+    db.close()
+  pin_table()
+
+
+def sync_similar_index(db: Session) -> None:
+  """Apply product changes made since the index was last synced, possibly by
+  another worker; a no-op while the catalog version is unchanged."""
+  version = catalog_version()
+  if _similar_index_state["version"] == version:
+    return
+  with _similar_index_lock:
+    if _similar_index_state["version"] == version:
+      return
+    cursor, has_more = (_similar_index_state["seq"], "~", ""), True
+    while has_more:
+      rows, has_more = list_changes(db, cursor, kinds=("product",))
+      for seq, kind, product in rows:
+        if product.deleted_at:
+          similar_index.remove(product.id)
+        else:
+          similar_index.upsert(product)
+        cursor = (seq, kind, product.id)
+    _similar_index_state["seq"] = max(_similar_index_state["seq"], cursor[0])
+    _similar_index_state["version"] = version
 
 
 @app.on_event("startup")
 def startup_event():
   """Initialize database with seed data on startup."""
-  db = next(get_db())
+  prepare_app()
+
+
+def sweep_expired_reservations() -> int:
+  db = SessionLocal()
   try:
-    init_db(db)
+    return release_expired_reservations(db)
   finally:
     db.close()
 
 
+async def reservation_sweeper() -> None:
+  """Periodically return stock held by orders that were never paid."""
+  while True:
+    try:
+      await run_in_threadpool(sweep_expired_reservations)
+    except Exception as e:
+      print(f"Reservation sweep failed: {e}")
+    await asyncio.sleep(RESERVATION_SWEEP_SECONDS)
+
+
+async def webhook_worker(worker_id: str) -> None:
+  """Apply queued payment webhook events in batches.
+
+  Keeps claiming while batches complete events; a batch whose events were all
+  put back for a later retry waits for the next poll instead.
+  """
+  while True:
+    try:
+      completed = await run_in_threadpool(process_webhook_batch, worker_id)
+    except Exception as e:
+      print(f"Webhook batch failed: {e}")
+      completed = 0
+    if completed:
+      continue
+    webhook_wakeup.clear()
+    try:
+      await asyncio.wait_for(webhook_wakeup.wait(), WEBHOOK_POLL_SECONDS)
+    except asyncio.TimeoutError:
+      pass
+
+
+async def payment_reconciler() -> None:
+  """Periodically repair unpaid orders whose payment confirmation was lost."""
+  while True:
+    await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+    try:
+      stats = await run_in_threadpool(reconcile_pending_orders)
+      print(f"Payment reconciliation: {stats.as_dict()}")
+    except Exception as e:
+      print(f"Payment reconciliation failed: {e}")
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+  app.state.background_tasks = [
+    asyncio.create_task(reservation_sweeper()),
+    asyncio.create_task(event_broker.run()),
+  ]
+  if RECONCILE_INTERVAL_SECONDS > 0:
+    app.state.background_tasks.append(asyncio.create_task(payment_reconciler()))
+  for n in range(WEBHOOK_WORKERS):
+    worker_id = f"webhook-{os.getpid()}-{n}"
+    app.state.background_tasks.append(asyncio.create_task(webhook_worker(worker_id)))
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+  for task in app.state.background_tasks:
+    task.cancel()
+  images.shutdown()
+  order_writer.stop()
+
+
 @app.get("/health")
 def health() -> dict:
   return {"status": "ok", "uptimeSeconds": round(datetime.now().timestamp())}
 
 
+@app.get("/images/{key}")
+async def image_variant(
+  request: Request,
+  key: str = Path(pattern=r"^[0-9a-f]{16}$"),
+  w: Optional[int] = Query(default=None, ge=16, le=2048),
+  h: Optional[int] = Query(default=None, ge=16, le=2048),
+  fmt: Literal["webp", "jpeg", "png"] = Query(default="webp"),
+):
+  """A resized product image or brand logo; `key` comes from `imageVariants`/`logoVariants`."""
+  w, h = images.snap_size(w), images.snap_size(h)
+  etag = f'"{images.variant_name(key, w, h, fmt)}"'
+  headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": etag}
+  if request.headers.get("if-none-match") == etag:
+    return Response(status_code=304, headers=headers)
+  try:
+    body = await images.get_variant(key, w, h, fmt)
+  except images.ImageNotFoundError:
+    raise HTTPException(status_code=404, detail="Image not found")
+  except images.ImageSourceError as e:
+    raise HTTPException(status_code=502, detail=str(e))
+  except images.ResizingUnavailableError as e:
+    raise HTTPException(status_code=501, detail=str(e))
+  return Response(content=body, media_type=images.FORMATS[fmt][1], headers=headers)
+
+
+def _encode_products(filters: dict, fields: tuple[str, ...] | None) -> bytes:
+  # Runs once on behalf of every request sharing the flight, so it opens its own
+  # session rather than borrowing the leader's, which closes with its request.
+  db = SessionLocal()
+  try:
+    if fields is None:
+      result = list_products(db, **filters)
+      products_list: List[Product] = [product_from_db(p) for p in result]
+      return ProductsResponse(items=products_list, total=len(products_list)).model_dump_json().encode()
+
+    columns = list(dict.fromkeys(PRODUCT_FIELD_COLUMNS[f] for f in fields))
+    result = list_products(db, **filters, columns=columns)
+    items = [product_fields_from_db(p, fields) for p in result]
+    return to_json({"items": items, "total": len(items)})
+  finally:
+    db.close()
+
+
 @app.get("/products", response_model=ProductsResponse)
-def list_products_endpoint(
+async def list_products_endpoint(
+  request: Request,
   q: Optional[str] = Query(default=None, description="Full-text search"),
   brand: Optional[str] = Query(default=None),
   manufacturer: Optional[str] = Query(default=None),
@@ -65,36 +289,101 @@ def list_products_endpoint(
   minPrice: Optional[float] = Query(default=None, ge=0),
   maxPrice: Optional[float] = Query(default=None, ge=0),
   sort: Optional[str] = Query(default=None, description="price-asc|price-desc|rating-desc"),
+  priceBasis: Literal["effective", "list"] = Query(default="effective", description="Price used by minPrice/maxPrice and price sorts"),
+  fields: Optional[str] = Query(default=None, description="Comma-separated product fields to return"),
+  view: Optional[Literal["card", "full"]] = Query(default=None, description="Named field preset"),
+):
+  # Normalized so that equivalent URLs share one in-flight query; q, brand and
+  # manufacturer are matched case-insensitively, category is not.
+  filters = dict(
+    q=q.strip().lower() if q and q.strip() else None,
+    brand=brand.lower() if brand else None,
+    manufacturer=manufacturer.lower() if manufacturer else None,
+    category=category or None,
+    min_price=minPrice,
+    max_price=maxPrice,
+    sort=sort if sort in PRODUCT_SORTS else None,
+    price_basis=priceBasis,
+  )
+
+  selected: tuple[str, ...] | None = None
+  if fields:
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in PRODUCT_FIELD_COLUMNS]
+    if unknown:
+      raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    selected = tuple(dict.fromkeys(["id", *requested]))
+  elif view == "card":
+    selected = PRODUCT_VIEWS["card"]
+
+  key = ("products", catalog_version(), tuple(sorted(filters.items())), selected)
+  body_flight = lambda: catalog_flights.do_async(key, lambda: run_in_threadpool(_encode_products, filters, selected))
+  return await compressed_response(request, key, body_flight, COMPRESSION_MIN_BYTES)
+
+
+def _product_batch(db: Session, ids: List[str]) -> ProductBatchResponse:
+  requested = list(dict.fromkeys(i.strip() for i in ids if i.strip()))
+  if not requested or len(requested) > PRODUCT_BATCH_LIMIT:
+    raise HTTPException(status_code=400, detail=f"Between 1 and {PRODUCT_BATCH_LIMIT} product IDs are required")
+  resolved = {product_id: resolve_product_id(product_id) for product_id in requested}
+  found = get_products_by_ids(db, list(resolved.values()))
+
+  items: List[Product] = []
+  missing: List[str] = []
+  seen = set()
+  for product_id, resolved_id in resolved.items():
+    product = found.get(resolved_id)
+    if product is None:
+      missing.append(product_id)
+    elif resolved_id not in seen:  # a legacy ID and its product ID both requested
+      seen.add(resolved_id)
+      items.append(product_from_db(product))
+  aliases = {legacy: pid for legacy, pid in resolved.items() if legacy != pid and pid in found}
+  return ProductBatchResponse(items=items, missing=missing, aliases=aliases)
+
+
+@app.get("/products:batch", response_model=ProductBatchResponse)
+def get_products_batch(
+  ids: str = Query(..., description=f"Comma-separated product IDs, at most {PRODUCT_BATCH_LIMIT}"),
   db: Session = Depends(get_db),
 ):
-  result = list_products(db, q=q, brand=brand, manufacturer=manufacturer, category=category, min_price=minPrice, max_price=maxPrice)
-
-  products_list: List[Product] = [
-    Product(
-      id=p.id,
-      name=p.name,
-      description=p.description,
-      price=p.price,
-      brand=p.brand,
-      manufacturer=p.manufacturer if hasattr(p, 'manufacturer') else None,
-      category=p.category,
-      imageUrl=p.imageUrl,
-      imageHint=p.imageHint,
-      rating=p.rating,
-      reviewCount=p.reviewCount,
-      discount=p.discount,
+  """Several products in one query, in request order; unknown IDs are listed in `missing`."""
+  return _product_batch(db, ids.split(","))
+
+
+@app.post("/products:batch", response_model=ProductBatchResponse)
+def post_products_batch(payload: ProductBatchRequest, db: Session = Depends(get_db)):
+  """As `GET /products:batch`, for ID lists too long for a URL."""
+  return _product_batch(db, payload.ids)
+
+
+@app.patch("/products/bulk", response_model=BulkProductUpdateResponse)
+def bulk_update_products(payload: BulkProductUpdateRequest, db: Session = Depends(get_db)):
+  """Change price/discount on many products in one transaction.
+
+  Either `items` (per-product changes) or `filter` + `set` (one set operation
+  over every matching product). With `dryRun` only the match count is returned.
+  """
+  missing: List[str] = []
+  if payload.items is not None:
+    items = [item.model_dump(exclude_unset=True) | {"id": item.id} for item in payload.items]
+    matched, updated, missing = bulk_update_products_by_id(db, items, dry_run=payload.dryRun)
+  else:
+    matched, updated = bulk_update_products_by_filter(
+      db,
+      payload.filter.fields(),
+      payload.set.model_dump(exclude_unset=True),
+      dry_run=payload.dryRun,
     )
-    for p in result
-  ]
 
-  if sort == "price-asc":
-    products_list.sort(key=lambda p: p.price)
-  elif sort == "price-desc":
-    products_list.sort(key=lambda p: p.price, reverse=True)
-  elif sort == "rating-desc":
-    products_list.sort(key=lambda p: p.rating, reverse=True)
-
-  return {"items": products_list, "total": len(products_list)}
+  version = bump_catalog_version() if updated else catalog_version()
+  return BulkProductUpdateResponse(
+    matched=matched,
+    updated=updated,
+    missing=missing,
+    dryRun=payload.dryRun,
+    catalogVersion=version,
+  )
 
 
 @app.get("/products/{product_id}", response_model=Product)
@@ -102,30 +391,37 @@ def get_product(product_id: str, db: Session = Depends(get_db)):
   product = get_product_by_id(db, product_id)
   if not product:
     raise HTTPException(status_code=404, detail="Product not found")
-  return Product(
-    id=product.id,
-    name=product.name,
-    description=product.description,
-    price=product.price,
-    brand=product.brand,
-    category=product.category,
-    imageUrl=product.imageUrl,
-    imageHint=product.imageHint,
-    rating=product.rating,
-    reviewCount=product.reviewCount,
-    discount=product.discount,
-  )
+  return product_from_db(product)
+
+
+@app.get("/products/{product_id}/similar", response_model=List[Product])
+def similar_products(
+  product_id: str,
+  limit: int = Query(default=8, ge=1, le=50),
+  db: Session = Depends(get_db),
+):
+  """Content-based suggestions for a product, ranked by TF-IDF cosine similarity."""
+  product = get_product_by_id(db, product_id)
+  if not product:
+    raise HTTPException(status_code=404, detail="Product not found")
+  sync_similar_index(db)
+  if product_id not in similar_index:
+    similar_index.upsert(product)
+
+  ranked = [pid for pid, _ in similar_index.similar(product_id, limit)]
+  found = get_products_by_ids(db, ranked)
+  return [product_from_db(found[pid]) for pid in ranked if pid in found]
 
 
 @app.post("/brand", response_model=Brand, status_code=201)
 def create_brand_endpoint(payload: BrandCreateRequest, db: Session = Depends(get_db)):
     """Create a new brand."""
     # Check if brand with same name already exists
-    existing_brand = db.query(BrandDB).filter(BrandDB.name == payload.name).first()
+    existing_brand = db.query(BrandDB).filter(BrandDB.name == payload.name, BrandDB.deleted_at.is_(None)).first()
     if existing_brand:
         raise HTTPException(status_code=400, detail="Brand with this name already exists")
     
-    # Generate brand ID
+    # Generate brand ID (deleted brands stay as tombstones, so IDs are never reused)
     brand_count = db.query(BrandDB).count()
     brand_id = f"brand_{brand_count + 1}"
     
@@ -140,6 +436,7 @@ def create_brand_endpoint(payload: BrandCreateRequest, db: Session = Depends(get
     db.add(new_brand)
     db.commit()
     db.refresh(new_brand)
+    bump_catalog_version()
     
     return Brand(
         id=new_brand.id,
@@ -160,7 +457,7 @@ def list_manufacturers(db: Session = Depends(get_db)):
 
 @app.get("/manufacturers/{manu_id}")
 def get_manufacturer(manu_id: str, db: Session = Depends(get_db)):
-    m = db.query(ManufacturerDB).filter(ManufacturerDB.id == manu_id).first()
+    m = db.query(ManufacturerDB).filter(ManufacturerDB.id == manu_id, ManufacturerDB.deleted_at.is_(None)).first()
     if not m:
       raise HTTPException(status_code=404, detail="Manufacturer not found")
     return {"id": m.id, "name": m.name, "imageBase64": m.imageBase64, "models": m.models.split(',') if m.models else []}
@@ -168,7 +465,7 @@ def get_manufacturer(manu_id: str, db: Session = Depends(get_db)):
 
 @app.post("/manufacturers", status_code=201)
 def create_manufacturer(payload: ManufacturerCreateRequest, db: Session = Depends(get_db)):
-    existing = db.query(ManufacturerDB).filter(ManufacturerDB.name == payload.name).first()
+    existing = db.query(ManufacturerDB).filter(ManufacturerDB.name == payload.name, ManufacturerDB.deleted_at.is_(None)).first()
     if existing:
         raise HTTPException(status_code=400, detail="Manufacturer with this name already exists")
     count = db.query(ManufacturerDB).count()
@@ -177,15 +474,16 @@ def create_manufacturer(payload: ManufacturerCreateRequest, db: Session = Depend
     db.add(m)
     db.commit()
     db.refresh(m)
+    bump_catalog_version()
     return {"id": m.id, "name": m.name, "imageBase64": m.imageBase64, "models": m.models.split(',') if m.models else []}
 
 
 @app.put("/manufacturers/{manu_id}")
 def update_manufacturer(manu_id: str, payload: ManufacturerCreateRequest, db: Session = Depends(get_db)):
-    m = db.query(ManufacturerDB).filter(ManufacturerDB.id == manu_id).first()
+    m = db.query(ManufacturerDB).filter(ManufacturerDB.id == manu_id, ManufacturerDB.deleted_at.is_(None)).first()
     if not m:
         raise HTTPException(status_code=404, detail="Manufacturer not found")
-    other = db.query(ManufacturerDB).filter(ManufacturerDB.name == payload.name, ManufacturerDB.id != manu_id).first()
+    other = db.query(ManufacturerDB).filter(ManufacturerDB.name == payload.name, ManufacturerDB.id != manu_id, ManufacturerDB.deleted_at.is_(None)).first()
     if other:
         raise HTTPException(status_code=400, detail="Another manufacturer with this name already exists")
     old_name = m.name
@@ -196,23 +494,25 @@ def update_manufacturer(manu_id: str, payload: ManufacturerCreateRequest, db: Se
     db.refresh(m)
     # update products manufacturer name if changed
     if old_name != m.name:
-        prods = db.query(ProductDB).filter(ProductDB.manufacturer == old_name).all()
+        prods = db.query(ProductDB).filter(ProductDB.manufacturer == old_name, ProductDB.deleted_at.is_(None)).all()
         for p in prods:
             p.manufacturer = m.name
         db.commit()
+    bump_catalog_version()
     return {"id": m.id, "name": m.name, "imageBase64": m.imageBase64, "models": m.models.split(',') if m.models else []}
 
 
 @app.delete("/manufacturers/{manu_id}", status_code=204)
 def delete_manufacturer(manu_id: str, db: Session = Depends(get_db)):
-    m = db.query(ManufacturerDB).filter(ManufacturerDB.id == manu_id).first()
+    m = db.query(ManufacturerDB).filter(ManufacturerDB.id == manu_id, ManufacturerDB.deleted_at.is_(None)).first()
     if not m:
         raise HTTPException(status_code=404, detail="Manufacturer not found")
-    linked = db.query(ProductDB).filter(ProductDB.manufacturer == m.name).first()
+    linked = db.query(ProductDB).filter(ProductDB.manufacturer == m.name, ProductDB.deleted_at.is_(None)).first()
     if linked:
         raise HTTPException(status_code=400, detail="Cannot delete manufacturer with existing products")
-    db.delete(m)
+    tombstone(m)
     db.commit()
+    bump_catalog_version()
     return {}
 
 
@@ -220,11 +520,11 @@ def delete_manufacturer(manu_id: str, db: Session = Depends(get_db)):
 def create_product_endpoint(payload: ProductCreateRequest, db: Session = Depends(get_db)):
     """Create a new product."""
     # Verify brand exists
-    brand = db.query(BrandDB).filter(BrandDB.name == payload.brand).first()
+    brand = db.query(BrandDB).filter(BrandDB.name == payload.brand, BrandDB.deleted_at.is_(None)).first()
     if not brand:
         raise HTTPException(status_code=400, detail="Brand not found")
     
-    # Generate product ID
+    # Generate product ID (deleted products stay as tombstones, so IDs are never reused)
     product_count = db.query(ProductDB).count()
     product_id = f"prod_{product_count + 1}"
     
@@ -240,38 +540,29 @@ def create_product_endpoint(payload: ProductCreateRequest, db: Session = Depends
         imageHint=payload.imageHint,
         rating=payload.rating if payload.rating else 0.0,
         reviewCount=payload.reviewCount if payload.reviewCount else 0,
-        discount=payload.discount
+        discount=payload.discount,
+        stock=payload.stock,
     )
     
     db.add(new_product)
     db.commit()
     db.refresh(new_product)
-      
-    return Product(
-          id=new_product.id,
-          name=new_product.name,
-          description=new_product.description,
-          price=new_product.price,
-          brand=new_product.brand,
-          category=new_product.category,
-          imageUrl=new_product.imageUrl,
-          imageHint=new_product.imageHint,
-          rating=new_product.rating,
-          reviewCount=new_product.reviewCount,
-          discount=new_product.discount
-      )
+    similar_index.upsert(new_product)
+    bump_catalog_version()
+
+    return product_from_db(new_product)
   
   
 @app.put("/brand/{brand_id}", response_model=Brand)
 def update_brand(brand_id: str, payload: BrandCreateRequest, db: Session = Depends(get_db)):
     """Update an existing brand. Also update product.brand references if name changes."""
-    brand = db.query(BrandDB).filter(BrandDB.id == brand_id).first()
+    brand = db.query(BrandDB).filter(BrandDB.id == brand_id, BrandDB.deleted_at.is_(None)).first()
     if not brand:
       raise HTTPException(status_code=404, detail="Brand not found")
 
     old_name = brand.name
     # Check for name collision with another brand
-    other = db.query(BrandDB).filter(BrandDB.name == payload.name, BrandDB.id != brand_id).first()
+    other = db.query(BrandDB).filter(BrandDB.name == payload.name, BrandDB.id != brand_id, BrandDB.deleted_at.is_(None)).first()
     if other:
       raise HTTPException(status_code=400, detail="Another brand with this name already exists")
 
@@ -283,10 +574,11 @@ def update_brand(brand_id: str, payload: BrandCreateRequest, db: Session = Depen
 
     # If name changed, update products referencing old name
     if old_name != payload.name:
-      products = db.query(ProductDB).filter(ProductDB.brand == old_name).all()
+      products = db.query(ProductDB).filter(ProductDB.brand == old_name, ProductDB.deleted_at.is_(None)).all()
       for p in products:
         p.brand = payload.name
       db.commit()
+    bump_catalog_version()
 
     return Brand(id=brand.id, name=brand.name, logoUrl=brand.logoUrl, logoHint=brand.logoHint)
 
@@ -294,29 +586,30 @@ def update_brand(brand_id: str, payload: BrandCreateRequest, db: Session = Depen
 @app.delete("/brand/{brand_id}", status_code=204)
 def delete_brand(brand_id: str, db: Session = Depends(get_db)):
       """Delete a brand. Prevent deletion if any products reference the brand."""
-      brand = db.query(BrandDB).filter(BrandDB.id == brand_id).first()
+      brand = db.query(BrandDB).filter(BrandDB.id == brand_id, BrandDB.deleted_at.is_(None)).first()
       if not brand:
           raise HTTPException(status_code=404, detail="Brand not found")
   
       # Prevent deletion if products exist for this brand
-      linked = db.query(ProductDB).filter(ProductDB.brand == brand.name).first()
+      linked = db.query(ProductDB).filter(ProductDB.brand == brand.name, ProductDB.deleted_at.is_(None)).first()
       if linked:
           raise HTTPException(status_code=400, detail="Cannot delete brand with existing products")
   
-      db.delete(brand)
+      tombstone(brand)
       db.commit()
+      bump_catalog_version()
       return {}
   
   
 @app.put("/product/{product_id}", response_model=Product)
 def update_product(product_id: str, payload: ProductCreateRequest, db: Session = Depends(get_db)):
     """Update an existing product."""
-    product = db.query(ProductDB).filter(ProductDB.id == product_id).first()
+    product = get_product_by_id(db, product_id)
     if not product:
       raise HTTPException(status_code=404, detail="Product not found")
 
     # Verify brand exists
-    brand = db.query(BrandDB).filter(BrandDB.name == payload.brand).first()
+    brand = db.query(BrandDB).filter(BrandDB.name == payload.brand, BrandDB.deleted_at.is_(None)).first()
     if not brand:
       raise HTTPException(status_code=400, detail="Brand not found")
 
@@ -330,41 +623,34 @@ def update_product(product_id: str, payload: ProductCreateRequest, db: Session =
     product.rating = payload.rating if payload.rating else 0.0
     product.reviewCount = payload.reviewCount if payload.reviewCount else 0
     product.discount = payload.discount
+    product.stock = payload.stock
 
     db.commit()
     db.refresh(product)
+    similar_index.upsert(product)
+    bump_catalog_version()
 
-    return Product(
-      id=product.id,
-      name=product.name,
-      description=product.description,
-      price=product.price,
-      brand=product.brand,
-      category=product.category,
-      imageUrl=product.imageUrl,
-      imageHint=product.imageHint,
-      rating=product.rating,
-      reviewCount=product.reviewCount,
-      discount=product.discount,
-    )
+    return product_from_db(product)
 
 
 @app.delete("/product/{product_id}", status_code=204)
 def delete_product(product_id: str, db: Session = Depends(get_db)):
     """Delete a product by ID."""
-    product = db.query(ProductDB).filter(ProductDB.id == product_id).first()
+    product = get_product_by_id(db, product_id)
     if not product:
       raise HTTPException(status_code=404, detail="Product not found")
 
-    db.delete(product)
+    tombstone(product)
     db.commit()
+    similar_index.remove(product_id)
+    bump_catalog_version()
     return {}
 
 
 @app.get("/brands/{brand_id}", response_model=Brand)
 def get_brand_by_id(brand_id: str, db: Session = Depends(get_db)):
     """Get a brand by ID."""
-    brand = db.query(BrandDB).filter(BrandDB.id == brand_id).first()
+    brand = db.query(BrandDB).filter(BrandDB.id == brand_id, BrandDB.deleted_at.is_(None)).first()
     if not brand:
         raise HTTPException(status_code=404, detail="Brand not found")
     
@@ -376,18 +662,143 @@ def get_brand_by_id(brand_id: str, db: Session = Depends(get_db)):
     )
 
 
+_brand_list = TypeAdapter(List[Brand])
+_category_list = TypeAdapter(List[str])
+
+
 @app.get("/brands", response_model=List[Brand])
 def list_brands(db: Session = Depends(get_db)):
-  brands_db = get_brands(db)
-  return [
-    Brand(id=b.id, name=b.name, logoUrl=b.logoUrl, logoHint=b.logoHint)
-    for b in brands_db
-  ]
+  def encode() -> bytes:
+    brands = [Brand(id=b.id, name=b.name, logoUrl=b.logoUrl, logoHint=b.logoHint) for b in get_brands(db)]
+    return _brand_list.dump_json(brands)
+
+  body = catalog_flights.do(("brands", catalog_version()), encode)
+  return Response(content=body, media_type="application/json")
 
 
 @app.get("/categories", response_model=List[str])
 def list_categories(db: Session = Depends(get_db)):
-  return get_categories(db)
+  body = catalog_flights.do(("categories", catalog_version()), lambda: _category_list.dump_json(get_categories(db)))
+  return Response(content=body, media_type="application/json")
+
+
+def _parse_change_cursor(since: str) -> tuple[int, str, str]:
+  seq, sep, rest = since.partition(":")
+  # A bare sequence number means everything up to and including it was seen;
+  # "~" sorts after every kind.
+  kind, _, item_id = rest.partition(":") if sep else ("~", "", "")
+  try:
+    return int(seq), kind, item_id
+  except ValueError:
+    raise HTTPException(status_code=400, detail="Invalid since cursor")
+
+
+def _change_data(kind: str, row) -> dict:
+  if kind == "product":
+    return product_from_db(row).model_dump()
+  if kind == "brand":
+    return Brand(id=row.id, name=row.name, logoUrl=row.logoUrl, logoHint=row.logoHint).model_dump()
+  return {"id": row.id, "name": row.name, "imageBase64": row.imageBase64, "models": row.models.split(',') if row.models else []}
+
+
+@app.get("/changes", response_model=ChangesResponse)
+def list_catalog_changes(
+  since: str = Query("0", description="Cursor from a previous response's nextSince, or a sequence number"),
+  limit: int = Query(CHANGE_FEED_LIMIT, ge=1, le=CHANGE_FEED_LIMIT),
+  db: Session = Depends(get_db),
+):
+  """Products, brands and manufacturers created, updated or deleted after `since`."""
+  cursor = _parse_change_cursor(since)
+  sequence = current_change_seq(db)
+  rows, has_more = list_changes(db, cursor, limit)
+  changes = [
+    CatalogChange(
+      seq=seq,
+      kind=kind,
+      id=row.id,
+      op="delete" if row.deleted_at else "upsert",
+      updatedAt=row.deleted_at or row.updated_at,
+      data=None if row.deleted_at else _change_data(kind, row),
+    )
+    for seq, kind, row in rows
+  ]
+  if changes:
+    last = changes[-1]
+    next_since = f"{last.seq}:{last.kind}:{last.id}"
+  else:
+    next_since = since if ":" in since else str(max(cursor[0], sequence))
+  return ChangesResponse(changes=changes, nextSince=next_since, hasMore=has_more, sequence=sequence)
+
+
+@app.get("/admin/coalescing")
+def coalescing_stats() -> dict:
+  """Request-coalescing counters for the catalog listing endpoints and order writes."""
+  return {**catalog_flights.stats(), "groupCommit": order_writer.stats()}
+
+
+STATS_DEFAULT_DAYS = 30
+
+
+def _parse_stats_date(value: str, name: str) -> str:
+  try:
+    return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+  except ValueError:
+    raise HTTPException(status_code=400, detail=f"{name} must be a date (YYYY-MM-DD)")
+
+
+@app.get("/admin/admission")
+def admission_stats() -> dict:
+  """Rate-limit rejections and per-class concurrency limits on this worker."""
+  if not admission_state:
+    return {"enabled": False}
+  return {"enabled": True, **admission_state[-1].stats()}
+
+
+def require_profile_token(x_debug_profile: Optional[str] = Header(default=None)) -> None:
+  """Diagnostics reveal query text and timings; they take the profiling token."""
+  if not x_debug_profile or not token_is_valid(x_debug_profile):
+    raise HTTPException(status_code=403, detail="A valid X-Debug-Profile token is required")
+
+
+@app.get("/admin/slow-queries", dependencies=[Depends(require_profile_token)])
+def list_slow_queries(limit: int = Query(50, ge=1, le=1000)) -> list[dict]:
+  """Most recent statements slower than SLOW_QUERY_MS, newest first, with query plans."""
+  return slow_queries.recent(limit)
+
+
+@app.delete("/admin/slow-queries", status_code=204, dependencies=[Depends(require_profile_token)])
+def clear_slow_queries():
+  slow_queries.clear()
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_profile_token)])
+def list_profiles() -> list[dict]:
+  """Stored request profiles, newest first, without their function tables."""
+  return [{k: v for k, v in p.items() if k != "functions"} for p in profiles.recent()]
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_profile_token)])
+def get_profile(profile_id: str) -> dict:
+  for profile in profiles.recent():
+    if profile["id"] == profile_id:
+      return profile
+  raise HTTPException(status_code=404, detail="Profile not found")
+
+
+@app.get("/admin/stats")
+def admin_stats(
+  start: Optional[str] = Query(None, alias="from", description="First order date, YYYY-MM-DD (default: 30 days ago)"),
+  end: Optional[str] = Query(None, alias="to", description="Last order date, YYYY-MM-DD (default: today)"),
+  top: int = Query(10, ge=1, le=100, description="Number of top-selling products"),
+  db: Session = Depends(get_db),
+) -> dict:
+  """Revenue, order counts and top sellers from the sales summary tables."""
+  today = datetime.utcnow()
+  end = _parse_stats_date(end, "to") if end else today.strftime("%Y-%m-%d")
+  start = _parse_stats_date(start, "from") if start else (today - timedelta(days=STATS_DEFAULT_DAYS - 1)).strftime("%Y-%m-%d")
+  if start > end:
+    raise HTTPException(status_code=400, detail="from must not be after to")
+  return sales_summary(db, start, end, top)
 
 
 @app.get("/orders", response_model=List[Order])
@@ -424,67 +835,220 @@ def list_orders_endpoint(db: Session = Depends(get_db)):
   return result
 
 
-@app.post("/orders", response_model=OrderCreateResponse, status_code=201)
-def create_order_endpoint(payload: OrderCreateRequest, db: Session = Depends(get_db)):
-  # Map old product IDs to new prod_X format
-  product_id_map = {
-    'turbocharger': 'prod_1',
-    'brake-kit': 'prod_2',
-    'suspension': 'prod_3',
-    'exhaust': 'prod_4',
-    'racing-seat': 'prod_5',
-    'carbon-hood': 'prod_6',
-    'intercooler': 'prod_7',
-    'racing-wheel': 'prod_8',
-  }
-  
-  product_ids = []
-  total = 0.0
+@app.get("/orders/{order_id}", response_model=Order)
+def get_order(order_id: str, db: Session = Depends(get_db)):
+  """A single order, from the live tables or the archive."""
+  order = db.get(OrderDB, order_id)
+  if order is not None:
+    record = {"id": order.id, "date": order.date, "status": order.status, "total": order.total,
+              "payment_status": order.payment_status, "razorpay_order_id": order.razorpay_order_id,
+              "shipping_cost": order.shipping_cost,
+              "items": [{"productId": pid, "quantity": q} for pid, q in order_quantities(db, order.id).items()]}
+  else:
+    record = find_archived_order(db, order_id)
+    if record is None:
+      raise HTTPException(status_code=404, detail="Order not found")
+
+  # Deleted products are still shown on the orders that bought them.
+  ids = [item["productId"] for item in record["items"]]
+  products = {p.id: p for p in db.query(ProductDB).filter(ProductDB.id.in_(ids)).all()}
+  return Order(
+    id=record["id"],
+    date=record["date"],
+    status=record["status"],
+    total=record["total"],
+    items=[
+      {"product": product_from_db(products[item["productId"]]), "quantity": item["quantity"]}
+      for item in record["items"] if item["productId"] in products
+    ],
+    payment_status=record["payment_status"],
+    razorpay_order_id=record["razorpay_order_id"],
+    shippingCost=record.get("shipping_cost"),
+    archived=order is None,
+  )
 
-  for item in payload.items:
-    # Convert old ID to new ID if needed
-    product_id = product_id_map.get(item.productId, item.productId)
-    
-    product = get_product_by_id(db, product_id)
-    if not product:
-      raise HTTPException(status_code=400, detail=f"Unknown product: {item.productId}")
-    product_ids.append((product_id, item.quantity))
-    total += product.price * item.quantity
 
-  order_id = f"ORD-{int(datetime.utcnow().timestamp() * 1000)}"
-  order_db = create_order(db, order_id, datetime.utcnow().strftime("%Y-%m-%d"), round(total, 2), product_ids)
+@app.get("/shipping/quote", response_model=ShippingQuoteResponse)
+def shipping_quote(
+  pin: str = Query(..., description="Six-digit delivery PIN code"),
+  subtotal: float = Query(default=0.0, ge=0, description="Cart total after discounts"),
+  units: int = Query(default=1, ge=1, description="Number of items in the cart"),
+):
+  """Whether a PIN code is served, the delivery estimate and the shipping cost."""
+  try:
+    quote = quote_shipping(pin, subtotal, units)
+  except InvalidPinError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  zone = quote.zone
+  return ShippingQuoteResponse(
+    pin=quote.pin,
+    serviceable=quote.serviceable,
+    zone=zone.zone if zone and quote.serviceable else None,
+    region=zone.region if zone else None,
+    etaMinDays=zone.eta_min if quote.serviceable else None,
+    etaMaxDays=zone.eta_max if quote.serviceable else None,
+    cost=quote.cost,
+    freeAbove=SHIPPING_FREE_ABOVE,
+  )
 
-  items = []
-  for product_id, qty in product_ids:
-    product = get_product_by_id(db, product_id)
-    items.append({
-      "product": Product(
-        id=product.id,
-        name=product.name,
-        description=product.description,
-        price=product.price,
-        brand=product.brand,
-        category=product.category,
-        imageUrl=product.imageUrl,
-        imageHint=product.imageHint,
-        rating=product.rating,
-        reviewCount=product.reviewCount,
-        discount=product.discount,
-      ),
-      "quantity": qty,
-    })
 
+@app.get("/account/orders", response_model=AccountOrdersResponse)
+def account_orders(
+  email: EmailStr = Query(..., description="Customer email the orders were placed with"),
+  limit: int = Query(default=ACCOUNT_ORDERS_LIMIT, ge=1, le=100),
+  cursor: Optional[str] = Query(default=None, description="nextCursor of the previous page"),
+  db: Session = Depends(get_db),
+):
+  """One customer's orders with their items, newest first, a page at a time."""
+  before = None
+  if cursor:
+    date, _, order_id = cursor.partition(":")
+    if not date or not order_id:
+      raise HTTPException(status_code=400, detail="Invalid cursor")
+    before = (date, order_id)
+
+  orders, has_more = list_customer_orders(db, email, limit, before)
+  items = [
+    Order(
+      id=order.id,
+      date=order.date,
+      status=order.status,
+      total=order.total,
+      items=[
+        {"product": product_from_db(item.product), "quantity": item.quantity}
+        for item in order.order_items if item.product is not None
+      ],
+      payment_status=order.payment_status,
+      razorpay_order_id=order.razorpay_order_id,
+      shippingCost=order.shipping_cost,
+    )
+    for order in orders
+  ]
+  next_cursor = f"{orders[-1].date}:{orders[-1].id}" if has_more else None
+  return AccountOrdersResponse(items=items, nextCursor=next_cursor)
+
+
+@app.post("/cart/quote", response_model=CartQuoteResponse)
+def quote_cart_endpoint(payload: CartQuoteRequest, db: Session = Depends(get_db)):
+  """Price a cart server-side with discounts applied and current availability."""
+  try:
+    return quote_cart(db, payload.items)
+  except UnknownProductError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/orders", response_model=OrderCreateResponse, status_code=201)
+def create_order_endpoint(payload: OrderCreateRequest, db: Session = Depends(get_db)):
+  try:
+    cart = price_cart(db, payload.items)
+  except UnknownProductError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  product_ids = [(line.productId, line.quantity) for line in cart.items]
+
+  address = payload.shippingAddress
+  try:
+    quote = quote_shipping(address.postalCode, cart.total, sum(q for _, q in product_ids))
+  except InvalidPinError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  if not quote.serviceable:
+    raise HTTPException(status_code=400, detail=f"We do not deliver to PIN code {quote.pin}")
+  total = round(cart.total + quote.cost, 2)
+
+  # Random suffix keeps IDs unique when concurrent checkouts land in the same millisecond
+  order_id = f"ORD-{int(datetime.utcnow().timestamp() * 1000)}-{uuid.uuid4().hex[:6]}"
+  date = datetime.utcnow().strftime("%Y-%m-%d")
+  customer = {
+    "customer_email": normalize_email(payload.customerEmail),
+    "shipping_address": address.line1,
+    "shipping_city": address.city,
+    "shipping_zip": address.postalCode,
+    "shipping_cost": quote.cost,
+  }
+  try:
+    if GROUP_COMMIT:
+      order_db = order_writer.submit(lambda session: add_order(session, order_id, date, total, product_ids, customer))
+    else:
+      order_db = create_order(db, order_id, date, total, product_ids, customer)
+  except OutOfStockError as e:
+    raise HTTPException(status_code=409, detail=str(e))
+
+  # The priced cart is memoized and its products carry the stock from before
+  # this order reserved any; report the levels left after the reservation.
+  stock = get_stock_levels(db, [line.productId for line in cart.items])
   new_order = Order(
     id=order_db.id,
     date=order_db.date,
     status=order_db.status,
     total=order_db.total,
-    items=items,
+    items=[
+      {"product": line.product.model_copy(update={"stock": stock.get(line.productId)}), "quantity": line.quantity}
+      for line in cart.items
+    ],
+    shippingCost=order_db.shipping_cost,
   )
 
   return {"order": new_order}
 
 
+def _order_snapshot(order_id: str) -> dict | None:
+  db = SessionLocal()
+  try:
+    order = db.query(OrderDB.status, OrderDB.payment_status).filter(OrderDB.id == order_id).first()
+    if order is None:
+      return None
+    return {"type": "snapshot", "orderId": order_id, "status": order.status, "paymentStatus": order.payment_status}
+  finally:
+    db.close()
+
+
+def _sse(event_id: int, payload: dict) -> bytes:
+  return f"id: {event_id}\nevent: order\ndata: {json.dumps(payload)}\n\n".encode()
+
+
+async def _order_event_stream(subscription, initial: list[dict]):
+  try:
+    for payload in initial:
+      yield _sse(0, payload)
+    while not subscription.overflowed:
+      item = await subscription.get(SSE_HEARTBEAT_SECONDS)
+      # A comment line keeps proxies from closing an idle stream.
+      yield b": keepalive\n\n" if item is None else _sse(*item)
+  finally:
+    subscription.close()
+
+
+def _sse_response(stream) -> StreamingResponse:
+  return StreamingResponse(
+    stream,
+    media_type="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+  )
+
+
+@app.get("/orders/{order_id}/events")
+async def order_events(order_id: str):
+  """Server-sent events for one order: its current status, then every change."""
+  # Subscribe before reading the snapshot so no change can fall in between.
+  subscription = event_hub.subscribe(order_id)
+  snapshot = await run_in_threadpool(_order_snapshot, order_id)
+  if snapshot is None:
+    subscription.close()
+    raise HTTPException(status_code=404, detail="Order not found")
+  return _sse_response(_order_event_stream(subscription, [snapshot]))
+
+
+@app.get("/admin/orders/events")
+async def all_order_events():
+  """Server-sent events for every order created or changed from now on."""
+  return _sse_response(_order_event_stream(event_hub.subscribe(None), []))
+
+
+@app.get("/admin/events")
+def event_stats() -> dict:
+  """Open event streams and delivery counters for this worker."""
+  return event_hub.stats()
+
+
 # ===== Payment Routes =====
 
 @app.post("/payments/create-order", response_model=RazorpayOrderResponse)
@@ -502,6 +1066,13 @@ async def create_payment_order(
             currency=request.currency,
             receipt=request.receipt
         )
+
+        # Remember the gateway order on ours so webhooks can find it.
+        if request.receipt:
+            order = db.query(OrderDB).filter(OrderDB.id == request.receipt).first()
+            if order:
+                order.razorpay_order_id = razorpay_order["id"]
+                db.commit()
         
         return RazorpayOrderResponse(
             id=razorpay_order["id"],
@@ -513,6 +1084,43 @@ async def create_payment_order(
         raise HTTPException(status_code=500, detail=f"Failed to create Razorpay order: {str(e)}")
 
 
+def _record_verified_payment(db: Session, verification: PaymentVerificationRequest) -> OrderDB:
+    """Mark the order paid and store its shipping details, without committing."""
+    order = db.query(OrderDB).filter(OrderDB.id == verification.order_id).first()
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    mark_order_paid(
+        db,
+        order,
+        razorpay_order_id=verification.razorpay_order_id,
+        razorpay_payment_id=verification.razorpay_payment_id,
+        razorpay_signature=verification.razorpay_signature,
+    )
+
+    # Save shipping details if provided
+    if verification.shipping_details:
+        order.customer_name = verification.shipping_details.name
+        order.customer_email = normalize_email(verification.shipping_details.email)
+        order.customer_phone = verification.shipping_details.phone
+        order.shipping_address = verification.shipping_details.address
+        order.shipping_city = verification.shipping_details.city
+        order.shipping_state = verification.shipping_details.state
+        order.shipping_zip = verification.shipping_details.zip
+    return order
+
+
+def _commit_verified_payment(db: Session, verification: PaymentVerificationRequest) -> OrderDB:
+    try:
+        order = _record_verified_payment(db, verification)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    db.refresh(order)
+    return order
+
+
 @app.post("/payments/verify")
 async def verify_payment(
     verification: PaymentVerificationRequest,
@@ -531,30 +1139,20 @@ async def verify_payment(
     if not is_valid:
         raise HTTPException(status_code=400, detail="Invalid payment signature")
     
-    # Update order with payment details
-    order = db.query(OrderDB).filter(OrderDB.id == verification.order_id).first()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    order.payment_status = "paid"
-    order.razorpay_order_id = verification.razorpay_order_id
-    order.razorpay_payment_id = verification.razorpay_payment_id
-    order.razorpay_signature = verification.razorpay_signature
-    order.status = "confirmed"
-    
-    # Save shipping details if provided
-    if verification.shipping_details:
-        order.customer_name = verification.shipping_details.name
-        order.customer_email = verification.shipping_details.email
-        order.customer_phone = verification.shipping_details.phone
-        order.shipping_address = verification.shipping_details.address
-        order.shipping_city = verification.shipping_details.city
-        order.shipping_state = verification.shipping_details.state
-        order.shipping_zip = verification.shipping_details.zip
-    
-    db.commit()
-    db.refresh(order)
-    
+    if GROUP_COMMIT:
+        order = await run_in_threadpool(
+            order_writer.submit, lambda session: _record_verified_payment(session, verification)
+        )
+    else:
+        order = await run_in_threadpool(_commit_verified_payment, db, verification)
+    if order.payment_status == "refund_due":
+        # The sweeper already gave this order's stock back and it has since
+        # sold; the payment is recorded so that it can be refunded.
+        raise HTTPException(
+            status_code=409,
+            detail="Your reservation expired and the items sold out. The payment was recorded and will be refunded.",
+        )
+
     return {
         "success": True,
         "message": "Payment verified successfully",
@@ -563,5 +1161,22 @@ async def verify_payment(
     }
 
 
-
-
+@app.post("/payments/webhook")
+async def razorpay_webhook(request: Request):
+    """
+    Receive a Razorpay webhook. The event is verified and queued durably;
+    order updates happen asynchronously in the webhook workers.
+    """
+    body = await request.body()
+    if not verify_webhook_signature(body, request.headers.get("X-Razorpay-Signature")):
+        raise HTTPException(status_code=400, detail="Invalid webhook signature")
+    try:
+        event = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Malformed webhook payload")
+
+    event_id = request.headers.get("X-Razorpay-Event-Id") or event.get("id") or hashlib.sha256(body).hexdigest()
+    queued = await run_in_threadpool(enqueue_webhook_event, event_id, event.get("event", ""), body)
+    if queued:
+        webhook_wakeup.set()
+    return {"status": "queued" if queued else "duplicate"}
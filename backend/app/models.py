@@ -1,10 +1,24 @@
 from __future__ import annotations
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Table, Text
-from sqlalchemy.orm import relationship
-from .database import Base
+from datetime import datetime
+from itertools import chain
 
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index, Table, Text, event, inspect, select, update
+from sqlalchemy.orm import Session, relationship
+from .database import Base, QueueBase
 
-class ProductDB(Base):
+
+class ChangeTrackedMixin:
+  """Columns backing the catalog change feed (`/changes`).
+
+  `change_seq` and `updated_at` are stamped on every flush that changes the
+  row; deleting sets `deleted_at` and keeps the row as a tombstone.
+  """
+  updated_at = Column(String, nullable=True)
+  deleted_at = Column(String, nullable=True)
+  change_seq = Column(Integer, index=True, nullable=True)
+
+
+class ProductDB(ChangeTrackedMixin, Base):
   __tablename__ = "products"
 
   id = Column(String, primary_key=True, index=True)
@@ -19,11 +33,28 @@ class ProductDB(Base):
   rating = Column(Float, nullable=False)
   reviewCount = Column(Integer, default=0)
   discount = Column(Integer, nullable=True)
+  stock = Column(Integer, nullable=True)  # None means stock is not tracked
+  effective_price = Column(Float, index=True, nullable=True)  # price after discount, kept in sync on write
 
   order_items = relationship("OrderItemDB", back_populates="product")
 
+  __table_args__ = (
+    Index("ix_products_category_effective_price", "category", "effective_price"),
+  )
+
+
+def effective_price(price: float, discount: int | None) -> float:
+  """Price the customer pays for one unit after the product discount."""
+  return round(price * (1 - (discount or 0) / 100), 2)
 
-class BrandDB(Base):
+
+@event.listens_for(ProductDB, "before_insert")
+@event.listens_for(ProductDB, "before_update")
+def _sync_effective_price(mapper, connection, target: ProductDB) -> None:
+  target.effective_price = effective_price(target.price, target.discount)
+
+
+class BrandDB(ChangeTrackedMixin, Base):
   __tablename__ = "brands"
 
   id = Column(String, primary_key=True, index=True)
@@ -32,7 +63,7 @@ class BrandDB(Base):
   logoHint = Column(String, nullable=False)
 
 
-class ManufacturerDB(Base):
+class ManufacturerDB(ChangeTrackedMixin, Base):
   __tablename__ = "manufacturers"
 
   id = Column(String, primary_key=True, index=True)
@@ -41,6 +72,56 @@ class ManufacturerDB(Base):
   models = Column(Text, nullable=True)  # comma-separated list of models
 
 
+class CatalogSequenceDB(Base):
+  """Single-row counter issuing catalog change sequence numbers."""
+  __tablename__ = "catalog_sequence"
+
+  id = Column(Integer, primary_key=True)
+  value = Column(Integer, nullable=False, default=0)
+
+
+CATALOG_MODELS = (ProductDB, BrandDB, ManufacturerDB)
+
+# Attributes whose changes are not catalog changes: stock moves with every
+# order, and the tracking columns themselves.
+UNTRACKED_ATTRIBUTES = {"stock", "updated_at", "change_seq", "order_items"}
+
+
+def change_timestamp() -> str:
+  return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def next_change_seq(connection) -> int:
+  """Take the next catalog change sequence number inside the current transaction."""
+  table = CatalogSequenceDB.__table__
+  result = connection.execute(update(table).where(table.c.id == 1).values(value=table.c.value + 1))
+  if result.rowcount == 0:
+    connection.execute(table.insert().values(id=1, value=1))
+  return connection.execute(select(table.c.value).where(table.c.id == 1)).scalar_one()
+
+
+def _is_catalog_change(session: Session, obj) -> bool:
+  if obj in session.new:
+    return True
+  state = inspect(obj)
+  return any(attr.history.has_changes() for attr in state.attrs if attr.key not in UNTRACKED_ATTRIBUTES)
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_catalog_changes(session: Session, flush_context, instances) -> None:
+  changed = [
+    obj for obj in chain(session.new, session.dirty)
+    if isinstance(obj, CATALOG_MODELS) and _is_catalog_change(session, obj)
+  ]
+  if not changed:
+    return
+  seq = next_change_seq(session.connection())
+  now = change_timestamp()
+  for obj in changed:
+    obj.change_seq = seq
+    obj.updated_at = now
+
+
 class OrderItemDB(Base):
   __tablename__ = "order_items"
 
@@ -60,10 +141,11 @@ class OrderDB(Base):
   status = Column(String, nullable=False)
   total = Column(Float, nullable=False)
   payment_status = Column(String, default="pending")  # pending, paid, failed
-  razorpay_order_id = Column(String, nullable=True)
+  razorpay_order_id = Column(String, index=True, nullable=True)
   razorpay_payment_id = Column(String, nullable=True)
   razorpay_signature = Column(String, nullable=True)
-  
+  reserved_until = Column(String, nullable=True)  # UTC "%Y-%m-%dT%H:%M:%S" while stock is held
+
   # Shipping details
   customer_name = Column(String, nullable=True)
   customer_email = Column(String, nullable=True)
@@ -72,5 +154,81 @@ class OrderDB(Base):
   shipping_city = Column(String, nullable=True)
   shipping_state = Column(String, nullable=True)
   shipping_zip = Column(String, nullable=True)
+  shipping_cost = Column(Float, nullable=True)  # included in total
 
   order_items = relationship("OrderItemDB", back_populates="order")
+
+  __table_args__ = (
+    Index("ix_orders_payment_status_reserved_until", "payment_status", "reserved_until"),
+    Index("ix_orders_payment_status_id", "payment_status", "id"),
+    # Account order history: one customer's orders, newest first.
+    Index("ix_orders_customer_email_date_id", "customer_email", "date", "id"),
+  )
+
+
+class ArchivedOrderDB(Base):
+  """Manifest of orders moved out of `orders` into archive segments (see `archive`)."""
+  __tablename__ = "order_archive_index"
+
+  order_id = Column(String, primary_key=True)
+  month = Column(String, nullable=False, index=True)  # "%Y-%m" of the order date
+  segment = Column(String, nullable=False, index=True)  # file name in ARCHIVE_DIR
+  archived_at = Column(String, nullable=False)
+
+
+class DailySalesDB(Base):
+  """Per-day order totals, maintained by `stats` in the order transactions."""
+  __tablename__ = "stats_daily_sales"
+
+  date = Column(String, primary_key=True)  # order date, "%Y-%m-%d"
+  orders = Column(Integer, nullable=False, default=0)  # orders placed
+  paid_orders = Column(Integer, nullable=False, default=0)
+  revenue = Column(Float, nullable=False, default=0.0)  # total of paid orders
+  units = Column(Integer, nullable=False, default=0)  # units in paid orders
+
+
+class OrderStatusStatsDB(Base):
+  __tablename__ = "stats_order_status"
+
+  date = Column(String, primary_key=True)
+  payment_status = Column(String, primary_key=True)
+  orders = Column(Integer, nullable=False, default=0)
+
+
+class ProductSalesDB(Base):
+  __tablename__ = "stats_product_sales"
+
+  date = Column(String, primary_key=True)
+  product_id = Column(String, primary_key=True, index=True)
+  units = Column(Integer, nullable=False, default=0)  # units in paid orders
+
+
+class WebhookEventDB(QueueBase):
+  __tablename__ = "webhook_events"
+
+  id = Column(String, primary_key=True)  # gateway event ID; redeliveries are dropped
+  event = Column(String, nullable=False)
+  payload = Column(Text, nullable=False)
+  status = Column(String, nullable=False, default="queued")  # queued, processing, processed, skipped, failed
+  attempts = Column(Integer, nullable=False, default=0)
+  received_at = Column(String, nullable=False)
+  claimed_by = Column(String, nullable=True)
+  claimed_at = Column(String, nullable=True)
+  processed_at = Column(String, nullable=True)
+  error = Column(Text, nullable=True)
+  next_attempt_at = Column(String, nullable=True)  # a retried event is not claimed before this
+
+  __table_args__ = (
+    Index("ix_webhook_events_status_received_at", "status", "received_at"),
+    Index("ix_webhook_events_claimed_by", "claimed_by"),
+  )
+
+
+class OrderEventDB(QueueBase):
+  """Order status events shared between API workers (see `events.SQLiteBroker`)."""
+  __tablename__ = "order_events"
+
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  order_id = Column(String, nullable=False)
+  payload = Column(Text, nullable=False)
+  created_at = Column(String, nullable=False, index=True)
@@ -0,0 +1,91 @@
+"""Server-side cart pricing shared by `/cart/quote` and order creation."""
+from __future__ import annotations
+from collections import Counter
+from typing import Iterable
+
+from sqlalchemy.orm import Session
+
+from .cache import LRUCache, catalog_version
+from .crud import get_products_by_ids, get_stock_levels, resolve_product_id
+from .models import effective_price
+from .schemas import CartQuoteLine, CartQuoteResponse, OrderItemInput, product_from_db
+
+# Priced carts keyed by (cart signature, catalog version). Stock is not part of
+# the catalog version, so availability is always re-read in `quote_cart`.
+_priced_carts = LRUCache(maxsize=2048)
+
+
+class UnknownProductError(Exception):
+  """Raised when a cart references a product that does not exist."""
+
+  def __init__(self, product_id: str):
+    super().__init__(f"Unknown product: {product_id}")
+    self.product_id = product_id
+
+
+def cart_signature(items: Iterable[OrderItemInput]) -> tuple[tuple[str, int], ...]:
+  return tuple((resolve_product_id(item.productId), item.quantity) for item in items)
+
+
+def _price(db: Session, signature: tuple[tuple[str, int], ...], requested: list[str]) -> CartQuoteResponse:
+  products = get_products_by_ids(db, [product_id for product_id, _ in signature])
+  lines = []
+  for (product_id, quantity), requested_id in zip(signature, requested):
+    product = products.get(product_id)
+    if product is None:
+      raise UnknownProductError(requested_id)
+    unit = effective_price(product.price, product.discount)
+    lines.append(CartQuoteLine(
+      productId=product_id,
+      product=product_from_db(product),
+      quantity=quantity,
+      unitPrice=product.price,
+      discount=product.discount,
+      effectivePrice=unit,
+      lineTotal=round(unit * quantity, 2),
+    ))
+
+  subtotal = round(sum(line.unitPrice * line.quantity for line in lines), 2)
+  total = round(sum(line.lineTotal for line in lines), 2)
+  return CartQuoteResponse(
+    items=lines,
+    subtotal=subtotal,
+    discountTotal=round(subtotal - total, 2),
+    total=total,
+    available=True,
+    catalogVersion=catalog_version(),
+  )
+
+
+def price_cart(db: Session, items: list[OrderItemInput]) -> CartQuoteResponse:
+  """Price a cart with discounts applied, loading all products in one query.
+
+  Results are memoized per cart signature and catalog version. The returned
+  object is shared between callers and must not be mutated.
+  """
+  signature = cart_signature(items)
+  key = (signature, catalog_version())
+  priced = _priced_carts.get(key)
+  if priced is None:
+    priced = _price(db, signature, [item.productId for item in items])
+    _priced_carts.set(key, priced)
+  return priced
+
+
+def quote_cart(db: Session, items: list[OrderItemInput]) -> CartQuoteResponse:
+  """Price a cart and attach current per-line availability."""
+  priced = price_cart(db, items)
+  stock = get_stock_levels(db, [line.productId for line in priced.items])
+  wanted: Counter = Counter()
+  for line in priced.items:
+    wanted[line.productId] += line.quantity
+
+  lines = []
+  for line in priced.items:
+    level = stock.get(line.productId)
+    lines.append(line.model_copy(update={
+      "stock": level,
+      "available": level is None or level >= wanted[line.productId],
+      "product": line.product.model_copy(update={"stock": level}),
+    }))
+  return priced.model_copy(update={"items": lines, "available": all(line.available for line in lines)})
@@ -0,0 +1,265 @@
+"""Production diagnostics: slow-query capture and opt-in request profiling.
+
+Slow queries: `install_slow_query_log(engine)` times every statement on the
+engine and keeps the ones slower than SLOW_QUERY_MS, with the request path
+that issued them and SQLite's `EXPLAIN QUERY PLAN`, in a bounded ring buffer
+(`/admin/slow-queries`). A full table scan on a new query path shows up there
+as a `SCAN <table>` plan. Bound parameters hold customer emails, phone numbers
+and payment IDs, so only their types are kept unless SLOW_QUERY_PARAMETERS=1.
+
+Request profiling: a request carrying a valid `X-Debug-Profile` token is
+sampled by a stack profiler for its duration. The report is kept in a second
+ring buffer and its ID returned in the `X-Profile-Id` response header; read it
+at `/admin/profiles/{id}`. Tokens are `<expiry>.<hmac>` signed with
+PROFILE_SECRET; profiling is disabled while the secret is unset. The
+diagnostics endpoints themselves require the same token, and requests to them
+are not profiled. Mint one with:
+
+    python -m app.profiling token --ttl 600
+
+Endpoints run in a thread pool, so the sampler walks every thread of the
+worker rather than one thread: samples from requests running at the same time
+are included. Profile on a quiet worker for a clean report.
+"""
+from __future__ import annotations
+import argparse
+import contextvars
+import hashlib
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+
+from sqlalchemy import event
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_BUFFER = int(os.getenv("SLOW_QUERY_BUFFER", "200"))
+SLOW_QUERY_PARAMETERS = os.getenv("SLOW_QUERY_PARAMETERS", "0") == "1"
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_HEADER = b"x-debug-profile"
+PROFILE_BUFFER = 20
+# Reading diagnostics must not record profiles of its own and evict real ones.
+DIAGNOSTICS_PATHS = ("/admin/profiles", "/admin/slow-queries")
+SAMPLE_INTERVAL = 0.001
+
+# Path of the request being served, for attributing slow queries.
+current_path: contextvars.ContextVar[str | None] = contextvars.ContextVar("current_path", default=None)
+
+
+class RingBuffer:
+  """Thread-safe bounded list of the most recent entries."""
+
+  def __init__(self, maxlen: int):
+    self._entries: deque = deque(maxlen=maxlen)
+    self._lock = threading.Lock()
+
+  def append(self, entry) -> None:
+    with self._lock:
+      self._entries.append(entry)
+
+  def recent(self, limit: int | None = None) -> list:
+    with self._lock:
+      entries = list(self._entries)
+    entries.reverse()
+    return entries[:limit] if limit else entries
+
+  def clear(self) -> None:
+    with self._lock:
+      self._entries.clear()
+
+
+slow_queries = RingBuffer(SLOW_QUERY_BUFFER)
+profiles = RingBuffer(PROFILE_BUFFER)
+
+
+def _explain(cursor, statement: str, parameters) -> list[str] | None:
+  if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+    return None
+  if isinstance(parameters, list):  # executemany: explain the first row
+    parameters = parameters[0] if parameters else ()
+  explain = cursor.connection.cursor()
+  try:
+    explain.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+    return [row[-1] for row in explain.fetchall()]
+  except Exception as e:
+    return [f"(plan unavailable: {e})"]
+  finally:
+    explain.close()
+
+
+def describe_parameters(parameters) -> str:
+  """Bound parameters with their values replaced by type names."""
+  if isinstance(parameters, list):  # executemany
+    return f"{len(parameters)} rows of {describe_parameters(parameters[0]) if parameters else '()'}"
+  if isinstance(parameters, dict):
+    return "{" + ", ".join(f"{name}: {type(value).__name__}" for name, value in parameters.items()) + "}"
+  return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+
+
+def install_slow_query_log(engine, threshold_ms: float = SLOW_QUERY_MS) -> None:
+  """Record statements on `engine` that take longer than `threshold_ms`."""
+  explain_plans = engine.dialect.name == "sqlite"
+
+  @event.listens_for(engine, "before_cursor_execute")
+  def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    context._slow_query_started = time.perf_counter()
+
+  @event.listens_for(engine, "after_cursor_execute")
+  def _record_slow(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - context._slow_query_started) * 1000
+    if elapsed_ms < threshold_ms:
+      return
+    slow_queries.append({
+      "at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f"),
+      "durationMs": round(elapsed_ms, 2),
+      "path": current_path.get(),
+      "statement": statement,
+      "parameters": repr(parameters)[:1000] if SLOW_QUERY_PARAMETERS else describe_parameters(parameters),
+      "executemany": executemany,
+      "plan": _explain(cursor, statement, parameters) if explain_plans else None,
+    })
+
+
+def sign_token(expires: int, secret: str = PROFILE_SECRET) -> str:
+  signature = hmac.new(secret.encode(), str(expires).encode(), hashlib.sha256).hexdigest()
+  return f"{expires}.{signature}"
+
+
+def token_is_valid(token: str, secret: str = PROFILE_SECRET) -> bool:
+  if not secret:
+    return False
+  expires, _, _ = token.partition(".")
+  if not expires.isdigit() or int(expires) < time.time():
+    return False
+  return hmac.compare_digest(token, sign_token(int(expires), secret))
+
+
+# Leaf frames of threads that are idle rather than doing work.
+IDLE_FRAMES = {
+  ("threading.py", "wait"),
+  ("queue.py", "get"),
+  ("selectors.py", "select"),
+  ("runners.py", "run"),
+  ("base_events.py", "run_forever"),
+  ("base_events.py", "_run_once"),
+}
+
+
+class StackSampler:
+  """Samples the Python stacks of all other threads at a fixed interval."""
+
+  def __init__(self, interval: float = SAMPLE_INTERVAL):
+    self.interval = interval
+    self.samples = 0
+    self.own: Counter = Counter()
+    self.total: Counter = Counter()
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+  def _run(self) -> None:
+    me = threading.get_ident()
+    while not self._stop.wait(self.interval):
+      for thread_id, frame in sys._current_frames().items():
+        if thread_id == me:
+          continue
+        code = frame.f_code
+        if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+          continue
+        self.samples += 1
+        seen = set()
+        leaf = True
+        while frame is not None:
+          code = frame.f_code
+          key = (code.co_filename, code.co_firstlineno, code.co_name)
+          if leaf:
+            self.own[key] += 1
+            leaf = False
+          if key not in seen:
+            seen.add(key)
+            self.total[key] += 1
+          frame = frame.f_back
+
+  def __enter__(self) -> "StackSampler":
+    self._thread.start()
+    return self
+
+  def __exit__(self, *exc) -> None:
+    self._stop.set()
+    self._thread.join()
+
+  def report(self, limit: int = 40) -> list[dict]:
+    ms = self.interval * 1000
+    return [
+      {
+        "function": f"{name} ({filename}:{line})",
+        "ownMs": round(self.own[(filename, line, name)] * ms, 1),
+        "totalMs": round(count * ms, 1),
+      }
+      for (filename, line, name), count in self.total.most_common(limit)
+    ]
+
+
+_profile_ids = itertools.count(1)
+
+
+class ProfilingMiddleware:
+  """Tags requests with their path and profiles the ones with a valid token."""
+
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    path_token = current_path.set(f'{scope["method"]} {scope["path"]}')
+    try:
+      token = dict(scope.get("headers") or []).get(PROFILE_HEADER)
+      if token is None or scope["path"].startswith(DIAGNOSTICS_PATHS) or not token_is_valid(token.decode("latin-1")):
+        await self.app(scope, receive, send)
+        return
+      await self._profile(scope, receive, send)
+    finally:
+      current_path.reset(path_token)
+
+  async def _profile(self, scope, receive, send):
+    profile_id = f"{next(_profile_ids)}-{uuid.uuid4().hex[:8]}"
+
+    async def send_with_id(message):
+      if message["type"] == "http.response.start":
+        message = {**message, "headers": [*message["headers"], (b"x-profile-id", profile_id.encode())]}
+      await send(message)
+
+    started = time.perf_counter()
+    with StackSampler() as sampler:
+      await self.app(scope, receive, send_with_id)
+    profiles.append({
+      "id": profile_id,
+      "at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f"),
+      "path": current_path.get(),
+      "query": scope.get("query_string", b"").decode("latin-1"),
+      "durationMs": round((time.perf_counter() - started) * 1000, 2),
+      "samples": sampler.samples,
+      "intervalMs": sampler.interval * 1000,
+      "functions": sampler.report(),
+    })
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Request profiling helpers.")
+  commands = parser.add_subparsers(dest="command", required=True)
+  token = commands.add_parser("token", help="print a signed X-Debug-Profile token")
+  token.add_argument("--ttl", type=int, default=600, help="seconds until the token expires")
+  args = parser.parse_args()
+  if not PROFILE_SECRET:
+    parser.error("set PROFILE_SECRET to the value the API uses")
+  print(sign_token(int(time.time()) + args.ttl))
+
+
+if __name__ == "__main__":
+  main()
@@ -8,6 +8,7 @@ load_dotenv()
 
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID", "")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET", "")
+RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET", "")
 
 if not RAZORPAY_KEY_ID or not RAZORPAY_KEY_SECRET:
     print("Warning: Razorpay credentials not found in environment variables")
@@ -33,21 +34,35 @@ def create_razorpay_order(amount: float, currency: str = "INR", receipt: str = N
     return order
 
 
+def _signature_matches(secret: str, message: bytes, signature: str) -> bool:
+    """Constant-time check of a hex HMAC-SHA256 signature."""
+    try:
+        generated_signature = hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(generated_signature, signature)
+    except Exception as e:
+        print(f"Signature verification failed: {e}")
+        return False
+
+
 def verify_payment_signature(razorpay_order_id: str, razorpay_payment_id: str, razorpay_signature: str) -> bool:
     """
     Verify Razorpay payment signature to ensure payment authenticity.
     """
-    try:
-        generated_signature = hmac.new(
-            RAZORPAY_KEY_SECRET.encode(),
-            f"{razorpay_order_id}|{razorpay_payment_id}".encode(),
-            hashlib.sha256
-        ).hexdigest()
-        
-        return hmac.compare_digest(generated_signature, razorpay_signature)
-    except Exception as e:
-        print(f"Signature verification failed: {e}")
+    return _signature_matches(
+        RAZORPAY_KEY_SECRET,
+        f"{razorpay_order_id}|{razorpay_payment_id}".encode(),
+        razorpay_signature,
+    )
+
+
+def verify_webhook_signature(body: bytes, signature: str | None) -> bool:
+    """
+    Verify the X-Razorpay-Signature header of a webhook delivery.
+    Razorpay signs the raw request body with the webhook secret.
+    """
+    if not RAZORPAY_WEBHOOK_SECRET or not signature:
         return False
+    return _signature_matches(RAZORPAY_WEBHOOK_SECRET, body, signature)
 
 
 def get_payment_details(payment_id: str):
@@ -57,3 +72,12 @@ def get_payment_details(payment_id: str):
     except Exception as e:
         print(f"Failed to fetch payment: {e}")
         return None
+
+
+def get_order_payments(razorpay_order_id: str):
+    """Fetch all payment attempts made against a Razorpay order."""
+    try:
+        return razorpay_client.order.payments(razorpay_order_id).get("items", [])
+    except Exception as e:
+        print(f"Failed to fetch payments for order: {e}")
+        return None
@@ -0,0 +1,274 @@
+"""Reconcile unpaid orders against the payment gateway.
+
+Repairs orders whose `/payments/verify` call (and webhook) never arrived:
+pages through `pending`/`failed` orders that have a Razorpay order ID, asks
+the gateway for their payments with bounded concurrency and a global rate
+limit, and applies the outcomes in one transaction per page. Orders the
+reservation sweeper already expired are checked too, back to
+RECONCILE_EXPIRED_DAYS: when both confirmations are lost the sweeper gets to
+them first, and a captured payment then re-reserves their stock. A payment
+that cannot be honoured (the stock has sold since, or the captured amount is
+not the order total) leaves the order cancelled as "refund_due".
+
+Run it as a command:
+
+    python -m app.reconcile --concurrency 8 --rate 20
+
+or periodically from the API process by setting RECONCILE_INTERVAL_SECONDS.
+"""
+from __future__ import annotations
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from .crud import UNPAID_STATUSES, mark_order_paid, mark_order_payment_failed
+from .database import SessionLocal
+from .models import OrderDB
+
+# How far back (by order date) expired orders are rechecked.
+RECONCILE_EXPIRED_DAYS = int(os.getenv("RECONCILE_EXPIRED_DAYS", "7"))
+RECONCILE_STATUSES = (*UNPAID_STATUSES, "expired")
+
+
+class RazorpayGateway:
+  """Gateway lookups backed by the Razorpay API."""
+
+  def order_payments(self, razorpay_order_id: str, razorpay_payment_id: str | None = None) -> list[dict] | None:
+    from .razorpay_utils import get_order_payments, get_payment_details
+
+    if razorpay_payment_id:
+      payment = get_payment_details(razorpay_payment_id)
+      if payment and payment.get("status") == "captured":
+        return [payment]
+    return get_order_payments(razorpay_order_id)
+
+
+class FakeGateway:
+  """In-memory stand-in for the gateway, for local runs and tests.
+
+  `payments` maps a Razorpay order ID to the payment dicts it should report;
+  `latency` simulates network time per call.
+  """
+
+  def __init__(self, payments: dict[str, list[dict]] | None = None, latency: float = 0.0):
+    self.payments = payments or {}
+    self.latency = latency
+    self.calls = 0
+    self._lock = threading.Lock()
+
+  def order_payments(self, razorpay_order_id: str, razorpay_payment_id: str | None = None) -> list[dict] | None:
+    with self._lock:
+      self.calls += 1
+    if self.latency:
+      time.sleep(self.latency)
+    return self.payments.get(razorpay_order_id, [])
+
+
+class RateLimiter:
+  """Spaces calls across threads to at most `rate` per second (0 = unlimited)."""
+
+  def __init__(self, rate: float):
+    self.interval = 1.0 / rate if rate > 0 else 0.0
+    self._next = time.monotonic()
+    self._lock = threading.Lock()
+
+  def wait(self) -> None:
+    if not self.interval:
+      return
+    with self._lock:
+      now = time.monotonic()
+      slot = max(now, self._next)
+      self._next = slot + self.interval
+    if slot > now:
+      time.sleep(slot - now)
+
+
+@dataclass
+class ReconcileStats:
+  scanned: int = 0
+  paid: int = 0
+  refund_due: int = 0
+  failed: int = 0
+  unchanged: int = 0
+  errors: int = 0
+  gateway_calls: int = 0
+  pages: int = 0
+  started_at: float = field(default_factory=time.monotonic)
+
+  @property
+  def elapsed(self) -> float:
+    return time.monotonic() - self.started_at
+
+  def as_dict(self) -> dict:
+    return {
+      "scanned": self.scanned,
+      "paid": self.paid,
+      "refundDue": self.refund_due,
+      "failed": self.failed,
+      "unchanged": self.unchanged,
+      "errors": self.errors,
+      "gatewayCalls": self.gateway_calls,
+      "pages": self.pages,
+      "elapsedSeconds": round(self.elapsed, 2),
+      "ordersPerSecond": round(self.scanned / self.elapsed, 1) if self.elapsed else 0.0,
+    }
+
+
+def outcome(payments: list[dict]) -> tuple[str | None, str | None, int | None]:
+  """Reduce a gateway payment list to ("paid"|"failed"|None, payment_id, amount in paise)."""
+  for payment in payments:
+    if payment.get("status") == "captured":
+      return "paid", payment.get("id"), payment.get("amount")
+  if payments and all(p.get("status") == "failed" for p in payments):
+    return "failed", payments[-1].get("id"), None
+  return None, None, None
+
+
+def _page(db: Session, status: str, after: str, page_size: int, since: str | None = None) -> list[tuple[str, str, str | None]]:
+  # Keyset pagination over the (payment_status, id) index.
+  query = db.query(OrderDB.id, OrderDB.razorpay_order_id, OrderDB.razorpay_payment_id).filter(
+    OrderDB.payment_status == status, OrderDB.id > after, OrderDB.razorpay_order_id.isnot(None)
+  )
+  if since is not None:
+    query = query.filter(OrderDB.date >= since)
+  return query.order_by(OrderDB.id).limit(page_size).all()
+
+
+def _apply(db: Session, order_id: str, result: str, razorpay_order_id: str, payment_id: str | None, amount: int | None) -> str | None:
+  """Apply one outcome; returns the order's new payment status, or None if unchanged."""
+  order = db.get(OrderDB, order_id)
+  if order is None:
+    return None
+  if result == "paid":
+    changed = mark_order_paid(db, order, razorpay_order_id, payment_id, amount=amount)
+  else:
+    changed = mark_order_payment_failed(db, order, razorpay_order_id, payment_id)
+  return order.payment_status if changed else None
+
+
+def _apply_page(updates: list[tuple[str, str, str, str | None, int | None]], stats: ReconcileStats) -> None:
+  """Apply a page of outcomes in one transaction, or one by one if that fails."""
+  db = SessionLocal()
+  try:
+    changed = [status for status in (_apply(db, *u) for u in updates) if status]
+    db.commit()
+  except Exception:
+    db.rollback()
+    changed = []
+    for update in updates:
+      try:
+        status = _apply(db, *update)
+        db.commit()
+      except Exception as e:
+        db.rollback()
+        stats.errors += 1
+        print(f"Order {update[0]} could not be updated: {e}")
+      else:
+        if status:
+          changed.append(status)
+  finally:
+    db.close()
+
+  for status in changed:
+    if status == "paid":
+      stats.paid += 1
+    elif status == "refund_due":
+      stats.refund_due += 1
+    else:
+      stats.failed += 1
+  stats.unchanged += len(updates) - len(changed)
+
+
+def reconcile_pending_orders(
+  gateway=None,
+  concurrency: int = 8,
+  rate: float = 20.0,
+  page_size: int = 200,
+  progress=None,
+  expired_days: int = RECONCILE_EXPIRED_DAYS,
+) -> ReconcileStats:
+  """Check every unpaid order with a gateway order against the gateway.
+
+  Expired orders are included if they were placed in the last `expired_days`
+  days. At most `concurrency` lookups run at once and no more than `rate` start per
+  second. `progress`, if given, is called with the stats after each page.
+  """
+  gateway = gateway or RazorpayGateway()
+  limiter = RateLimiter(rate)
+  stats = ReconcileStats()
+
+  def lookup(row):
+    limiter.wait()
+    return row, gateway.order_payments(row[1], row[2])
+
+  # Orders moved from pending to failed in this run show up again in the
+  # failed pass; they were just checked, so skip them.
+  checked: set[str] = set()
+  expired_since = (datetime.utcnow() - timedelta(days=expired_days)).strftime("%Y-%m-%d")
+
+  with ThreadPoolExecutor(max_workers=concurrency) as pool:
+    for status in RECONCILE_STATUSES:
+      since = expired_since if status == "expired" else None
+      after = ""
+      while True:
+        db = SessionLocal()
+        try:
+          rows = _page(db, status, after, page_size, since)
+        finally:
+          db.close()
+        if not rows:
+          break
+        after = rows[-1][0]
+        rows = [row for row in rows if row[0] not in checked]
+        checked.update(row[0] for row in rows)
+
+        updates = []
+        for (order_id, razorpay_order_id, _), payments in pool.map(lookup, rows):
+          stats.gateway_calls += 1
+          if payments is None:
+            stats.errors += 1
+            continue
+          result, payment_id, amount = outcome(payments)
+          if result is None or result == status or (status == "expired" and result == "failed"):
+            stats.unchanged += 1
+          else:
+            updates.append((order_id, result, razorpay_order_id, payment_id, amount))
+
+        if updates:
+          _apply_page(updates, stats)
+        stats.scanned += len(rows)
+        stats.pages += 1
+        if progress:
+          progress(stats)
+  return stats
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Reconcile unpaid orders with Razorpay.")
+  parser.add_argument("--concurrency", type=int, default=8, help="parallel gateway lookups")
+  parser.add_argument("--rate", type=float, default=20.0, help="max gateway calls per second (0 = unlimited)")
+  parser.add_argument("--page-size", type=int, default=200, help="orders per page/transaction")
+  parser.add_argument("--expired-days", type=int, default=RECONCILE_EXPIRED_DAYS, help="recheck expired orders placed this many days back")
+  args = parser.parse_args()
+
+  def report(stats: ReconcileStats) -> None:
+    print(f"scanned={stats.scanned} paid={stats.paid} refund_due={stats.refund_due} failed={stats.failed} errors={stats.errors} elapsed={stats.elapsed:.1f}s")
+
+  stats = reconcile_pending_orders(
+    concurrency=args.concurrency,
+    rate=args.rate,
+    page_size=args.page_size,
+    progress=report,
+    expired_days=args.expired_days,
+  )
+  print(stats.as_dict())
+
+
+if __name__ == "__main__":
+  main()
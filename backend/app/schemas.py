@@ -1,5 +1,7 @@
-from typing import List, Optional
-from pydantic import BaseModel, EmailStr, Field
+from typing import Any, Dict, List, Literal, Optional
+from pydantic import BaseModel, EmailStr, Field, computed_field, model_validator
+
+from .images import LOGO_VARIANTS, PRODUCT_VARIANTS, variant_urls
 
 
 class Product(BaseModel):
@@ -15,6 +17,67 @@ class Product(BaseModel):
     rating: float
     reviewCount: int
     discount: Optional[int] = None
+    stock: Optional[int] = None
+    effectivePrice: Optional[float] = None
+
+    @computed_field
+    @property
+    def imageVariants(self) -> Dict[str, str]:
+        return variant_urls(self.imageUrl, PRODUCT_VARIANTS)
+
+
+def product_from_db(p) -> Product:
+    """Build the API representation of a `ProductDB` row."""
+    return Product(
+        id=p.id,
+        name=p.name,
+        description=p.description,
+        price=p.price,
+        brand=p.brand,
+        manufacturer=p.manufacturer,
+        category=p.category,
+        imageUrl=p.imageUrl,
+        imageHint=p.imageHint,
+        rating=p.rating,
+        reviewCount=p.reviewCount,
+        discount=p.discount,
+        stock=p.stock,
+        effectivePrice=p.effective_price,
+    )
+
+
+# API field name -> ProductDB attribute, for sparse fieldsets.
+PRODUCT_FIELD_COLUMNS = {
+    "id": "id",
+    "name": "name",
+    "description": "description",
+    "price": "price",
+    "brand": "brand",
+    "manufacturer": "manufacturer",
+    "category": "category",
+    "imageUrl": "imageUrl",
+    "imageHint": "imageHint",
+    "rating": "rating",
+    "reviewCount": "reviewCount",
+    "discount": "discount",
+    "stock": "stock",
+    "effectivePrice": "effective_price",
+    "imageVariants": "imageUrl",
+}
+
+# Named fieldset presets for `GET /products?view=`; "full" is the complete Product.
+PRODUCT_VIEWS = {
+    "card": ("id", "name", "price", "discount", "effectivePrice", "imageUrl", "imageVariants", "imageHint", "rating"),
+    "full": tuple(PRODUCT_FIELD_COLUMNS),
+}
+
+
+def product_fields_from_db(p, fields) -> dict:
+    """Only the requested API fields of a `ProductDB` row."""
+    row = {field: getattr(p, PRODUCT_FIELD_COLUMNS[field]) for field in fields}
+    if "imageVariants" in row:
+        row["imageVariants"] = variant_urls(row["imageVariants"], PRODUCT_VARIANTS)
+    return row
 
 
 class Brand(BaseModel):
@@ -23,6 +86,11 @@ class Brand(BaseModel):
     logoUrl: str
     logoHint: str
 
+    @computed_field
+    @property
+    def logoVariants(self) -> Dict[str, str]:
+        return variant_urls(self.logoUrl, LOGO_VARIANTS)
+
 
 class Manufacturer(BaseModel):
     id: str
@@ -44,6 +112,8 @@ class Order(BaseModel):
     items: List[CartItem]
     payment_status: Optional[str] = "pending"
     razorpay_order_id: Optional[str] = None
+    shippingCost: Optional[float] = None
+    archived: bool = False
 
 
 class OrderItemInput(BaseModel):
@@ -61,7 +131,33 @@ class ShippingAddress(BaseModel):
 class OrderCreateRequest(BaseModel):
     items: List[OrderItemInput]
     customerEmail: Optional[EmailStr] = None
-    shippingAddress: Optional[ShippingAddress] = None
+    # Required: the PIN code decides whether we deliver and what shipping costs.
+    shippingAddress: ShippingAddress
+
+
+class CartQuoteRequest(BaseModel):
+    items: List[OrderItemInput] = Field(..., min_length=1)
+
+
+class CartQuoteLine(BaseModel):
+    productId: str
+    product: Product
+    quantity: int
+    unitPrice: float
+    discount: Optional[int] = None
+    effectivePrice: float
+    lineTotal: float
+    available: bool = True
+    stock: Optional[int] = None
+
+
+class CartQuoteResponse(BaseModel):
+    items: List[CartQuoteLine]
+    subtotal: float
+    discountTotal: float
+    total: float
+    available: bool
+    catalogVersion: int
 
 
 class ProductsResponse(BaseModel):
@@ -69,10 +165,40 @@ class ProductsResponse(BaseModel):
     total: int
 
 
+PRODUCT_BATCH_LIMIT = 300
+
+
+class ProductBatchRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=PRODUCT_BATCH_LIMIT)
+
+
+class ProductBatchResponse(BaseModel):
+    items: List[Product]
+    missing: List[str]
+    # Legacy IDs in the request -> the product IDs they resolved to.
+    aliases: Dict[str, str] = {}
+
+
 class OrderCreateResponse(BaseModel):
     order: Order
 
 
+class ShippingQuoteResponse(BaseModel):
+    pin: str
+    serviceable: bool
+    zone: Optional[str] = None
+    region: Optional[str] = None
+    etaMinDays: Optional[int] = None
+    etaMaxDays: Optional[int] = None
+    cost: Optional[float] = None
+    freeAbove: float
+
+
+class AccountOrdersResponse(BaseModel):
+    items: List[Order]
+    nextCursor: Optional[str] = None
+
+
 class RazorpayOrderRequest(BaseModel):
     amount: float
     currency: str = "INR"
@@ -130,4 +256,81 @@ class ProductCreateRequest(BaseModel):
     rating: Optional[float] = Field(default=0.0, ge=0, le=5)
     reviewCount: Optional[int] = Field(default=0, ge=0)
     discount: Optional[int] = Field(default=None, ge=0, le=100)
+    stock: Optional[int] = Field(default=None, ge=0)
+
+
+
+class ProductChanges(BaseModel):
+    """Fields a bulk update may set. Only fields present in the request are changed;
+    an explicit `"discount": null` clears the discount."""
+    price: Optional[float] = Field(default=None, gt=0)
+    discount: Optional[int] = Field(default=None, ge=0, le=100)
+    priceMultiplier: Optional[float] = Field(default=None, gt=0)
+
+    @model_validator(mode="after")
+    def check_changes(self):
+        changed = self.model_fields_set - {"id"}
+        if not changed:
+            raise ValueError("At least one change is required")
+        if {"price", "priceMultiplier"} <= changed:
+            raise ValueError("Use either price or priceMultiplier, not both")
+        if ("price" in changed and self.price is None) or ("priceMultiplier" in changed and self.priceMultiplier is None):
+            raise ValueError("price and priceMultiplier cannot be null")
+        return self
+
+
+class BulkProductItem(ProductChanges):
+    id: str = Field(..., min_length=1)
+
+
+class BulkProductFilter(BaseModel):
+    category: Optional[str] = None
+    brand: Optional[str] = None
+    manufacturer: Optional[str] = None
+    # Must be set to match every product, so that an empty filter is never a catalog-wide update.
+    all: bool = False
+
+    def fields(self) -> Dict[str, str]:
+        return {name: value for name, value in self.model_dump(exclude={"all"}).items() if value}
+
+
+class BulkProductUpdateRequest(BaseModel):
+    items: Optional[List[BulkProductItem]] = None
+    filter: Optional[BulkProductFilter] = None
+    set: Optional[ProductChanges] = None
+    dryRun: bool = False
+
+    @model_validator(mode="after")
+    def check_mode(self):
+        if (self.items is None) == (self.filter is None):
+            raise ValueError("Provide either items or filter")
+        if self.filter is not None and self.set is None:
+            raise ValueError("A filter update needs a set operation")
+        if self.filter is not None and not self.filter.all and not self.filter.fields():
+            raise ValueError('An empty filter matches every product; send "all": true to update the whole catalog')
+        return self
+
+
+class BulkProductUpdateResponse(BaseModel):
+    matched: int
+    updated: int
+    missing: List[str] = []
+    dryRun: bool
+    catalogVersion: int
+
+
+class CatalogChange(BaseModel):
+    seq: int
+    kind: Literal["brand", "manufacturer", "product"]
+    id: str
+    op: Literal["upsert", "delete"]
+    updatedAt: Optional[str] = None
+    # Current state of the row for upserts; omitted for deletions.
+    data: Optional[Dict[str, Any]] = None
+
 
+class ChangesResponse(BaseModel):
+    changes: List[CatalogChange]
+    nextSince: str
+    hasMore: bool
+    sequence: int
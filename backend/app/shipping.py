@@ -0,0 +1,134 @@
+"""Delivery zones, ETAs and shipping cost by PIN code.
+
+The PIN table is loaded once from a CSV file (SHIPPING_DATA_FILE, default
+`shipping_pins.csv` next to this module) of `start,end` PIN ranges with a
+zone, region name, ETA in days and a serviceable flag; single PINs are rows
+with start = end. Contiguous rows with the same attributes are merged, and the
+ranges are kept in parallel `array`s of range starts, ends and an index into
+the distinct attribute tuples, so even the full India Post directory (about
+19,000 PINs) fits in a few hundred kilobytes. A lookup is one bisect over the
+range starts: no database query or external call on the checkout path.
+
+Cost is a per-zone base rate plus a charge per additional unit, and free
+above SHIPPING_FREE_ABOVE.
+"""
+from __future__ import annotations
+import csv
+import os
+import sys
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Iterable
+
+SHIPPING_DATA_FILE = os.getenv("SHIPPING_DATA_FILE", os.path.join(os.path.dirname(__file__), "shipping_pins.csv"))
+SHIPPING_FREE_ABOVE = float(os.getenv("SHIPPING_FREE_ABOVE", "5000"))
+
+# Rupees for the first unit, per zone.
+SHIPPING_RATES = {"A": 49.0, "B": 79.0, "C": 99.0, "D": 129.0, "E": 199.0}
+SHIPPING_PER_EXTRA_UNIT = 20.0
+
+
+class InvalidPinError(ValueError):
+  """Raised for a PIN code that is not six digits."""
+
+  def __init__(self, pin: str):
+    super().__init__(f"Invalid PIN code: {pin}")
+    self.pin = pin
+
+
+@dataclass(frozen=True)
+class ShippingZone:
+  zone: str
+  region: str
+  eta_min: int
+  eta_max: int
+  serviceable: bool
+
+
+@dataclass(frozen=True)
+class ShippingQuote:
+  pin: str
+  serviceable: bool
+  zone: ShippingZone | None
+  cost: float | None
+
+
+class PinTable:
+  """Sorted, non-overlapping PIN ranges mapped to a `ShippingZone`."""
+
+  def __init__(self, rows: Iterable[tuple[int, int, ShippingZone]]):
+    self.starts = array("I")
+    self.ends = array("I")
+    self.zone_ids = array("H")
+    self.zones: list[ShippingZone] = []
+    interned: dict[ShippingZone, int] = {}
+    for start, end, zone in sorted(rows, key=lambda row: row[0]):
+      if start > end:
+        raise ValueError(f"PIN range {start}-{end} is reversed")
+      zone_id = interned.setdefault(zone, len(interned))
+      if zone_id == len(self.zones):
+        self.zones.append(zone)
+      if self.ends and start <= self.ends[-1]:
+        raise ValueError(f"PIN range {start}-{end} overlaps the range ending at {self.ends[-1]}")
+      if self.ends and start == self.ends[-1] + 1 and self.zone_ids[-1] == zone_id:
+        self.ends[-1] = end  # contiguous with the same attributes: extend
+        continue
+      self.starts.append(start)
+      self.ends.append(end)
+      self.zone_ids.append(zone_id)
+
+  def __len__(self) -> int:
+    return len(self.starts)
+
+  def lookup(self, pin: int) -> ShippingZone | None:
+    i = bisect_right(self.starts, pin) - 1
+    if i < 0 or pin > self.ends[i]:
+      return None
+    return self.zones[self.zone_ids[i]]
+
+  def nbytes(self) -> int:
+    arrays = sum(a.itemsize * len(a) for a in (self.starts, self.ends, self.zone_ids))
+    return arrays + sum(sys.getsizeof(zone) for zone in self.zones)
+
+
+def load_pin_table(path: str = SHIPPING_DATA_FILE) -> PinTable:
+  def rows():
+    with open(path, newline="") as f:
+      for row in csv.DictReader(line for line in f if not line.startswith("#")):
+        yield int(row["start"]), int(row["end"]), ShippingZone(
+          zone=row["zone"],
+          region=row["region"],
+          eta_min=int(row["eta_min"]),
+          eta_max=int(row["eta_max"]),
+          serviceable=row["serviceable"] == "1",
+        )
+
+  return PinTable(rows())
+
+
+_table: PinTable | None = None
+
+
+def pin_table() -> PinTable:
+  global _table
+  if _table is None:
+    _table = load_pin_table()
+  return _table
+
+
+def shipping_cost(zone: ShippingZone, subtotal: float, units: int) -> float:
+  if subtotal >= SHIPPING_FREE_ABOVE:
+    return 0.0
+  return round(SHIPPING_RATES[zone.zone] + SHIPPING_PER_EXTRA_UNIT * max(0, units - 1), 2)
+
+
+def quote_shipping(pin: str, subtotal: float = 0.0, units: int = 1) -> ShippingQuote:
+  """Zone, ETA and cost of delivering `units` items worth `subtotal` to `pin`."""
+  pin = pin.strip().replace(" ", "")
+  if len(pin) != 6 or not pin.isdigit() or pin[0] == "0":
+    raise InvalidPinError(pin)
+  zone = pin_table().lookup(int(pin))
+  if zone is None or not zone.serviceable:
+    return ShippingQuote(pin=pin, serviceable=False, zone=zone, cost=None)
+  return ShippingQuote(pin=pin, serviceable=True, zone=zone, cost=shipping_cost(zone, subtotal, units))
@@ -0,0 +1,191 @@
+"""Content-based "similar parts" index over product text.
+
+Products are turned into sparse TF-IDF rows built from name, category and
+description. The postings (term -> {product_id: weight}) are the column view
+of the same sparse matrix, so a similarity query is a sparse matrix-vector
+product that only touches the query's non-zero terms, and within each term
+only its heaviest postings. Everything is computed locally; no external
+embedding service is involved.
+"""
+from __future__ import annotations
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from functools import lru_cache
+from operator import itemgetter
+from typing import Iterable
+
+from .models import ProductDB
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = frozenset({
+  "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into",
+  "is", "it", "its", "of", "on", "or", "that", "the", "this", "to", "with",
+  "your", "you", "our", "all", "any", "more", "most",
+})
+
+# Each field's tokens are counted this many times in the product's document.
+FIELD_WEIGHTS = (("name", 2), ("category", 3), ("description", 1))
+
+# Only the heaviest query terms are expanded; the long tail adds cost, not ranking.
+MAX_QUERY_TERMS = 24
+
+# Terms present in more than this share of a large catalog carry almost no
+# signal but have the longest postings, so they are skipped at query time.
+MAX_DF_RATIO = 0.2
+MIN_DOCS_FOR_DF_CUTOFF = 1000
+
+# Only a term's heaviest postings are scored. Products that share a query
+# term but carry little weight for it rarely reach the top results, and long
+# postings (a category word across 100k parts) are what make queries slow.
+MAX_POSTINGS_PER_TERM = 200
+
+# Answers are memoized until the next mutation; detail pages ask the same
+# question over and over.
+RESULT_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=16384)
+def tokenize(text: str | None) -> tuple[str, ...]:
+  # Cached: categories, and descriptions shared by a product line, repeat a lot.
+  if not text:
+    return ()
+  return tuple(t for t in _TOKEN_RE.findall(text.lower()) if t not in STOP_WORDS and len(t) > 1)
+
+
+def _term_counts(product: ProductDB) -> Counter:
+  counts: Counter = Counter()
+  for field, weight in FIELD_WEIGHTS:
+    for token in tokenize(getattr(product, field, None)):
+      counts[token] += weight
+  return counts
+
+
+class SimilarityIndex:
+  """In-memory sparse TF-IDF index supporting incremental per-product updates.
+
+  `build` computes every row against the current document frequencies.
+  `upsert`/`remove` keep the index current as products change; rows that were
+  not touched keep the IDF weights they were built with until the next
+  `build`, which is cheap enough to run at startup.
+  """
+
+  def __init__(self) -> None:
+    self._lock = threading.RLock()
+    self._counts: dict[str, Counter] = {}
+    self._df: Counter = Counter()
+    self._rows: dict[str, dict[str, float]] = {}
+    self._postings: dict[str, dict[str, float]] = defaultdict(dict)
+    # term -> its heaviest postings, best first; dropped when the term changes.
+    self._top_postings: dict[str, list[tuple[str, float]]] = {}
+    self._results: dict[tuple[str, int], list[tuple[str, float]]] = {}
+
+  def __len__(self) -> int:
+    return len(self._rows)
+
+  def __contains__(self, product_id: str) -> bool:
+    return product_id in self._rows
+
+  def _idf(self, term: str) -> float:
+    return math.log((1 + len(self._counts)) / (1 + self._df[term])) + 1.0
+
+  def _weigh(self, counts: Counter, idf: dict[str, float] | None = None) -> dict[str, float]:
+    weight = self._idf if idf is None else idf.__getitem__
+    row = {term: (1.0 + math.log(tf)) * weight(term) for term, tf in counts.items()}
+    norm = math.sqrt(sum(w * w for w in row.values()))
+    if norm == 0:
+      return {}
+    return {term: w / norm for term, w in row.items()}
+
+  def _index_row(self, product_id: str, idf: dict[str, float] | None = None) -> None:
+    row = self._weigh(self._counts[product_id], idf)
+    self._rows[product_id] = row
+    for term, weight in row.items():
+      self._postings[term][product_id] = weight
+      self._top_postings.pop(term, None)
+
+  def _unindex_row(self, product_id: str) -> None:
+    for term in self._rows.pop(product_id, {}):
+      self._top_postings.pop(term, None)
+      postings = self._postings.get(term)
+      if postings is not None:
+        postings.pop(product_id, None)
+        if not postings:
+          del self._postings[term]
+
+  def build(self, products: Iterable[ProductDB]) -> None:
+    """Rebuild the whole index from scratch."""
+    with self._lock:
+      self._counts = {p.id: _term_counts(p) for p in products}
+      self._df = Counter()
+      for counts in self._counts.values():
+        self._df.update(counts.keys())
+      self._rows = {}
+      self._postings = defaultdict(dict)
+      self._top_postings = {}
+      self._results.clear()
+      doc_count = len(self._counts)
+      idf = {term: math.log((1 + doc_count) / (1 + df)) + 1.0 for term, df in self._df.items()}
+      for product_id in self._counts:
+        self._index_row(product_id, idf)
+      # Ready before the first query (and shared by preforked workers).
+      for term in self._postings:
+        self._heaviest_postings(term)
+
+  def upsert(self, product: ProductDB) -> None:
+    """Add or refresh a single product's row."""
+    with self._lock:
+      self.remove(product.id)
+      counts = _term_counts(product)
+      self._counts[product.id] = counts
+      self._df.update(counts.keys())
+      self._index_row(product.id)
+      self._results.clear()
+
+  def remove(self, product_id: str) -> None:
+    with self._lock:
+      counts = self._counts.pop(product_id, None)
+      if counts is None:
+        return
+      self._df.subtract(counts.keys())
+      self._unindex_row(product_id)
+      self._results.clear()
+
+  def _heaviest_postings(self, term: str) -> list[tuple[str, float]]:
+    top = self._top_postings.get(term)
+    if top is None:
+      top = heapq.nlargest(MAX_POSTINGS_PER_TERM, self._postings.get(term, {}).items(), key=itemgetter(1))
+      self._top_postings[term] = top
+    return top
+
+  def similar(self, product_id: str, limit: int = 8) -> list[tuple[str, float]]:
+    """Return up to `limit` (product_id, cosine score) pairs, best first."""
+    with self._lock:
+      cached = self._results.get((product_id, limit))
+      if cached is not None:
+        return cached
+      row = self._rows.get(product_id)
+      if not row:
+        return []
+      doc_count = len(self._counts)
+      max_df = doc_count * MAX_DF_RATIO if doc_count >= MIN_DOCS_FOR_DF_CUTOFF else doc_count
+      terms = heapq.nlargest(MAX_QUERY_TERMS, row.items(), key=lambda item: item[1])
+
+      scores: dict[str, float] = defaultdict(float)
+      for term, weight in terms:
+        if self._df[term] > max_df:
+          continue
+        for other_id, other_weight in self._heaviest_postings(term):
+          scores[other_id] += weight * other_weight
+      scores.pop(product_id, None)
+      result = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+      if len(self._results) >= RESULT_CACHE_SIZE:
+        self._results.clear()
+      self._results[(product_id, limit)] = result
+      return result
+
+
+similar_index = SimilarityIndex()
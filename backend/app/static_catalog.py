@@ -0,0 +1,278 @@
+"""Static JSON export of the catalog for the storefront.
+
+Writes the catalog as content-addressed JSON shards that a CDN or the Next.js
+build can serve as static files, leaving the API to search and checkout:
+
+    index                 categories, brands and manufacturers with counts
+    categories/<slug>     product cards of one category
+    brands/<brand id>     the brand and its product cards
+    products/<id>         one full product
+
+Each shard is written as `<name>.<hash>.json` plus precompressed `.json.gz`
+and (with the optional `brotli` package) `.json.br` siblings, so the files are
+immutable. `manifest.json`, the only file that changes in place, maps shard
+names to their current file and hashes, and records the change-feed sequence
+the export reflects.
+
+Rebuilds are incremental: the catalog change feed since the manifest's
+sequence says which products, brands and manufacturers changed, and only the
+shards containing them are rendered again; a shard whose content hash did not
+change is not rewritten. Files of the previous manifest are kept for clients
+still holding it and listed under `retired`; the next build deletes them. Only
+files a manifest listed are ever deleted, so the output directory can be
+shared with other content.
+
+    python -m app.static_catalog build --out ./static_catalog
+    python -m app.static_catalog build --full
+"""
+from __future__ import annotations
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict
+from datetime import datetime
+
+from pydantic_core import to_json
+from sqlalchemy.orm import Session
+
+from .crud import current_change_seq, get_brands, get_manufacturers, get_products_by_ids, list_changes, list_products
+from .database import SessionLocal
+from .schemas import PRODUCT_VIEWS, Brand, product_fields_from_db, product_from_db
+
+try:
+  import brotli
+except ImportError:  # optional dependency
+  brotli = None
+
+STATIC_CATALOG_DIR = os.getenv("STATIC_CATALOG_DIR", "./static_catalog")
+MANIFEST = "manifest.json"
+LOAD_CHUNK_SIZE = 500
+
+
+def slugify(name: str) -> str:
+  return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "-"
+
+
+def _brand_dict(b) -> dict:
+  return Brand(id=b.id, name=b.name, logoUrl=b.logoUrl, logoHint=b.logoHint).model_dump(mode="json")
+
+
+def _card(p) -> dict:
+  return product_fields_from_db(p, PRODUCT_VIEWS["card"])
+
+
+class CatalogSnapshot:
+  """Which live products belong to which category and brand shard."""
+
+  def __init__(self, db: Session):
+    self.db = db
+    self.brands = {b.id: b for b in get_brands(db)}
+    self.brand_ids = {b.name: b.id for b in self.brands.values()}
+    self.category_names: dict[str, str] = {}
+    self.by_category: dict[str, list[str]] = defaultdict(list)
+    self.by_brand: dict[str, list[str]] = defaultdict(list)
+    self.meta: dict[str, dict] = {}
+    for p in list_products(db, columns=["id", "category", "brand"]):
+      slug = slugify(p.category)
+      self.category_names[slug] = p.category
+      self.by_category[slug].append(p.id)
+      if p.brand in self.brand_ids:
+        self.by_brand[self.brand_ids[p.brand]].append(p.id)
+      self.meta[p.id] = {"category": slugify(p.category), "brand": self.brand_ids.get(p.brand)}
+
+  def all_shards(self) -> set[str]:
+    return (
+      {"index"}
+      | {f"categories/{slug}" for slug in self.by_category}
+      | {f"brands/{brand_id}" for brand_id in self.brands}
+      | {f"products/{product_id}" for product_id in self.meta}
+    )
+
+  def products(self, product_ids: list[str]) -> list:
+    found = {}
+    for start in range(0, len(product_ids), LOAD_CHUNK_SIZE):
+      found.update(get_products_by_ids(self.db, product_ids[start:start + LOAD_CHUNK_SIZE]))
+    return [found[product_id] for product_id in product_ids if product_id in found]
+
+  def render(self, name: str) -> dict | None:
+    """The content of shard `name`, or None if it no longer exists."""
+    kind, _, key = name.partition("/")
+    if kind == "index":
+      return {
+        "categories": [
+          {"name": self.category_names[slug], "shard": f"categories/{slug}", "count": len(ids)}
+          for slug, ids in sorted(self.by_category.items())
+        ],
+        "brands": [
+          {**_brand_dict(b), "shard": f"brands/{b.id}", "count": len(self.by_brand.get(b.id, ()))}
+          for b in sorted(self.brands.values(), key=lambda b: b.name)
+        ],
+        "manufacturers": [
+          {"id": m.id, "name": m.name, "imageBase64": m.imageBase64, "models": m.models.split(",") if m.models else []}
+          for m in sorted(get_manufacturers(self.db), key=lambda m: m.name)
+        ],
+      }
+    if kind == "categories":
+      if key not in self.by_category:
+        return None
+      items = [_card(p) for p in self.products(sorted(self.by_category[key]))]
+      return {"category": self.category_names[key], "items": items}
+    if kind == "brands":
+      if key not in self.brands:
+        return None
+      items = [_card(p) for p in self.products(sorted(self.by_brand.get(key, ())))]
+      return {"brand": _brand_dict(self.brands[key]), "items": items}
+    if kind == "products":
+      products = self.products([key])
+      return product_from_db(products[0]).model_dump(mode="json") if products else None
+    raise ValueError(f"Unknown shard {name}")
+
+
+def load_manifest(out_dir: str) -> dict | None:
+  try:
+    with open(os.path.join(out_dir, MANIFEST)) as f:
+      return json.load(f)
+  except FileNotFoundError:
+    return None
+
+
+def changed_shards(db: Session, snapshot: CatalogSnapshot, manifest: dict) -> set[str]:
+  """Shards affected by catalog changes since the manifest was written."""
+  shards = {"index"}
+  old_meta = {
+    name.partition("/")[2]: entry.get("meta", {})
+    for name, entry in manifest["shards"].items()
+    if name.startswith("products/")
+  }
+  cursor = (manifest["changeSeq"], "~", "")
+  while True:
+    rows, has_more = list_changes(db, since=cursor)
+    for seq, kind, row in rows:
+      if kind == "product":
+        shards.add(f"products/{row.id}")
+        for meta in (old_meta.get(row.id, {}), snapshot.meta.get(row.id, {})):
+          if meta.get("category"):
+            shards.add(f"categories/{meta['category']}")
+          if meta.get("brand"):
+            shards.add(f"brands/{meta['brand']}")
+      elif kind == "brand":
+        shards.add(f"brands/{row.id}")
+      cursor = (seq, kind, row.id)
+    if not has_more:
+      return shards
+
+
+def _write_shard(out_dir: str, name: str, body: bytes, digest: str) -> dict:
+  path = f"{name}.{digest[:12]}.json"
+  full_path = os.path.join(out_dir, path)
+  os.makedirs(os.path.dirname(full_path), exist_ok=True)
+  variants = {"": body, ".gz": gzip.compress(body, compresslevel=9, mtime=0)}
+  if brotli is not None:
+    variants[".br"] = brotli.compress(body, quality=11)
+  for suffix, data in variants.items():
+    with open(full_path + suffix + ".tmp", "wb") as f:
+      f.write(data)
+    os.replace(full_path + suffix + ".tmp", full_path + suffix)
+  return {
+    "path": path,
+    "sha256": digest,
+    "bytes": len(body),
+    "gzipBytes": len(variants[".gz"]),
+    "brBytes": len(variants[".br"]) if ".br" in variants else None,
+  }
+
+
+def _files(entry: dict) -> set[str]:
+  return {entry["path"] + suffix for suffix in ("", ".gz", ".br")}
+
+
+def build(db: Session, out_dir: str = STATIC_CATALOG_DIR, full: bool = False) -> dict:
+  """Export the catalog into `out_dir`; returns counts of what was done."""
+  old = load_manifest(out_dir)
+  # Read before the rows, so changes made during the export are picked up next time.
+  seq = current_change_seq(db)
+  snapshot = CatalogSnapshot(db)
+  if full or old is None or old["changeSeq"] > seq:
+    full = True
+    old_shards = old["shards"] if old else {}
+    dirty = snapshot.all_shards() | set(old_shards)
+  else:
+    old_shards = old["shards"]
+    dirty = changed_shards(db, snapshot, old)
+
+  shards = dict(old_shards)
+  written = unchanged = removed = 0
+  for name in sorted(dirty):
+    content = snapshot.render(name)
+    if content is None:
+      removed += shards.pop(name, None) is not None
+      continue
+    body = to_json(content)
+    digest = hashlib.sha256(body).hexdigest()
+    entry = old_shards.get(name)
+    if entry is not None and entry["sha256"] == digest:
+      unchanged += 1
+    else:
+      entry = _write_shard(out_dir, name, body, digest)
+      written += 1
+    if name.startswith("products/"):
+      entry = {**entry, "meta": snapshot.meta[name.partition("/")[2]]}
+    shards[name] = entry
+
+  current = set().union(*map(_files, shards.values()))
+  previous = set().union(*map(_files, old_shards.values()))
+  retired = previous - current
+
+  os.makedirs(out_dir, exist_ok=True)
+  manifest = {
+    "changeSeq": seq,
+    "generatedAt": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+    "shards": shards,
+    "retired": sorted(retired),
+  }
+  with open(os.path.join(out_dir, MANIFEST + ".tmp"), "w") as f:
+    json.dump(manifest, f, separators=(",", ":"), sort_keys=True)
+  os.replace(os.path.join(out_dir, MANIFEST + ".tmp"), os.path.join(out_dir, MANIFEST))
+
+  # Files the previous build retired; anything else in out_dir is left alone.
+  pruned = 0
+  for path in set(old.get("retired", ()) if old else ()) - current - previous:
+    if os.path.isabs(path) or ".." in path.split("/"):
+      continue
+    try:
+      os.remove(os.path.join(out_dir, path))
+      pruned += 1
+    except FileNotFoundError:
+      pass
+
+  return {
+    "changeSeq": seq,
+    "full": full,
+    "rendered": len(dirty),
+    "written": written,
+    "unchanged": unchanged,
+    "removed": removed,
+    "prunedFiles": pruned,
+  }
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Export the catalog as static JSON shards.")
+  commands = parser.add_subparsers(dest="command", required=True)
+  build_cmd = commands.add_parser("build", help="write or update the export")
+  build_cmd.add_argument("--out", default=STATIC_CATALOG_DIR, help="output directory")
+  build_cmd.add_argument("--full", action="store_true", help="render every shard, ignoring the change feed")
+  args = parser.parse_args()
+
+  db = SessionLocal()
+  try:
+    print(json.dumps(build(db, args.out, full=args.full)))
+  finally:
+    db.close()
+
+
+if __name__ == "__main__":
+  main()
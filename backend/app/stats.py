@@ -0,0 +1,228 @@
+"""Sales summary tables for the admin dashboard.
+
+`stats_daily_sales`, `stats_order_status` and `stats_product_sales` hold
+running totals per order date. The order functions in `crud` call the
+`record_*` helpers inside their own transactions, so the summaries commit or
+roll back together with the order change, and `/admin/stats` reads a few rows
+per day instead of scanning the order history. Sales (revenue and units) are
+counted when an order is paid, under the date the order was placed.
+
+The counters are updated with `INSERT ... ON CONFLICT DO UPDATE`, available on
+SQLite and PostgreSQL; `check_database` refuses to start on anything else
+rather than failing at checkout.
+
+Rebuild the tables from the order history, live and archived, with:
+
+    python -m app.stats --rebuild
+"""
+from __future__ import annotations
+import argparse
+from collections import Counter
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .models import DailySalesDB, OrderDB, OrderItemDB, OrderStatusStatsDB, ProductDB, ProductSalesDB
+
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE, by SQLAlchemy dialect name.
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def check_database(engine) -> None:
+  """Raise at startup if the order database cannot run the counter upserts."""
+  if engine.dialect.name not in UPSERT_INSERTS:
+    raise RuntimeError(
+      f"Sales statistics need SQLite or PostgreSQL; DATABASE_URL uses {engine.dialect.name}"
+    )
+
+
+def _add(db: Session, model, keys: dict, **amounts) -> None:
+  """Upsert `keys` and add `amounts` to the existing counters."""
+  upsert = UPSERT_INSERTS[db.get_bind().dialect.name]
+  statement = upsert(model).values(**keys, **amounts)
+  statement = statement.on_conflict_do_update(
+    index_elements=list(keys),
+    set_={name: getattr(model, name) + statement.excluded[name] for name in amounts},
+  )
+  db.execute(statement)
+
+
+def record_order_created(db: Session, date: str) -> None:
+  _add(db, DailySalesDB, {"date": date}, orders=1)
+  _add(db, OrderStatusStatsDB, {"date": date, "payment_status": "pending"}, orders=1)
+
+
+def record_status_change(db: Session, date: str, old: str | None, new: str) -> None:
+  _add(db, OrderStatusStatsDB, {"date": date, "payment_status": old or "pending"}, orders=-1)
+  _add(db, OrderStatusStatsDB, {"date": date, "payment_status": new}, orders=1)
+
+
+def record_order_paid(db: Session, order: OrderDB, old_status: str | None, quantities: dict[str, int]) -> None:
+  record_status_change(db, order.date, old_status, "paid")
+  _add(db, DailySalesDB, {"date": order.date}, paid_orders=1, revenue=order.total, units=sum(quantities.values()))
+  for product_id in sorted(quantities):
+    _add(db, ProductSalesDB, {"date": order.date, "product_id": product_id}, units=quantities[product_id])
+
+
+def sales_summary(db: Session, start: str, end: str, top: int = 10) -> dict:
+  """Totals, daily series and breakdowns for order dates in [start, end]."""
+  in_range = lambda model: model.date.between(start, end)
+
+  daily = (
+    db.query(DailySalesDB)
+    .filter(in_range(DailySalesDB))
+    .order_by(DailySalesDB.date)
+    .all()
+  )
+  statuses = (
+    db.query(OrderStatusStatsDB.payment_status, func.sum(OrderStatusStatsDB.orders))
+    .filter(in_range(OrderStatusStatsDB))
+    .group_by(OrderStatusStatsDB.payment_status)
+    .all()
+  )
+  units = func.sum(ProductSalesDB.units).label("units")
+  products = (
+    db.query(ProductSalesDB.product_id, ProductDB.name, units)
+    .outerjoin(ProductDB, ProductDB.id == ProductSalesDB.product_id)
+    .filter(in_range(ProductSalesDB))
+    .group_by(ProductSalesDB.product_id)
+    .order_by(units.desc(), ProductSalesDB.product_id)
+    .limit(top)
+    .all()
+  )
+
+  def units_by(column):
+    return (
+      db.query(column, units)
+      .join(ProductDB, ProductDB.id == ProductSalesDB.product_id)
+      .filter(in_range(ProductSalesDB))
+      .group_by(column)
+      .order_by(units.desc(), column)
+      .all()
+    )
+
+  return {
+    "from": start,
+    "to": end,
+    "orders": sum(d.orders for d in daily),
+    "paidOrders": sum(d.paid_orders for d in daily),
+    "revenue": round(sum(d.revenue for d in daily), 2),
+    "units": sum(d.units for d in daily),
+    "daily": [
+      {"date": d.date, "orders": d.orders, "paidOrders": d.paid_orders, "revenue": round(d.revenue, 2), "units": d.units}
+      for d in daily
+    ],
+    "byStatus": {status: count for status, count in statuses if count},
+    "topProducts": [{"productId": pid, "name": name, "units": n} for pid, name, n in products],
+    "byBrand": [{"brand": brand, "units": n} for brand, n in units_by(ProductDB.brand)],
+    "byCategory": [{"category": category, "units": n} for category, n in units_by(ProductDB.category)],
+  }
+
+
+def _add_archived(db: Session) -> int:
+  """Add the orders in the archive segments to the summaries; returns how many."""
+  from .archive import archived_orders  # archive imports crud, which imports this module
+
+  daily, statuses, products = Counter(), Counter(), Counter()
+  counted = 0
+  for record in archived_orders(db):
+    date, status = record["date"], record["payment_status"] or "pending"
+    daily[date, "orders"] += 1
+    statuses[date, status] += 1
+    if status == "paid":
+      units = sum(item["quantity"] for item in record["items"])
+      daily[date, "paid_orders"] += 1
+      daily[date, "revenue"] += record["total"]
+      daily[date, "units"] += units
+      for item in record["items"]:
+        products[date, item["productId"]] += item["quantity"]
+    counted += 1
+
+  amounts: dict[str, dict] = {}
+  for (date, name), value in daily.items():
+    amounts.setdefault(date, {"orders": 0, "paid_orders": 0, "revenue": 0.0, "units": 0})[name] = value
+  for date in sorted(amounts):
+    _add(db, DailySalesDB, {"date": date}, **amounts[date])
+  for (date, status), count in sorted(statuses.items()):
+    _add(db, OrderStatusStatsDB, {"date": date, "payment_status": status}, orders=count)
+  for (date, product_id), units in sorted(products.items()):
+    _add(db, ProductSalesDB, {"date": date, "product_id": product_id}, units=units)
+  return counted
+
+
+def rebuild(db: Session) -> int:
+  """Recompute every summary table from `orders` and the order archive in
+  one transaction.
+
+  Returns the number of orders counted.
+  """
+  paid = OrderDB.payment_status == "paid"
+  payment_status = func.coalesce(OrderDB.payment_status, "pending")
+  order_units = (
+    select(OrderItemDB.order_id, func.sum(OrderItemDB.quantity).label("units"))
+    .group_by(OrderItemDB.order_id)
+    .subquery()
+  )
+  try:
+    for model in (DailySalesDB, OrderStatusStatsDB, ProductSalesDB):
+      db.execute(delete(model))
+    db.execute(insert(DailySalesDB).from_select(
+      ["date", "orders", "paid_orders", "revenue", "units"],
+      select(
+        OrderDB.date,
+        func.count(),
+        func.count().filter(paid),
+        func.coalesce(func.sum(OrderDB.total).filter(paid), 0.0),
+        func.coalesce(func.sum(order_units.c.units).filter(paid), 0),
+      )
+      .outerjoin(order_units, order_units.c.order_id == OrderDB.id)
+      .group_by(OrderDB.date),
+    ))
+    db.execute(insert(OrderStatusStatsDB).from_select(
+      ["date", "payment_status", "orders"],
+      select(OrderDB.date, payment_status, func.count()).group_by(OrderDB.date, payment_status),
+    ))
+    db.execute(insert(ProductSalesDB).from_select(
+      ["date", "product_id", "units"],
+      select(OrderDB.date, OrderItemDB.product_id, func.sum(OrderItemDB.quantity))
+      .join(OrderItemDB, OrderItemDB.order_id == OrderDB.id)
+      .where(paid)
+      .group_by(OrderDB.date, OrderItemDB.product_id),
+    ))
+    counted = db.query(func.count(OrderDB.id)).scalar() + _add_archived(db)
+    db.commit()
+  except Exception:
+    db.rollback()
+    raise
+  return counted
+
+
+def backfill(db: Session) -> int:
+  """Build the summaries for a database that has orders from before they existed."""
+  if db.query(DailySalesDB.date).first() is not None or db.query(OrderDB.id).first() is None:
+    return 0
+  return rebuild(db)
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Maintain the sales summary tables.")
+  parser.add_argument("--rebuild", action="store_true", help="recompute all summaries from the order history")
+  args = parser.parse_args()
+  if not args.rebuild:
+    parser.error("nothing to do; pass --rebuild")
+
+  from .database import Base, engine
+
+  Base.metadata.create_all(bind=engine)
+  db = SessionLocal()
+  try:
+    print(f"Rebuilt sales summaries from {rebuild(db)} orders")
+  finally:
+    db.close()
+
+
+if __name__ == "__main__":
+  main()
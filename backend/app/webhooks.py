@@ -0,0 +1,188 @@
+"""Durable queue and batch processor for Razorpay webhook events.
+
+The webhook endpoint only verifies the signature and appends the raw event to
+`webhook_events` in the queue database (see `database.queue_engine`); it never
+touches the order tables. Worker loops claim batches of queued events and apply
+them to `OrderDB` in one transaction per batch. An event that fails with a
+transient error is queued again with exponential backoff (`next_attempt_at`),
+so a short outage such as a locked database does not use up its attempts.
+"""
+from __future__ import annotations
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from .crud import find_order_for_payment, mark_order_paid, mark_order_payment_failed
+from .database import QueueSessionLocal, SessionLocal
+from .models import WebhookEventDB
+
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+# Delay before the first retry; doubled for each further attempt, up to WEBHOOK_RETRY_MAX.
+WEBHOOK_RETRY_SECONDS = float(os.getenv("WEBHOOK_RETRY_SECONDS", "5"))
+WEBHOOK_RETRY_MAX = timedelta(minutes=5)
+# Events claimed by a worker that died are handed out again after this long.
+WEBHOOK_CLAIM_TIMEOUT = timedelta(minutes=5)
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+PAID_EVENTS = {"payment.captured", "order.paid"}
+FAILED_EVENTS = {"payment.failed"}
+
+
+def _now() -> str:
+  return datetime.utcnow().strftime(TIME_FORMAT)
+
+
+def enqueue_event(event_id: str, event: str, payload: bytes) -> bool:
+  """Append an event to the queue. Returns False if it was already queued."""
+  db = QueueSessionLocal()
+  try:
+    db.add(WebhookEventDB(id=event_id, event=event, payload=payload.decode(), received_at=_now()))
+    db.commit()
+    return True
+  except IntegrityError:
+    db.rollback()
+    return False
+  finally:
+    db.close()
+
+
+def retry_delay(attempts: int) -> timedelta:
+  """Backoff before the next attempt of an event that has had `attempts`."""
+  seconds = WEBHOOK_RETRY_SECONDS * 2 ** min(max(0, attempts - 1), 20)
+  return min(timedelta(seconds=seconds), WEBHOOK_RETRY_MAX)
+
+
+def claim_batch(worker_id: str, limit: int = WEBHOOK_BATCH_SIZE) -> list[WebhookEventDB]:
+  """Atomically mark up to `limit` due queued (or abandoned) events as ours."""
+  db = QueueSessionLocal()
+  try:
+    now = datetime.utcnow()
+    stale = (now - WEBHOOK_CLAIM_TIMEOUT).strftime(TIME_FORMAT)
+    due = WebhookEventDB.next_attempt_at.is_(None) | (WebhookEventDB.next_attempt_at <= now.strftime(TIME_FORMAT))
+    claimable = (
+      select(WebhookEventDB.id)
+      .where(
+        ((WebhookEventDB.status == "queued") & due)
+        | ((WebhookEventDB.status == "processing") & (WebhookEventDB.claimed_at < stale))
+      )
+      .order_by(WebhookEventDB.received_at)
+      .limit(limit)
+    )
+    db.execute(
+      update(WebhookEventDB)
+      .where(WebhookEventDB.id.in_(claimable))
+      .values(
+        status="processing",
+        claimed_by=worker_id,
+        claimed_at=now.strftime(TIME_FORMAT),
+        attempts=WebhookEventDB.attempts + 1,
+      )
+      .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    events = (
+      db.query(WebhookEventDB)
+      .filter(WebhookEventDB.claimed_by == worker_id, WebhookEventDB.status == "processing")
+      .order_by(WebhookEventDB.received_at)
+      .all()
+    )
+    db.expunge_all()
+    return events
+  finally:
+    db.close()
+
+
+def _finish(results: dict[str, tuple[str, str | None]], events: dict[str, WebhookEventDB]) -> int:
+  """Record batch outcomes; returns how many events were completed rather than requeued."""
+  db = QueueSessionLocal()
+  completed = 0
+  try:
+    now = datetime.utcnow()
+    processed_at = now.strftime(TIME_FORMAT)
+    for event_id, (status, error) in results.items():
+      next_attempt_at = None
+      if status == "retry":
+        attempts = events[event_id].attempts
+        status = "failed" if attempts >= WEBHOOK_MAX_ATTEMPTS else "queued"
+        if status == "queued":
+          next_attempt_at = (now + retry_delay(attempts)).strftime(TIME_FORMAT)
+      completed += status != "queued"
+      db.execute(
+        update(WebhookEventDB)
+        .where(WebhookEventDB.id == event_id)
+        .values(status=status, error=error, claimed_by=None, processed_at=processed_at, next_attempt_at=next_attempt_at)
+      )
+    db.commit()
+  finally:
+    db.close()
+  return completed
+
+
+def apply_event(db, event: WebhookEventDB) -> str:
+  """Apply one event to the order tables without committing.
+
+  Returns "processed" if the event was relevant to an order and "skipped"
+  otherwise (unhandled event type, unknown order, or no state change).
+  """
+  body = json.loads(event.payload)
+  payload = body.get("payload", {})
+  payment = payload.get("payment", {}).get("entity", {})
+  gateway_order = payload.get("order", {}).get("entity", {})
+  razorpay_order_id = payment.get("order_id") or gateway_order.get("id")
+
+  if event.event not in PAID_EVENTS and event.event not in FAILED_EVENTS:
+    return "skipped"
+  order = find_order_for_payment(db, razorpay_order_id, gateway_order.get("receipt"))
+  if order is None:
+    return "skipped"
+
+  if event.event in PAID_EVENTS:
+    changed = mark_order_paid(db, order, razorpay_order_id, payment.get("id"), amount=payment.get("amount"))
+  else:
+    changed = mark_order_payment_failed(db, order, razorpay_order_id, payment.get("id"))
+  return "processed" if changed else "skipped"
+
+
+def _apply_one(event: WebhookEventDB) -> tuple[str, str | None]:
+  db = SessionLocal()
+  try:
+    status = apply_event(db, event)
+    db.commit()
+    return status, None
+  except Exception as e:
+    db.rollback()
+    return "retry", str(e)
+  finally:
+    db.close()
+
+
+def process_batch(worker_id: str | None = None, limit: int = WEBHOOK_BATCH_SIZE) -> int:
+  """Claim and apply one batch of events. Returns the number of events
+  completed (processed, skipped or given up on); requeued retries do not count.
+
+  The whole batch is applied in a single order-database transaction. If any
+  event fails, the batch is rolled back and its events are re-applied one
+  transaction each so that a single bad event cannot hold back the rest.
+  """
+  events = claim_batch(worker_id or uuid.uuid4().hex, limit)
+  if not events:
+    return 0
+  by_id = {e.id: e for e in events}
+
+  db = SessionLocal()
+  try:
+    results = {e.id: (apply_event(db, e), None) for e in events}
+    db.commit()
+  except Exception:
+    db.rollback()
+    results = {e.id: _apply_one(e) for e in events}
+  finally:
+    db.close()
+
+  return _finish(results, by_id)
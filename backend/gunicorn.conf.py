@@ -0,0 +1,56 @@
+"""Gunicorn settings for production: several preloaded uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The app is imported, the database seeded and the similarity index built once
+in the master before workers are forked, so workers share that memory
+copy-on-write and start serving immediately. Workers are recycled after
+MAX_REQUESTS requests (with jitter so they do not all restart together).
+
+Reads scale with the workers, but on SQLite all of them share one write
+lock: the database runs in WAL mode, so reads never wait for a writer, yet
+only one transaction commits at a time across every worker (waiting up to
+SQLITE_BUSY_TIMEOUT_MS for its turn). Checkout throughput is bounded by that
+single writer and the disk's sync rate, not by the number of cores; see
+GROUP_COMMIT in app/group_commit.py, or move to PostgreSQL for more.
+
+`kill -HUP <master pid>` replaces the workers gracefully with the preloaded
+code; to deploy new code, send USR2 (start a new master) and then QUIT to the
+old one.
+"""
+import gc
+import multiprocessing
+import os
+
+# Events must cross workers; see app/events.py.
+os.environ.setdefault("EVENT_BROKER", "sqlite")
+
+bind = os.getenv("BIND", "0.0.0.0:4000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+max_requests = int(os.getenv("MAX_REQUESTS", "20000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "2000"))
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+  from app.database import engine, queue_engine
+  from app.main import prepare_app
+
+  prepare_app()
+  # Never hand pooled connections opened here to the children.
+  engine.dispose()
+  queue_engine.dispose()
+  # Keep the preloaded objects out of the collector so it does not touch (and
+  # un-share) their pages in every worker.
+  gc.freeze()
+
+
+def post_fork(server, worker):
+  from app.database import engine, queue_engine
+
+  engine.dispose(close=False)
+  queue_engine.dispose(close=False)
@@ -14,5 +14,10 @@ if [ ! -d ".venv" ]; then
 fi
 
 # Run the server
+if [ "$1" = "--prod" ]; then
+    echo "Starting production server on port 4000 with ${WEB_CONCURRENCY:-one worker per core}..."
+    exec ./.venv/bin/gunicorn -c gunicorn.conf.py app.main:app
+fi
+
 echo "Starting backend server on port 4000..."
 ./.venv/bin/uvicorn app.main:app --reload --port 4000
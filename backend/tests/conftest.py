@@ -0,0 +1,68 @@
+"""Pytest fixtures on private copies of a seeded template database.
+
+The engines in `app.database` are created at import time, so the environment
+is pointed at scratch files before anything in `app` is imported; tests then
+rebind `SessionLocal` to their own copy (see `fixtures.py`).
+
+    cd backend && python -m pytest
+"""
+import os
+import tempfile
+
+_scratch = tempfile.mkdtemp(prefix="gtr-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_scratch}/unused.db")
+os.environ.setdefault("QUEUE_DATABASE_URL", f"sqlite:///{_scratch}/queue.db")
+os.environ.setdefault("CATALOG_VERSION_FILE", f"{_scratch}/catalog_version")
+os.environ.setdefault("ARCHIVE_DIR", f"{_scratch}/order_archive")
+
+import pytest
+
+from app.database import SessionLocal
+from .fixtures import FIXTURE_SCALE, file_copy, memory_copy, override_get_db, template_path, use_database
+
+
+@pytest.fixture(scope="session")
+def catalog_template() -> str:
+  return template_path(FIXTURE_SCALE)
+
+
+@pytest.fixture
+def db_engine(catalog_template):
+  """An in-memory copy; one shared connection, so single-threaded tests only."""
+  engine = memory_copy(catalog_template)
+  try:
+    with use_database(engine):
+      yield engine
+  finally:
+    engine.dispose()
+
+
+@pytest.fixture
+def file_db_engine(catalog_template, tmp_path):
+  """An on-disk copy with a connection pool, for concurrent writers."""
+  engine = file_copy(catalog_template, str(tmp_path / "catalog.db"))
+  try:
+    with use_database(engine):
+      yield engine
+  finally:
+    engine.dispose()
+
+
+@pytest.fixture
+def db(db_engine):
+  session = SessionLocal()
+  try:
+    yield session
+  finally:
+    session.close()
+
+
+@pytest.fixture
+def client(file_db_engine):
+  # On a file copy: the app's background tasks (sweeper, webhook workers) open
+  # their own sessions and must not share a connection with the requests.
+  from fastapi.testclient import TestClient
+  from app.main import app
+
+  with override_get_db(app, file_db_engine), TestClient(app) as test_client:
+    yield test_client
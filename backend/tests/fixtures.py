@@ -0,0 +1,196 @@
+"""Seeded database fixtures for tests and benchmarks.
+
+Seeding through `init_db` adds rows one ORM object at a time, which gets slow
+for large synthetic catalogs. Here a template database is built once per
+(scale, seed, schema) with the seed data plus `scale` synthetic products
+written by bulk inserts, and cached as a file in FIXTURE_CACHE_DIR; a schema
+change gives a new file name, so stale templates are never reused. Each test
+then gets a private copy:
+
+- `memory_copy(template)`: SQLite's online backup API into `:memory:`, served
+  through one shared connection. Fastest, but every session shares that
+  connection and its transaction, so only for single-threaded tests.
+- `file_copy(template, path)`: a copy on disk with an ordinary connection
+  pool, for tests where several connections (threads, background tasks)
+  write at once.
+
+`use_database(engine)` points `SessionLocal` at a copy, and
+`override_get_db(app, engine)` does the same for the `get_db` dependency.
+The pytest fixtures built on these are in `conftest.py`.
+
+FIXTURE_SCALE sets the number of synthetic products (default 1000). Build a
+template ahead of time with `python -m tests.fixtures build --scale 100000`.
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.cache import bump_catalog_version
+from app.crud import init_db
+from app.data import brands, manufacturers, products
+from app.database import Base, SessionLocal, get_db
+from app.models import ProductDB, change_timestamp, effective_price, next_change_seq
+
+FIXTURE_SCALE = int(os.getenv("FIXTURE_SCALE", "1000"))
+FIXTURE_CACHE_DIR = os.getenv("FIXTURE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "gtr_fixtures"))
+INSERT_CHUNK_SIZE = 10_000
+
+
+def schema_fingerprint() -> str:
+  """Hash of the DDL of every table and index; changes with the models."""
+  dialect = create_engine("sqlite://").dialect
+  ddl = []
+  for table in Base.metadata.sorted_tables:
+    ddl.append(str(CreateTable(table).compile(dialect=dialect)))
+    ddl.extend(str(CreateIndex(index).compile(dialect=dialect)) for index in sorted(table.indexes, key=lambda i: i.name))
+  return hashlib.sha256("\n".join(ddl).encode()).hexdigest()[:12]
+
+
+def synthetic_products(count: int, seed: int = 0, change_seq: int | None = None):
+  """`count` product rows (as dicts) modeled on the seed catalog."""
+  rng = random.Random(seed)
+  now = change_timestamp()
+  brand_names = [b.name for b in brands]
+  manufacturer_names = [m.name for m in manufacturers] + [None]
+  for n in range(count):
+    template = rng.choice(products)
+    price = round(rng.uniform(20, 5000), 2)
+    discount = rng.choice([None, None, 5, 10, 15, 20, 30])
+    yield {
+      "id": f"syn_{seed}_{n}",
+      "name": f"{template.name} {n}",
+      "description": template.description,
+      "price": price,
+      "brand": rng.choice(brand_names),
+      "manufacturer": rng.choice(manufacturer_names),
+      "category": template.category,
+      "imageUrl": template.imageUrl,
+      "imageHint": template.imageHint,
+      "rating": round(rng.uniform(3, 5), 1),
+      "reviewCount": rng.randint(0, 2000),
+      "discount": discount,
+      "stock": rng.choice([None, rng.randint(0, 500)]),
+      "effective_price": effective_price(price, discount),
+      "updated_at": now,
+      "deleted_at": None,
+      "change_seq": change_seq,
+    }
+
+
+def build_template(path: str, scale: int, seed: int = 0) -> None:
+  """Create a database at `path` with the seed data and `scale` synthetic products."""
+  engine = create_engine(f"sqlite:///{path}")
+  try:
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+      init_db(db)
+    with engine.begin() as conn:
+      # A throwaway file: no need for durability while it is being built.
+      conn.exec_driver_sql("PRAGMA synchronous=OFF")
+      seq = next_change_seq(conn)
+      rows = synthetic_products(scale, seed, change_seq=seq)
+      while chunk := [row for _, row in zip(range(INSERT_CHUNK_SIZE), rows)]:
+        conn.execute(ProductDB.__table__.insert(), chunk)
+    with engine.connect() as conn:
+      conn.exec_driver_sql("ANALYZE")
+  finally:
+    engine.dispose()
+
+
+def template_path(scale: int = FIXTURE_SCALE, seed: int = 0) -> str:
+  """Path of the cached template for `scale`, building it if needed."""
+  os.makedirs(FIXTURE_CACHE_DIR, exist_ok=True)
+  path = os.path.join(FIXTURE_CACHE_DIR, f"catalog-{scale}-{seed}-{schema_fingerprint()}.db")
+  if not os.path.exists(path):
+    # Built under a unique name, so parallel test workers cannot see a partial file.
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+      build_template(tmp, scale, seed)
+      os.replace(tmp, path)
+    finally:
+      if os.path.exists(tmp):
+        os.remove(tmp)
+  return path
+
+
+def memory_copy(template: str) -> Engine:
+  """An engine on a private in-memory copy of `template`."""
+  conn = sqlite3.connect(":memory:", check_same_thread=False)
+  source = sqlite3.connect(f"file:{template}?mode=ro", uri=True)
+  try:
+    source.backup(conn)
+  finally:
+    source.close()
+  return create_engine("sqlite://", creator=lambda: conn, poolclass=StaticPool)
+
+
+def file_copy(template: str, path: str) -> Engine:
+  """An engine on a private on-disk copy of `template` at `path`."""
+  shutil.copyfile(template, path)
+  return create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+
+@contextmanager
+def use_database(engine: Engine):
+  """Bind `SessionLocal` to `engine` for the duration, then restore it.
+
+  The catalog version is bumped on entry and exit so that nothing memoized
+  from another database is served.
+  """
+  previous = SessionLocal.kw["bind"]
+  SessionLocal.configure(bind=engine)
+  bump_catalog_version()
+  try:
+    yield engine
+  finally:
+    SessionLocal.configure(bind=previous)
+    bump_catalog_version()
+
+
+@contextmanager
+def override_get_db(app, engine: Engine):
+  """Serve `app`'s `get_db` dependency from `engine` for the duration."""
+  sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+  def get_test_db():
+    db = sessions()
+    try:
+      yield db
+    finally:
+      db.close()
+
+  app.dependency_overrides[get_db] = get_test_db
+  try:
+    yield
+  finally:
+    app.dependency_overrides.pop(get_db, None)
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Seeded template databases for tests.")
+  commands = parser.add_subparsers(dest="command", required=True)
+  build = commands.add_parser("build", help="build (or find) the cached template")
+  build.add_argument("--scale", type=int, default=FIXTURE_SCALE, help="synthetic products")
+  build.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+  started = time.perf_counter()
+  path = template_path(args.scale, args.seed)
+  print(f"{path} ({os.path.getsize(path) / 1e6:.1f} MB, {time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+  main()
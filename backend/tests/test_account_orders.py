@@ -0,0 +1,64 @@
+import pytest
+
+from app.crud import add_order
+from app.database import SessionLocal
+from app.models import ProductDB
+
+ORDERS = [
+  # id, date, customer
+  ("A-1", "2024-03-01", "alice@example.com"),
+  ("A-2", "2024-03-02", "alice@example.com"),
+  ("B-1", "2024-03-02", "bob@example.com"),
+  ("A-3", "2024-03-02", "alice@example.com"),
+  ("A-4", "2024-03-02", "alice@example.com"),
+  ("B-2", "2024-03-02", "bob@example.com"),
+  ("A-5", "2024-03-03", "alice@example.com"),
+]
+
+
+@pytest.fixture
+def orders(client):
+  db = SessionLocal()
+  try:
+    db.get(ProductDB, "prod_1").stock = None
+    for order_id, date, email in ORDERS:
+      add_order(db, order_id, date, 10.0, [("prod_1", 1)], {"customer_email": email})
+    db.commit()
+  finally:
+    db.close()
+  return client
+
+
+def pages(client, email: str, limit: int) -> list[dict]:
+  found, cursor = [], None
+  while True:
+    params = {"email": email, "limit": limit, **({"cursor": cursor} if cursor else {})}
+    response = client.get("/account/orders", params=params)
+    assert response.status_code == 200
+    found.append(response.json())
+    cursor = found[-1]["nextCursor"]
+    if cursor is None:
+      return found
+
+
+def test_pages_step_through_orders_that_share_a_date(orders):
+  found = pages(orders, "alice@example.com", limit=2)
+
+  assert [[order["id"] for order in page["items"]] for page in found] == [["A-5", "A-4"], ["A-3", "A-2"], ["A-1"]]
+  assert [page["nextCursor"] for page in found] == ["2024-03-02:A-4", "2024-03-02:A-2", None]
+  assert found[0]["items"][0]["items"][0]["product"]["id"] == "prod_1"
+
+
+def test_customers_only_see_their_own_orders(orders):
+  bob = pages(orders, "Bob@Example.com", limit=10)
+  assert [order["id"] for order in bob[0]["items"]] == ["B-2", "B-1"]
+  assert pages(orders, "carol@example.com", limit=10)[0]["items"] == []
+
+  # A cursor from one customer's listing does not leak another's orders.
+  response = orders.get("/account/orders", params={"email": "bob@example.com", "cursor": "2024-03-03:A-5"})
+  assert [order["id"] for order in response.json()["items"]] == ["B-2", "B-1"]
+
+
+def test_malformed_cursors_are_rejected(client):
+  response = client.get("/account/orders", params={"email": "alice@example.com", "cursor": "2024-03-02"})
+  assert response.status_code == 400
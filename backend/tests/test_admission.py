@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionMiddleware, TokenBuckets, admission_state, route_class
+
+
+@pytest.mark.parametrize("method, path, expected", [
+  ("GET", "/orders/ORD-1/events", "stream"),
+  ("GET", "/admin/orders/events", "stream"),
+  ("GET", "/admin/events", "admin"),
+  ("GET", "/admin/stats", "admin"),
+  ("POST", "/orders", "checkout"),
+  ("POST", "/payments/verify", "checkout"),
+  ("GET", "/products", "browse"),
+  ("POST", "/products:batch", "browse"),
+  ("PATCH", "/products/bulk", "write"),
+])
+def test_route_class(method, path, expected):
+  assert route_class(method, path) == expected
+
+
+def test_token_bucket_refills_at_its_rate():
+  buckets = TokenBuckets({"browse": (2.0, 3.0)})
+  assert [buckets.take("a", "browse", now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+  assert buckets.take("a", "browse", now=0.0) == pytest.approx(0.5)
+  assert buckets.take("b", "browse", now=0.0) == 0.0
+  assert buckets.take("a", "browse", now=1.0) == 0.0
+
+
+def test_payment_webhooks_are_not_rate_limited():
+  async def app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+  middleware = AdmissionMiddleware(app, rate_limits="checkout=1:1")
+
+  async def post(path: str) -> int:
+    sent = []
+
+    async def send(message):
+      sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": path, "headers": [], "client": ("203.0.113.9", 443)}
+    await middleware(scope, None, send)
+    return sent[0]["status"]
+
+  async def burst(path: str) -> list[int]:
+    return [await post(path) for _ in range(20)]
+
+  try:
+    assert set(asyncio.run(burst("/payments/webhook"))) == {200}
+    assert 429 in asyncio.run(burst("/payments/verify"))
+  finally:
+    admission_state.remove(middleware)
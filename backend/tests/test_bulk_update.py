@@ -0,0 +1,34 @@
+from app.database import SessionLocal
+from app.models import ProductDB
+
+
+def live_products() -> int:
+  db = SessionLocal()
+  try:
+    return db.query(ProductDB).filter(ProductDB.deleted_at.is_(None)).count()
+  finally:
+    db.close()
+
+
+def test_empty_filter_is_rejected(client):
+  for body_filter in ({}, {"category": ""}, {"all": False}):
+    response = client.patch("/products/bulk", json={"filter": body_filter, "set": {"discount": 90}})
+    assert response.status_code == 422
+
+
+def test_all_matches_every_product(client):
+  response = client.patch("/products/bulk", json={"filter": {"all": True}, "set": {"discount": 5}, "dryRun": True})
+  assert response.status_code == 200
+  assert response.json()["matched"] == live_products()
+  assert response.json()["updated"] == 0
+
+
+def test_filter_updates_only_matching_products(client):
+  db = SessionLocal()
+  try:
+    category = db.get(ProductDB, "prod_1").category
+    expected = db.query(ProductDB).filter(ProductDB.category == category, ProductDB.deleted_at.is_(None)).count()
+  finally:
+    db.close()
+  response = client.patch("/products/bulk", json={"filter": {"category": category}, "set": {"discount": 10}})
+  assert response.json()["updated"] == expected < live_products()
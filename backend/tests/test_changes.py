@@ -0,0 +1,63 @@
+from app.database import SessionLocal
+from app.models import ProductDB
+
+PRODUCT_IDS = ["prod_1", "prod_2", "prod_3", "prod_4", "prod_5"]
+ADDRESS = {"line1": "12 Marine Drive", "city": "Mumbai", "country": "IN", "postalCode": "400020"}
+
+
+def head(client) -> str:
+  return str(client.get("/changes", params={"since": "0", "limit": 1}).json()["sequence"])
+
+
+def test_pages_cover_every_change_exactly_once(client):
+  since = head(client)
+  # One bulk update stamps every row with the same sequence number, so the
+  # pages below split a single change set.
+  client.patch("/products/bulk", json={"items": [{"id": product_id, "discount": 5} for product_id in PRODUCT_IDS]})
+  client.delete("/product/prod_6")
+
+  pages = []
+  while True:
+    page = client.get("/changes", params={"since": since, "limit": 2}).json()
+    pages.append(page)
+    since = page["nextSince"]
+    if not page["hasMore"]:
+      break
+
+  assert [len(page["changes"]) for page in pages] == [2, 2, 2]
+  assert [page["hasMore"] for page in pages] == [True, True, False]
+  seen = [(change["id"], change["op"]) for page in pages for change in page["changes"]]
+  assert seen == [(product_id, "upsert") for product_id in PRODUCT_IDS] + [("prod_6", "delete")]
+
+  # The last cursor is caught up.
+  final = client.get("/changes", params={"since": since, "limit": 2}).json()
+  assert (final["changes"], final["hasMore"], final["nextSince"]) == ([], False, since)
+
+
+def test_deleted_products_are_reported_as_tombstones(client):
+  since = head(client)
+  assert client.delete("/product/prod_3").status_code == 204
+
+  changes = client.get("/changes", params={"since": since}).json()["changes"]
+
+  assert len(changes) == 1
+  assert (changes[0]["kind"], changes[0]["id"], changes[0]["op"]) == ("product", "prod_3", "delete")
+  assert changes[0]["data"] is None
+  assert changes[0]["updatedAt"]
+
+
+def test_stock_changes_are_not_catalog_changes(client):
+  since = head(client)
+  db = SessionLocal()
+  try:
+    db.get(ProductDB, "prod_1").stock = 40
+    db.commit()
+  finally:
+    db.close()
+  order = {"items": [{"productId": "prod_1", "quantity": 2}], "shippingAddress": ADDRESS}
+  assert client.post("/orders", json=order).status_code == 201
+
+  page = client.get("/changes", params={"since": since}).json()
+
+  assert page["changes"] == []
+  assert str(page["sequence"]) == since
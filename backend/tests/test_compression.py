@@ -0,0 +1,58 @@
+import asyncio
+import gzip
+import json
+
+from fastapi import Request
+
+from app import compression
+from app.coalesce import SingleFlight
+
+
+def request(accept_encoding: str) -> Request:
+  return Request({"type": "http", "method": "GET", "path": "/products", "headers": [(b"accept-encoding", accept_encoding.encode())]})
+
+
+def test_coalesced_requests_share_one_compression(monkeypatch):
+  calls = []
+  real_compress = compression.compress
+
+  def counting_compress(body, encoding):
+    calls.append(encoding)
+    return real_compress(body, encoding)
+
+  monkeypatch.setattr(compression, "compress", counting_compress)
+  flights = SingleFlight()
+  body = json.dumps({"items": list(range(5000))}).encode()
+
+  async def encode():
+    await asyncio.sleep(0.01)
+    return body
+
+  async def burst():
+    body_flight = lambda: flights.do_async("products", encode)
+    return await asyncio.gather(*(
+      compression.compressed_response(request("gzip"), "products", body_flight, minimum_size=1024)
+      for _ in range(20)
+    ))
+
+  responses = asyncio.run(burst())
+  assert calls == ["gzip"]
+  assert flights.leaders == 1
+  for response in responses:
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.body) == body
+
+
+def test_uncompressed_responses_still_vary(client):
+  plain = client.get("/products", headers={"Accept-Encoding": "identity"})
+  assert "content-encoding" not in plain.headers
+  assert plain.headers["vary"] == "Accept-Encoding"
+
+  compressed = client.get("/products", headers={"Accept-Encoding": "gzip"})
+  assert compressed.headers["content-encoding"] == "gzip"
+  assert compressed.headers["vary"] == "Accept-Encoding"
+  assert compressed.json() == plain.json()
+
+  small = client.get("/categories", headers={"Accept-Encoding": "identity"})
+  assert "accept-encoding" in small.headers["vary"].lower()
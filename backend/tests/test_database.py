@@ -0,0 +1,8 @@
+from app.database import SQLITE_BUSY_TIMEOUT_MS, engine, queue_engine
+
+
+def test_sqlite_engines_use_wal_and_a_busy_timeout():
+  for bind in (engine, queue_engine):
+    with bind.connect() as conn:
+      assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+      assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == SQLITE_BUSY_TIMEOUT_MS
@@ -0,0 +1,93 @@
+from sqlalchemy import text
+
+from app.cache import bump_catalog_version
+from app.crud import init_db
+from app.database import SessionLocal, upgrade_schema
+from app.models import ProductDB
+
+
+def set_product(product_id: str, **values) -> None:
+  db = SessionLocal()
+  try:
+    product = db.get(ProductDB, product_id)
+    for name, value in values.items():
+      setattr(product, name, value)
+    db.commit()
+  finally:
+    db.close()
+
+
+def stored_prices(*product_ids: str) -> dict[str, float | None]:
+  db = SessionLocal()
+  try:
+    rows = db.query(ProductDB.id, ProductDB.effective_price).filter(ProductDB.id.in_(product_ids))
+    return dict(rows.all())
+  finally:
+    db.close()
+
+
+def test_upgrade_backfills_databases_without_the_column(db_engine):
+  with db_engine.begin() as conn:
+    indexes = conn.execute(text(
+      "SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '%effective_price%'"
+    )).scalars().all()
+    for name in indexes:
+      conn.execute(text(f"DROP INDEX {name}"))
+    conn.execute(text("ALTER TABLE products DROP COLUMN effective_price"))
+    conn.execute(text("UPDATE products SET price = 1000, discount = 15 WHERE id = 'prod_1'"))
+    conn.execute(text("UPDATE products SET price = 999.99, discount = NULL WHERE id = 'prod_2'"))
+
+  upgrade_schema(db_engine)
+  db = SessionLocal()
+  try:
+    init_db(db)
+    assert db.query(ProductDB).filter(ProductDB.effective_price.is_(None)).count() == 0
+  finally:
+    db.close()
+
+  assert stored_prices("prod_1", "prod_2") == {"prod_1": 850.0, "prod_2": 999.99}
+
+
+def test_orm_updates_keep_effective_price_in_sync(db):
+  set_product("prod_1", price=1000.0, discount=None)
+  assert stored_prices("prod_1") == {"prod_1": 1000.0}
+  set_product("prod_1", discount=20)
+  assert stored_prices("prod_1") == {"prod_1": 800.0}
+  set_product("prod_1", price=500.0)
+  assert stored_prices("prod_1") == {"prod_1": 400.0}
+
+
+def test_bulk_updates_keep_effective_price_in_sync(client):
+  set_product("prod_1", price=1000.0, discount=None)
+  set_product("prod_2", price=200.0, discount=50)
+  db = SessionLocal()
+  try:
+    category = db.get(ProductDB, "prod_1").category
+  finally:
+    db.close()
+
+  client.patch("/products/bulk", json={"items": [
+    {"id": "prod_1", "discount": 10},
+    {"id": "prod_2", "price": 300.0},
+  ]})
+  assert stored_prices("prod_1", "prod_2") == {"prod_1": 900.0, "prod_2": 150.0}
+
+  client.patch("/products/bulk", json={"filter": {"category": category}, "set": {"priceMultiplier": 2}})
+  assert stored_prices("prod_1") == {"prod_1": 1800.0}
+
+
+def test_price_sort_and_filter_use_the_discounted_price(client):
+  set_product("prod_1", price=10.0, discount=50)   # 5.00
+  set_product("prod_2", price=5.0, discount=None)  # 5.00
+  set_product("prod_3", price=6.0, discount=None)  # 6.00
+  set_product("prod_4", price=7.0, discount=50)    # 3.50
+  bump_catalog_version()
+
+  def ids(**params):
+    response = client.get("/products", params={"minPrice": 1, "maxPrice": 6, **params})
+    return [item["id"] for item in response.json()["items"]]
+
+  # Equal prices fall back to the id, in both directions.
+  assert ids(sort="price-asc") == ["prod_4", "prod_1", "prod_2", "prod_3"]
+  assert ids(sort="price-desc") == ["prod_3", "prod_1", "prod_2", "prod_4"]
+  assert ids(sort="price-asc", priceBasis="list") == ["prod_2", "prod_3"]
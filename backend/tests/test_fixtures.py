@@ -0,0 +1,31 @@
+from app.models import ProductDB
+
+from .fixtures import FIXTURE_SCALE, memory_copy, template_path
+
+
+def test_template_is_cached(catalog_template):
+  assert template_path(FIXTURE_SCALE) == catalog_template
+
+
+def test_copy_has_seed_and_synthetic_products(db):
+  assert db.get(ProductDB, "prod_1") is not None
+  assert db.query(ProductDB).filter(ProductDB.id.like("syn_%")).count() == FIXTURE_SCALE
+
+
+def test_copies_are_isolated(db, catalog_template):
+  db.query(ProductDB).filter(ProductDB.id.like("syn_%")).delete(synchronize_session=False)
+  db.commit()
+  other = memory_copy(catalog_template)
+  try:
+    with other.connect() as conn:
+      assert conn.exec_driver_sql("SELECT COUNT(*) FROM products WHERE id LIKE 'syn_%'").scalar() == FIXTURE_SCALE
+  finally:
+    other.dispose()
+
+
+def test_client_is_served_from_the_copy(client, file_db_engine):
+  with file_db_engine.begin() as conn:
+    conn.exec_driver_sql("UPDATE products SET name = 'Fixture Turbo' WHERE id = 'prod_1'")
+  response = client.get("/products/prod_1")
+  assert response.status_code == 200
+  assert response.json()["name"] == "Fixture Turbo"
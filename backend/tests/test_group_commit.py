@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy.orm import Session
+
+from app import events
+from app.crud import OutOfStockError, add_order
+from app.database import SessionLocal
+from app.group_commit import GroupCommitter
+from app.models import OrderDB, ProductDB
+
+
+@pytest.fixture
+def committer(file_db_engine):
+  committer = GroupCommitter(window=0.05, max_batch=64)
+  yield committer
+  committer.stop()
+
+
+def set_stock(product_id: str, stock: int | None) -> None:
+  db = SessionLocal()
+  try:
+    db.get(ProductDB, product_id).stock = stock
+    db.commit()
+  finally:
+    db.close()
+
+
+def test_out_of_stock_fails_only_its_caller(committer):
+  set_stock("prod_1", 10)
+
+  def place(n: int) -> str:
+    try:
+      committer.submit(lambda db: add_order(db, f"GC-{n}", "2024-01-01", 1.0, [("prod_1", 1)]))
+      return "ok"
+    except OutOfStockError:
+      return "out of stock"
+
+  with ThreadPoolExecutor(max_workers=40) as pool:
+    results = list(pool.map(place, range(40)))
+
+  assert results.count("ok") == 10
+  assert committer.stats()["replayedBatches"] == 0
+  assert committer.batches < 40
+  db = SessionLocal()
+  try:
+    assert db.get(ProductDB, "prod_1").stock == 0
+    assert db.query(OrderDB).filter(OrderDB.id.like("GC-%")).count() == 10
+  finally:
+    db.close()
+
+
+def test_failed_operation_is_rolled_back_alone(committer):
+  def broken(db):
+    add_order(db, "GC-BROKEN", "2024-01-01", 1.0, [("prod_2", 1)])
+    db.flush()
+    raise ValueError("payment declined")
+
+  with ThreadPoolExecutor(max_workers=3) as pool:
+    ok = pool.submit(committer.submit, lambda db: add_order(db, "GC-OK", "2024-01-01", 1.0, [("prod_2", 1)]))
+    bad = pool.submit(committer.submit, broken)
+    also_ok = pool.submit(committer.submit, lambda db: add_order(db, "GC-OK2", "2024-01-01", 1.0, [("prod_2", 1)]))
+    assert ok.result().id == "GC-OK"
+    assert also_ok.result().id == "GC-OK2"
+    with pytest.raises(ValueError):
+      bad.result()
+
+  db = SessionLocal()
+  try:
+    assert db.get(OrderDB, "GC-BROKEN") is None
+    assert db.get(OrderDB, "GC-OK") is not None
+    assert db.get(OrderDB, "GC-OK2") is not None
+  finally:
+    db.close()
+  assert committer.stats()["replayedBatches"] == 0
+
+
+class RecordingBroker:
+  """Records published events and whether their orders were committed then."""
+
+  def __init__(self):
+    self.published = []
+
+  def publish(self, payloads):
+    db = SessionLocal()
+    try:
+      for payload in payloads:
+        self.published.append((payload["orderId"], db.get(OrderDB, payload["orderId"]) is not None))
+    finally:
+      db.close()
+
+
+def test_batch_events_are_published_once_after_commit(committer, monkeypatch):
+  recorder = RecordingBroker()
+  monkeypatch.setattr(events, "broker", recorder)
+
+  def broken(db):
+    add_order(db, "GC-EV-BAD", "2024-01-01", 1.0, [("prod_3", 1)])
+    db.flush()
+    raise ValueError("payment declined")
+
+  operations = [
+    lambda db: add_order(db, "GC-EV-A", "2024-01-01", 1.0, [("prod_3", 1)]),
+    broken,
+    lambda db: add_order(db, "GC-EV-C", "2024-01-01", 1.0, [("prod_3", 1)]),
+  ]
+  with ThreadPoolExecutor(max_workers=3) as pool:
+    futures = [pool.submit(committer.submit, operation) for operation in operations]
+    futures[0].result()
+    futures[2].result()
+    with pytest.raises(ValueError):
+      futures[1].result()
+
+  assert sorted(recorder.published) == [("GC-EV-A", True), ("GC-EV-C", True)]
+
+
+def test_failed_batch_commit_publishes_only_the_replay(committer, monkeypatch):
+  recorder = RecordingBroker()
+  monkeypatch.setattr(events, "broker", recorder)
+  commits = []
+  real_commit = Session.commit
+
+  def fail_first_batch_commit(session):
+    commits.append(1)
+    if len(commits) == 1:
+      session.rollback()
+      raise RuntimeError("disk I/O error")
+    real_commit(session)
+
+  monkeypatch.setattr(Session, "commit", fail_first_batch_commit)
+  with ThreadPoolExecutor(max_workers=2) as pool:
+    futures = [
+      pool.submit(committer.submit, lambda db, n=n: add_order(db, f"GC-RP-{n}", "2024-01-01", 1.0, [("prod_3", 1)]))
+      for n in range(2)
+    ]
+    for future in futures:
+      future.result()
+
+  assert committer.stats()["replayedBatches"] == 1
+  assert sorted(recorder.published) == [("GC-RP-0", True), ("GC-RP-1", True)]
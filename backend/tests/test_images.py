@@ -0,0 +1,87 @@
+import asyncio
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import images
+from app.admission import route_class
+from app.cache import bump_catalog_version
+from app.database import SessionLocal
+from app.models import ProductDB
+
+
+@pytest.fixture
+def counted_sessions(monkeypatch):
+  opened = []
+
+  def session():
+    opened.append(1)
+    return SessionLocal()
+
+  monkeypatch.setattr(images, "SessionLocal", session)
+  return opened
+
+
+def test_unknown_keys_do_not_rescan_the_catalog(db, counted_sessions):
+  url = db.get(ProductDB, "prod_1").imageUrl
+  assert images.resolve_key(images.image_key(url)) == url
+  for n in range(50):
+    with pytest.raises(images.ImageNotFoundError):
+      images.resolve_key(f"{n:016x}")
+  assert len(counted_sessions) == 1
+
+
+def test_index_is_rebuilt_after_a_catalog_change(db, counted_sessions):
+  db.get(ProductDB, "prod_1").imageUrl = "https://example.com/new-turbo.jpg"
+  db.commit()
+  bump_catalog_version()
+  assert images.resolve_key(images.image_key("https://example.com/new-turbo.jpg")) == "https://example.com/new-turbo.jpg"
+
+
+@pytest.mark.parametrize("url", [
+  "file:///etc/passwd",
+  "ftp://example.com/a.jpg",
+  "http://127.0.0.1/a.jpg",
+  "http://localhost:8080/a.jpg",
+  "http://169.254.169.254/latest/meta-data/",
+  "http://10.0.0.5/a.jpg",
+  "http://[::1]/a.jpg",
+])
+def test_http_source_refuses_non_public_urls(url):
+  with pytest.raises(images.ImageSourceError, match="Refusing"):
+    images.HTTPImageSource().fetch("0" * 16, url)
+
+
+def test_images_have_their_own_admission_class():
+  assert route_class("GET", "/images/0123456789abcdef") == "images"
+  assert route_class("GET", "/products") == "browse"
+
+
+def test_requested_sizes_snap_to_advertised_variants():
+  assert images.snap_size(None) is None
+  assert images.snap_size(200) == 200
+  assert images.snap_size(201) == 256
+  assert images.snap_size(16) == 96
+  assert images.snap_size(2048) == 1080
+  assert {images.snap_size(w) for w in range(16, 2049)} == set(images.VARIANT_SIZES)
+
+
+def png_header(width: int, height: int) -> bytes:
+  # A PNG that only declares its size; Pillow checks it before decoding.
+  ihdr = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+  chunk = lambda kind, data: struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+  return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IEND", b"")
+
+
+@pytest.mark.skipif(images.Image is None, reason="Pillow is not installed")
+def test_decompression_bombs_are_a_source_error(monkeypatch):
+  pool = ThreadPoolExecutor(max_workers=1)
+  monkeypatch.setattr(images, "_process_pool", lambda: pool)
+  monkeypatch.setattr(images, "_original", lambda key: png_header(50_000, 50_000))
+  try:
+    with pytest.raises(images.ImageSourceError, match="could not be decoded"):
+      asyncio.run(images.get_variant("f" * 16, 400, None, "webp"))
+  finally:
+    pool.shutdown()
@@ -0,0 +1,110 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from app.crud import OutOfStockError, create_order, release_expired_reservations
+from app.database import SessionLocal
+from app.models import OrderDB, ProductDB
+
+STOCK = 50
+BUYERS = 300
+
+
+def set_stock(product_id: str, stock: int | None) -> None:
+  db = SessionLocal()
+  try:
+    db.get(ProductDB, product_id).stock = stock
+    db.commit()
+  finally:
+    db.close()
+
+
+def stock_of(product_id: str) -> int | None:
+  db = SessionLocal()
+  try:
+    return db.get(ProductDB, product_id).stock
+  finally:
+    db.close()
+
+
+def place(order_id: str, lines: list[tuple[str, int]]) -> str:
+  db = SessionLocal()
+  try:
+    create_order(db, order_id, "2024-01-01", 1.0, lines)
+    return "ok"
+  except OutOfStockError:
+    return "out of stock"
+  finally:
+    db.close()
+
+
+def test_concurrent_checkouts_never_oversell(file_db_engine):
+  set_stock("prod_1", STOCK)
+  with ThreadPoolExecutor(max_workers=32) as pool:
+    results = list(pool.map(lambda n: place(f"INV-{n}", [("prod_1", 1)]), range(BUYERS)))
+
+  assert results.count("ok") == STOCK
+  assert results.count("out of stock") == BUYERS - STOCK
+  assert stock_of("prod_1") == 0
+  db = SessionLocal()
+  try:
+    assert db.query(OrderDB).filter(OrderDB.id.like("INV-%")).count() == STOCK
+  finally:
+    db.close()
+
+
+def test_short_line_rolls_back_the_whole_order(file_db_engine):
+  set_stock("prod_1", 5)
+  set_stock("prod_2", 0)
+  assert place("INV-SHORT", [("prod_1", 2), ("prod_2", 1)]) == "out of stock"
+  assert stock_of("prod_1") == 5
+  db = SessionLocal()
+  try:
+    assert db.get(OrderDB, "INV-SHORT") is None
+  finally:
+    db.close()
+
+
+def test_expired_reservations_return_stock(file_db_engine):
+  set_stock("prod_1", 3)
+  assert place("INV-LAPSED", [("prod_1", 2)]) == "ok"
+  assert stock_of("prod_1") == 1
+
+  db = SessionLocal()
+  try:
+    assert release_expired_reservations(db, now=datetime.utcnow() + timedelta(days=1)) == 1
+    assert db.get(OrderDB, "INV-LAPSED").payment_status == "expired"
+  finally:
+    db.close()
+  assert stock_of("prod_1") == 3
+
+
+def test_late_payment_for_sold_out_order_is_kept_for_refund(client, monkeypatch):
+  from app import main
+
+  monkeypatch.setattr(main, "verify_payment_signature", lambda **kwargs: True)
+  set_stock("prod_1", 5)
+  set_stock("prod_2", 1)
+  assert place("INV-LATE", [("prod_1", 2), ("prod_2", 1)]) == "ok"
+  db = SessionLocal()
+  try:
+    release_expired_reservations(db, now=datetime.utcnow() + timedelta(days=1))
+  finally:
+    db.close()
+  set_stock("prod_2", 0)  # sold to someone else meanwhile
+
+  response = client.post("/payments/verify", json={
+    "razorpay_order_id": "order_late",
+    "razorpay_payment_id": "pay_late",
+    "razorpay_signature": "sig",
+    "order_id": "INV-LATE",
+  })
+
+  assert response.status_code == 409
+  db = SessionLocal()
+  try:
+    order = db.get(OrderDB, "INV-LATE")
+    assert (order.payment_status, order.status, order.razorpay_payment_id) == ("refund_due", "Cancelled", "pay_late")
+  finally:
+    db.close()
+  # The line that could be re-reserved was put back.
+  assert stock_of("prod_1") == 5
@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+import pytest
+
+from app.crud import add_order
+from app.database import SessionLocal
+from app.events import hub
+from app.models import OrderDB
+
+
+class Stream:
+  """One server-sent event stream, driven at the ASGI level.
+
+  The test client buffers whole responses, which never end for a stream; here
+  each event is read as it is sent and the client can hang up at any point.
+  """
+
+  def __init__(self, app, path: str):
+    self.messages: asyncio.Queue = asyncio.Queue()
+    self.hung_up = asyncio.Event()
+    scope = {
+      "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+      "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+      "query_string": b"", "headers": [], "client": ("127.0.0.1", 5000), "server": ("testserver", 80),
+    }
+    self.task = asyncio.create_task(app(scope, self._receive, self.messages.put))
+
+  async def _receive(self):
+    await self.hung_up.wait()
+    return {"type": "http.disconnect"}
+
+  async def next_event(self) -> dict:
+    while True:
+      message = await asyncio.wait_for(self.messages.get(), 5)
+      if message["type"] == "http.response.start":
+        assert message["status"] == 200
+        continue
+      for line in message.get("body", b"").decode().splitlines():
+        if line.startswith("data: "):
+          return json.loads(line[len("data: "):])
+
+  async def hang_up(self) -> None:
+    self.hung_up.set()
+    await asyncio.wait_for(self.task, 5)
+
+
+def set_status(order_id: str, status: str, commit: bool = True) -> None:
+  db = SessionLocal()
+  try:
+    db.get(OrderDB, order_id).status = status
+    db.flush()
+    db.commit() if commit else db.rollback()
+  finally:
+    db.close()
+
+
+@pytest.fixture
+def order_id(file_db_engine):
+  db = SessionLocal()
+  try:
+    add_order(db, "EV-1", "2024-01-01", 10.0, [("prod_1", 1)])
+    db.commit()
+  finally:
+    db.close()
+  return "EV-1"
+
+
+def test_stream_starts_with_a_snapshot_and_follows_commits(order_id):
+  from app.main import app
+
+  async def scenario():
+    stream = Stream(app, f"/orders/{order_id}/events")
+    snapshot = await stream.next_event()
+    set_status(order_id, "Packed", commit=False)
+    set_status(order_id, "Shipped")
+    update = await stream.next_event()
+    await stream.hang_up()
+    return snapshot, update
+
+  snapshot, update = asyncio.run(scenario())
+
+  assert (snapshot["type"], snapshot["orderId"], snapshot["status"]) == ("snapshot", order_id, "Processing")
+  # The rolled-back change was never published; the next event is the commit.
+  assert (update["type"], update["status"]) == ("updated", "Shipped")
+
+
+def test_hanging_up_closes_the_subscription(order_id):
+  from app.main import app
+
+  async def scenario():
+    before = hub.stats()["streams"]
+    stream = Stream(app, f"/orders/{order_id}/events")
+    await stream.next_event()
+    during = hub.stats()["streams"]
+    await stream.hang_up()
+    return before, during, hub.stats()["streams"]
+
+  before, during, after = asyncio.run(scenario())
+
+  assert (during, after) == (before + 1, before)
+
+
+def test_unknown_orders_are_not_subscribed(client):
+  before = hub.stats()["streams"]
+  assert client.get("/orders/NOPE/events").status_code == 404
+  assert hub.stats()["streams"] == before
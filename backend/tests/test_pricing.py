@@ -0,0 +1,60 @@
+from app.cache import bump_catalog_version
+from app.database import SessionLocal
+from app.models import ProductDB
+
+
+def set_product(product_id: str, **values) -> None:
+  db = SessionLocal()
+  try:
+    product = db.get(ProductDB, product_id)
+    for name, value in values.items():
+      setattr(product, name, value)
+    db.commit()
+  finally:
+    db.close()
+
+
+CART = {"items": [{"productId": "prod_1", "quantity": 2}, {"productId": "prod_2", "quantity": 1}]}
+ADDRESS = {"line1": "12 Marine Drive", "city": "Mumbai", "country": "IN", "postalCode": "400020"}
+
+
+def test_quote_applies_discounts(client):
+  set_product("prod_1", price=1000.0, discount=10, stock=None)
+  set_product("prod_2", price=500.0, discount=None, stock=None)
+  bump_catalog_version()
+
+  quote = client.post("/cart/quote", json=CART).json()
+
+  assert [line["lineTotal"] for line in quote["items"]] == [1800.0, 500.0]
+  assert (quote["subtotal"], quote["discountTotal"], quote["total"]) == (2500.0, 200.0, 2300.0)
+
+
+def test_quote_follows_catalog_version_and_stock(client):
+  set_product("prod_1", price=1000.0, discount=None, stock=5)
+  set_product("prod_2", price=500.0, discount=None, stock=None)
+  bump_catalog_version()
+  assert client.post("/cart/quote", json=CART).json()["total"] == 2500.0
+
+  # Prices are memoized per catalog version...
+  set_product("prod_1", price=2000.0)
+  assert client.post("/cart/quote", json=CART).json()["total"] == 2500.0
+  bump_catalog_version()
+  assert client.post("/cart/quote", json=CART).json()["total"] == 4500.0
+
+  # ...but availability is re-read on every quote.
+  set_product("prod_1", stock=1)
+  quote = client.post("/cart/quote", json=CART).json()
+  assert quote["available"] is False
+  assert (quote["items"][0]["stock"], quote["items"][0]["available"]) == (1, False)
+
+
+def test_order_response_reports_stock_after_the_reservation(client):
+  set_product("prod_1", stock=5)
+  bump_catalog_version()
+  assert client.post("/cart/quote", json=CART).status_code == 200  # memoizes the cart
+
+  response = client.post("/orders", json={**CART, "shippingAddress": ADDRESS})
+
+  assert response.status_code == 201
+  items = response.json()["order"]["items"]
+  assert items[0]["product"]["stock"] == 3
@@ -0,0 +1,20 @@
+from app.database import get_db
+from app.main import app
+
+
+def test_product_list_does_not_borrow_the_request_session(client):
+  def no_session():
+    raise AssertionError("the shared product query must open its own session")
+    yield
+
+  previous = app.dependency_overrides.get(get_db)
+  app.dependency_overrides[get_db] = no_session
+  try:
+    full = client.get("/products")
+    cards = client.get("/products?view=card&category=Brakes")
+  finally:
+    app.dependency_overrides[get_db] = previous
+
+  assert full.status_code == 200
+  assert full.json()["total"] == len(full.json()["items"]) > 0
+  assert cards.status_code == 200
@@ -0,0 +1,24 @@
+import time
+
+import pytest
+
+from app import main, profiling
+
+
+def test_parameters_are_described_by_type():
+  assert profiling.describe_parameters(("a@b.com", 3)) == "(str, int)"
+  assert profiling.describe_parameters({"email": "a@b.com"}) == "{email: str}"
+  assert profiling.describe_parameters([("x", 1.5), ("y", 2.5)]) == "2 rows of (str, float)"
+
+
+@pytest.fixture
+def secret(monkeypatch):
+  monkeypatch.setattr(main, "token_is_valid", lambda token: profiling.token_is_valid(token, "test-secret"))
+  return profiling.sign_token(int(time.time()) + 60, "test-secret")
+
+
+@pytest.mark.parametrize("path", ["/admin/slow-queries", "/admin/profiles", "/admin/profiles/1-abc"])
+def test_diagnostics_require_the_profiling_token(client, secret, path):
+  assert client.get(path).status_code == 403
+  assert client.get(path, headers={"X-Debug-Profile": "123.bad"}).status_code == 403
+  assert client.get(path, headers={"X-Debug-Profile": secret}).status_code in (200, 404)
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+
+from app.crud import create_order, release_expired_reservations
+from app.database import SessionLocal
+from app.models import OrderDB, ProductDB
+from app.reconcile import FakeGateway, reconcile_pending_orders
+
+TODAY = datetime.utcnow().strftime("%Y-%m-%d")
+
+
+def captured(payment_id: str, amount: int = 100) -> list[dict]:
+  return [{"id": payment_id, "status": "captured", "amount": amount}]
+
+
+def place(order_id: str, product_id: str = "prod_1", quantity: int = 1, date: str = TODAY) -> None:
+  db = SessionLocal()
+  try:
+    order = create_order(db, order_id, date, 1.0, [(product_id, quantity)])
+    order.razorpay_order_id = f"rzp_{order_id}"
+    db.commit()
+  finally:
+    db.close()
+
+
+def order(order_id: str) -> OrderDB:
+  db = SessionLocal()
+  try:
+    return db.get(OrderDB, order_id)
+  finally:
+    db.close()
+
+
+def set_stock(product_id: str, stock: int | None) -> None:
+  db = SessionLocal()
+  try:
+    db.get(ProductDB, product_id).stock = stock
+    db.commit()
+  finally:
+    db.close()
+
+
+def expire_all() -> None:
+  db = SessionLocal()
+  try:
+    release_expired_reservations(db, now=datetime.utcnow() + timedelta(days=1))
+  finally:
+    db.close()
+
+
+def test_applies_gateway_outcomes(file_db_engine):
+  for order_id in ("REC-PAID", "REC-FAILED", "REC-OPEN"):
+    place(order_id)
+  gateway = FakeGateway({
+    "rzp_REC-PAID": captured("pay_1"),
+    "rzp_REC-FAILED": [{"id": "pay_2", "status": "failed"}],
+  })
+
+  stats = reconcile_pending_orders(gateway, concurrency=4, rate=0, page_size=2)
+
+  assert (stats.paid, stats.failed, stats.errors) == (1, 1, 0)
+  assert order("REC-PAID").payment_status == "paid"
+  assert order("REC-PAID").razorpay_payment_id == "pay_1"
+  assert order("REC-FAILED").payment_status == "failed"
+  assert order("REC-OPEN").payment_status == "pending"
+
+
+def test_repairs_orders_the_sweeper_expired(file_db_engine):
+  set_stock("prod_1", 5)
+  place("REC-LOST", quantity=2)
+  expire_all()
+  assert order("REC-LOST").payment_status == "expired"
+
+  stats = reconcile_pending_orders(FakeGateway({"rzp_REC-LOST": captured("pay_3")}), rate=0)
+
+  assert stats.paid == 1
+  assert order("REC-LOST").payment_status == "paid"
+  db = SessionLocal()
+  try:
+    assert db.get(ProductDB, "prod_1").stock == 3
+  finally:
+    db.close()
+
+
+def test_old_expired_orders_are_left_alone(file_db_engine):
+  place("REC-OLD", date=(datetime.utcnow() - timedelta(days=30)).strftime("%Y-%m-%d"))
+  expire_all()
+  gateway = FakeGateway({"rzp_REC-OLD": captured("pay_4")})
+
+  stats = reconcile_pending_orders(gateway, rate=0, expired_days=7)
+
+  assert gateway.calls == 0
+  assert stats.paid == 0
+  assert order("REC-OLD").payment_status == "expired"
+
+
+def test_wrong_amount_is_not_marked_paid(file_db_engine):
+  set_stock("prod_1", 5)
+  place("REC-SHORT", quantity=2)
+
+  stats = reconcile_pending_orders(FakeGateway({"rzp_REC-SHORT": captured("pay_5", amount=1)}), rate=0)
+
+  assert (stats.paid, stats.refund_due) == (0, 1)
+  assert order("REC-SHORT").payment_status == "refund_due"
+  assert order("REC-SHORT").razorpay_payment_id == "pay_5"
+  db = SessionLocal()
+  try:
+    assert db.get(ProductDB, "prod_1").stock == 5
+  finally:
+    db.close()
+
+
+def test_expired_order_that_sold_out_awaits_a_refund(file_db_engine):
+  set_stock("prod_1", 2)
+  place("REC-SOLD", quantity=2)
+  expire_all()
+  set_stock("prod_1", 0)
+
+  stats = reconcile_pending_orders(FakeGateway({"rzp_REC-SOLD": captured("pay_6")}), rate=0)
+
+  assert (stats.paid, stats.refund_due, stats.errors) == (0, 1, 0)
+  assert order("REC-SOLD").payment_status == "refund_due"
@@ -0,0 +1,112 @@
+import pytest
+
+from app.database import SessionLocal
+from app.models import OrderDB, ProductDB
+from app.shipping import (
+  SHIPPING_FREE_ABOVE, SHIPPING_PER_EXTRA_UNIT, SHIPPING_RATES, InvalidPinError, PinTable, ShippingZone,
+  quote_shipping, shipping_cost,
+)
+
+METRO = ShippingZone(zone="C", region="Delhi", eta_min=2, eta_max=4, serviceable=True)
+LOCAL = ShippingZone(zone="A", region="Mumbai", eta_min=1, eta_max=2, serviceable=True)
+ARMY = ShippingZone(zone="-", region="Army Postal Service", eta_min=0, eta_max=0, serviceable=False)
+
+
+def address(pin: str) -> dict:
+  return {"line1": "12 Marine Drive", "city": "Mumbai", "country": "IN", "postalCode": pin}
+
+
+def test_lookup_at_range_boundaries():
+  table = PinTable([
+    (400001, 400001, LOCAL),
+    (110000, 110999, METRO),
+    (400002, 400099, LOCAL),  # contiguous with the same zone: merged
+    (900000, 900999, ARMY),
+  ])
+
+  assert len(table) == 3
+  assert [table.lookup(pin) for pin in (109999, 110000, 110999, 111000)] == [None, METRO, METRO, None]
+  assert [table.lookup(pin) for pin in (400000, 400001, 400099, 400100)] == [None, LOCAL, LOCAL, None]
+  assert table.lookup(900999) == ARMY
+  assert table.lookup(999999) is None
+
+
+def test_overlapping_ranges_are_rejected():
+  with pytest.raises(ValueError):
+    PinTable([(110000, 110999, METRO), (110500, 111999, LOCAL)])
+
+
+@pytest.mark.parametrize("pin, serviceable", [
+  ("109999", False),  # below the first range
+  ("110000", True),
+  ("110999", True),
+  ("900500", False),  # listed, but not delivered to
+])
+def test_quotes_from_the_bundled_table(pin, serviceable):
+  quote = quote_shipping(pin)
+  assert quote.serviceable is serviceable
+  assert (quote.cost is not None) is serviceable
+
+
+@pytest.mark.parametrize("pin", ["11000", "1100001", "011000", "11O000"])
+def test_malformed_pins_are_rejected(pin):
+  with pytest.raises(InvalidPinError):
+    quote_shipping(pin)
+
+
+def test_free_shipping_threshold():
+  just_below = SHIPPING_FREE_ABOVE - 0.01
+  assert shipping_cost(LOCAL, just_below, 3) == SHIPPING_RATES["A"] + 2 * SHIPPING_PER_EXTRA_UNIT
+  assert shipping_cost(LOCAL, SHIPPING_FREE_ABOVE, 3) == 0.0
+
+
+@pytest.fixture
+def priced(client):
+  db = SessionLocal()
+  try:
+    product = db.get(ProductDB, "prod_1")
+    product.price, product.discount, product.stock = 1000.0, None, None
+    db.commit()
+  finally:
+    db.close()
+  return client
+
+
+@pytest.mark.parametrize("quantity, shipping", [
+  (2, SHIPPING_RATES["C"] + SHIPPING_PER_EXTRA_UNIT),
+  (5, 0.0),  # 5000.00: free
+])
+def test_order_total_includes_shipping(priced, quantity, shipping):
+  response = priced.post("/orders", json={
+    "items": [{"productId": "prod_1", "quantity": quantity}],
+    "shippingAddress": address("110001"),
+  })
+
+  assert response.status_code == 201
+  order = response.json()["order"]
+  assert (order["shippingCost"], order["total"]) == (shipping, 1000.0 * quantity + shipping)
+  db = SessionLocal()
+  try:
+    stored = db.get(OrderDB, order["id"])
+    assert (stored.shipping_cost, stored.total, stored.shipping_zip) == (shipping, order["total"], "110001")
+  finally:
+    db.close()
+
+
+@pytest.mark.parametrize("body", [
+  {"shippingAddress": address("900500")},  # not delivered to
+  {"shippingAddress": address("12345")},   # not a PIN code
+])
+def test_orders_to_undeliverable_pins_are_rejected(priced, body):
+  response = priced.post("/orders", json={"items": [{"productId": "prod_1", "quantity": 1}], **body})
+  assert response.status_code == 400
+  db = SessionLocal()
+  try:
+    assert db.query(OrderDB).filter(OrderDB.shipping_zip == body["shippingAddress"]["postalCode"]).count() == 0
+  finally:
+    db.close()
+
+
+def test_orders_need_a_shipping_address(priced):
+  response = priced.post("/orders", json={"items": [{"productId": "prod_1", "quantity": 1}]})
+  assert response.status_code == 422
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import main
+from app.cache import bump_catalog_version
+from app.database import SessionLocal
+from app.models import ProductDB
+from app.similarity import SimilarityIndex
+
+
+def part(product_id: str, name: str, category: str, description: str) -> SimpleNamespace:
+  return SimpleNamespace(id=product_id, name=name, category=category, description=description)
+
+
+CATALOG = [
+  part("pads", "Ceramic Brake Pads", "Brakes", "Low dust ceramic pads for street brakes."),
+  part("rotors", "Slotted Brake Rotors", "Brakes", "Slotted rotors that pair with performance pads."),
+  part("calipers", "Six Piston Brake Calipers", "Brakes", "Forged calipers for big brake upgrades."),
+  part("turbo", "Ball Bearing Turbocharger", "Engine", "More boost and faster spool for turbo engines."),
+  part("intake", "Cold Air Intake", "Engine", "Feeds the engine cooler air for more power."),
+]
+
+
+def ranked(index: SimilarityIndex, product_id: str) -> list[str]:
+  return [pid for pid, _ in index.similar(product_id, limit=4)]
+
+
+def test_ranks_parts_sharing_terms_first():
+  index = SimilarityIndex()
+  index.build(CATALOG)
+  assert ranked(index, "pads")[:2] == ["rotors", "calipers"]
+  assert ranked(index, "turbo")[0] == "intake"
+
+
+def test_incremental_updates_change_the_answers():
+  index = SimilarityIndex()
+  index.build(CATALOG)
+  assert "intake" not in ranked(index, "pads")[:2]
+
+  index.upsert(part("intake", "Ceramic Brake Pad Shims", "Brakes", "Quiet shims for ceramic pads."))
+  assert ranked(index, "pads")[0] == "intake"
+
+  index.remove("intake")
+  assert "intake" not in ranked(index, "pads")
+  assert "intake" not in index
+
+
+@pytest.fixture
+def similar_client(client):
+  # The index is process-wide; build it from this test's database copy.
+  main._similar_index_state["version"] = None
+  main.prepare_app()
+  yield client
+  main._similar_index_state["version"] = None
+
+
+def similar_ids(client, product_id: str) -> list[str]:
+  response = client.get(f"/products/{product_id}/similar?limit=10")
+  assert response.status_code == 200
+  return [p["id"] for p in response.json()]
+
+
+def test_deleted_products_leave_the_results(similar_client):
+  before = similar_ids(similar_client, "prod_2")
+  assert before
+  assert similar_client.delete(f"/product/{before[0]}").status_code == 204
+  assert before[0] not in similar_ids(similar_client, "prod_2")
+
+
+def test_edits_from_another_worker_are_picked_up(similar_client):
+  assert "prod_4" not in similar_ids(similar_client, "prod_1")
+  # Written straight to the database, as another worker would; only the
+  # change feed and the shared catalog version tell this process about it.
+  db = SessionLocal()
+  try:
+    original = db.get(ProductDB, "prod_1")
+    product = db.get(ProductDB, "prod_4")
+    product.name, product.category, product.description = original.name, original.category, original.description
+    db.commit()
+  finally:
+    db.close()
+  bump_catalog_version()
+  assert "prod_4" in similar_ids(similar_client, "prod_1")
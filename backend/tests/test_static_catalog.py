@@ -0,0 +1,35 @@
+import os
+
+from app.models import ProductDB
+from app.static_catalog import MANIFEST, build, load_manifest
+
+
+def shard_file(out_dir, name: str) -> str:
+  return os.path.join(out_dir, load_manifest(out_dir)["shards"][name]["path"])
+
+
+def test_rebuild_touches_only_its_own_files(db, tmp_path):
+  out = tmp_path / "public"
+  out.mkdir()
+  (out / "favicon.ico").write_bytes(b"icon")
+  (out / "products").mkdir()
+  (out / "products" / "notes.txt").write_text("keep me")
+
+  assert build(db, str(out))["full"]
+  first = shard_file(out, "products/prod_1")
+
+  db.get(ProductDB, "prod_1").price = 1.5
+  db.commit()
+  result = build(db, str(out))
+  assert not result["full"]
+  second = shard_file(out, "products/prod_1")
+  assert second != first
+  assert os.path.exists(first)  # kept for clients holding the previous manifest
+  assert os.path.relpath(first, out) in load_manifest(out)["retired"]
+
+  build(db, str(out), full=True)
+  assert not os.path.exists(first)
+  assert os.path.exists(second)
+  assert (out / "favicon.ico").read_bytes() == b"icon"
+  assert (out / "products" / "notes.txt").read_text() == "keep me"
+  assert (out / MANIFEST).exists()
@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy import create_mock_engine
+
+from app.archive import archive_orders, find_archived_order
+from app.crud import create_order, mark_order_paid
+from app.models import OrderDB
+from app.stats import check_database, rebuild, sales_summary
+
+OLD = "2020-03-01"
+
+
+def place_paid(db, order_id: str, date: str, quantity: int) -> None:
+  order = create_order(db, order_id, date, 100.0 * quantity, [("prod_1", quantity)])
+  mark_order_paid(db, order, f"rzp_{order_id}", f"pay_{order_id}")
+  db.commit()
+
+
+def summary(db) -> dict:
+  return sales_summary(db, "2020-01-01", "2099-12-31")
+
+
+def test_rebuild_matches_incremental_totals(db):
+  place_paid(db, "ST-1", OLD, 2)
+  place_paid(db, "ST-2", "2024-05-01", 1)
+  create_order(db, "ST-3", "2024-05-01", 50.0, [("prod_2", 1)])
+  before = summary(db)
+
+  assert rebuild(db) == db.query(OrderDB).count()
+  assert summary(db) == before
+
+
+def test_rebuild_counts_archived_orders(db):
+  place_paid(db, "ST-OLD", OLD, 3)
+  place_paid(db, "ST-NEW", "2024-05-01", 1)
+  before = summary(db)
+
+  assert archive_orders(db, older_than_days=365) >= 1
+  assert db.get(OrderDB, "ST-OLD") is None
+  assert find_archived_order(db, "ST-OLD")["total"] == 300.0
+  assert summary(db) == before
+
+  rebuild(db)
+  after = summary(db)
+  assert after["revenue"] == before["revenue"]
+  assert after["paidOrders"] == before["paidOrders"]
+  assert after["units"] == before["units"]
+  assert after["topProducts"] == before["topProducts"]
+
+
+def test_unsupported_database_fails_at_startup():
+  check_database(create_mock_engine("postgresql://", lambda *a, **k: None))
+  with pytest.raises(RuntimeError, match="mysql"):
+    check_database(create_mock_engine("mysql://", lambda *a, **k: None))
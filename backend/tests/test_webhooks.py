@@ -0,0 +1,101 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import webhooks
+from app.database import QueueBase, QueueSessionLocal, queue_engine
+from app.models import OrderDB, WebhookEventDB
+
+
+@pytest.fixture
+def queue():
+  QueueBase.metadata.create_all(bind=queue_engine)
+  db = QueueSessionLocal()
+  try:
+    db.query(WebhookEventDB).delete()
+    db.commit()
+  finally:
+    db.close()
+
+
+def event_row(event_id: str) -> WebhookEventDB:
+  db = QueueSessionLocal()
+  try:
+    return db.get(WebhookEventDB, event_id)
+  finally:
+    db.close()
+
+
+def payment_failed(event_id: str) -> None:
+  payload = {"payload": {"payment": {"entity": {"id": "pay_x", "order_id": "order_x"}}}}
+  assert webhooks.enqueue_event(event_id, "payment.failed", json.dumps(payload).encode())
+
+
+def test_transient_failure_is_retried_with_backoff(queue, db_engine, monkeypatch):
+  def locked(db, event):
+    raise RuntimeError("database is locked")
+
+  monkeypatch.setattr(webhooks, "apply_event", locked)
+  payment_failed("evt_locked")
+
+  assert webhooks.process_batch("w1") == 0
+  row = event_row("evt_locked")
+  assert (row.status, row.attempts) == ("queued", 1)
+  assert row.next_attempt_at > datetime.utcnow().strftime(webhooks.TIME_FORMAT)
+  # Not due yet: an immediate second pass claims nothing.
+  assert webhooks.claim_batch("w1") == []
+
+  monkeypatch.undo()
+  db = QueueSessionLocal()
+  try:
+    db.get(WebhookEventDB, "evt_locked").next_attempt_at = (datetime.utcnow() - timedelta(seconds=1)).strftime(webhooks.TIME_FORMAT)
+    db.commit()
+  finally:
+    db.close()
+  assert webhooks.process_batch("w1") == 1
+  row = event_row("evt_locked")
+  assert (row.status, row.attempts, row.next_attempt_at) == ("skipped", 2, None)
+
+
+def test_gives_up_after_max_attempts(queue, db_engine, monkeypatch):
+  monkeypatch.setattr(webhooks, "apply_event", lambda db, event: 1 / 0)
+  monkeypatch.setattr(webhooks, "WEBHOOK_RETRY_SECONDS", 0)
+  payment_failed("evt_broken")
+
+  for _ in range(webhooks.WEBHOOK_MAX_ATTEMPTS - 1):
+    assert webhooks.process_batch("w1") == 0
+  assert webhooks.process_batch("w1") == 1
+  assert event_row("evt_broken").status == "failed"
+
+
+def test_retry_delay_doubles_up_to_the_cap():
+  assert webhooks.retry_delay(2) == 2 * webhooks.retry_delay(1)
+  assert webhooks.retry_delay(50) == webhooks.WEBHOOK_RETRY_MAX
+
+
+def test_captured_amount_must_match_the_order_total(queue, db_engine):
+  from app.crud import create_order
+  from app.database import SessionLocal
+
+  db = SessionLocal()
+  try:
+    for order_id in ("WH-EXACT", "WH-SHORT"):
+      create_order(db, order_id, "2024-01-01", 499.99, [("prod_1", 1)])
+  finally:
+    db.close()
+  for order_id, amount in (("WH-EXACT", 49999), ("WH-SHORT", 100)):
+    payload = {"payload": {
+      "payment": {"entity": {"id": f"pay_{order_id}", "order_id": f"order_{order_id}", "amount": amount}},
+      "order": {"entity": {"id": f"order_{order_id}", "receipt": order_id}},
+    }}
+    assert webhooks.enqueue_event(f"evt_{order_id}", "payment.captured", json.dumps(payload).encode())
+
+  assert webhooks.process_batch("w1") == 2
+  db = SessionLocal()
+  try:
+    assert db.get(OrderDB, "WH-EXACT").payment_status == "paid"
+    assert db.get(OrderDB, "WH-SHORT").payment_status == "refund_due"
+    assert db.get(OrderDB, "WH-SHORT").razorpay_payment_id == "pay_WH-SHORT"
+  finally:
+    db.close()
@@ -21,6 +21,7 @@ import { Lock, Loader2 } from 'lucide-react';
 import Image from 'next/image';
 import Link from 'next/link';
 import { useEffect, useState } from 'react';
+import { fetchCartQuote, fetchShippingQuote, type CartQuote, type CartQuoteLine, type ShippingQuote } from '@/lib/api';
 
 const formSchema = z.object({
   name: z.string().min(2, 'Name is too short'),
@@ -73,6 +74,37 @@ export default function CheckoutPage() {
     };
   }, []);
 
+  // Price the cart on the server, with discounts, exactly as POST /orders will
+  const [cartQuote, setCartQuote] = useState<CartQuote | null>(null);
+  useEffect(() => {
+    if (cartItems.length === 0) {
+      setCartQuote(null);
+      return;
+    }
+    let cancelled = false;
+    fetchCartQuote(cartItems.map(({ product, quantity }) => ({ productId: product.id, quantity })))
+      .then((quote) => { if (!cancelled) setCartQuote(quote); })
+      .catch(() => { if (!cancelled) setCartQuote(null); });
+    return () => { cancelled = true; };
+  }, [cartItems]);
+
+  // Quote delivery once a full PIN code has been entered; the free-shipping
+  // threshold applies to the discounted total, as on the server
+  const zip = form.watch('zip');
+  const itemsTotal = cartQuote?.total ?? null;
+  const [shippingQuote, setShippingQuote] = useState<ShippingQuote | null>(null);
+  useEffect(() => {
+    if (!/^[1-9][0-9]{5}$/.test(zip) || itemsTotal === null) {
+      setShippingQuote(null);
+      return;
+    }
+    let cancelled = false;
+    fetchShippingQuote(zip, itemsTotal, totalItems)
+      .then((quote) => { if (!cancelled) setShippingQuote(quote); })
+      .catch(() => { if (!cancelled) setShippingQuote(null); });
+    return () => { cancelled = true; };
+  }, [zip, itemsTotal, totalItems]);
+
   async function onSubmit(values: z.infer<typeof formSchema>) {
     if (!razorpayLoaded) {
       toast({
@@ -95,7 +127,16 @@ export default function CheckoutPage() {
       const createOrderRes = await fetch(`${API_BASE}/orders`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ items: orderItems }),
+        body: JSON.stringify({
+          items: orderItems,
+          customerEmail: values.email,
+          shippingAddress: {
+            line1: values.address,
+            city: values.city,
+            country: 'IN',
+            postalCode: values.zip,
+          },
+        }),
       });
 
       if (!createOrderRes.ok) {
@@ -107,7 +148,8 @@ export default function CheckoutPage() {
       const orderId = createdOrder.id;
 
       // Step 2: Create Razorpay order
-      const amountInPaise = Math.round(cartTotal * 100 + 15 * 100); // shipping cost 15 INR
+      // The order total is priced server-side and includes shipping
+      const amountInPaise = Math.round(createdOrder.total * 100);
 
       const razorpayOrderRes = await fetch(`${API_BASE}/payments/create-order`, {
         method: 'POST',
@@ -157,7 +199,8 @@ export default function CheckoutPage() {
             });
 
             if (!verifyRes.ok) {
-              throw new Error('Payment verification failed');
+              const error = await verifyRes.json().catch(() => null);
+              throw new Error(error?.detail || 'Payment verification failed');
             }
 
             // Success!
@@ -218,8 +261,11 @@ export default function CheckoutPage() {
     )
   }
 
-  const shippingCost = 15.00;
-  const orderTotal = cartTotal + shippingCost;
+  const lineTotals = new Map<string, CartQuoteLine>(cartQuote?.items.map((line) => [line.productId, line] as const) ?? []);
+  const subtotal = cartQuote?.subtotal ?? cartTotal;
+  const discountTotal = cartQuote?.discountTotal ?? 0;
+  const shippingCost = shippingQuote?.cost ?? 0;
+  const orderTotal = (itemsTotal ?? cartTotal) + shippingCost;
 
   return (
     <div className="container mx-auto px-4 py-12 text-white">
@@ -245,20 +291,35 @@ export default function CheckoutPage() {
                       <div>
                         <p className="font-semibold">{product.name}</p>
                         <p className="text-sm text-gray-400">Qty: {quantity}</p>
+                        {lineTotals.get(product.id)?.available === false && (
+                          <p className="text-sm text-red-500">Not enough stock</p>
+                        )}
                       </div>
                     </div>
-                    <p className="font-medium">${(product.price * quantity).toFixed(2)}</p>
+                    <p className="font-medium">${(lineTotals.get(product.id)?.lineTotal ?? product.price * quantity).toFixed(2)}</p>
                   </div>
                 )
                 )}
                 <div className="mt-6 border-t border-white/10 pt-6 space-y-2">
                   <div className="flex justify-between text-gray-400">
                     <p>Subtotal</p>
-                    <p>${cartTotal.toFixed(2)}</p>
+                    <p>${subtotal.toFixed(2)}</p>
                   </div>
+                  {discountTotal > 0 && (
+                    <div className="flex justify-between text-gray-400">
+                      <p>Discounts</p>
+                      <p>-${discountTotal.toFixed(2)}</p>
+                    </div>
+                  )}
                   <div className="flex justify-between text-gray-400">
                     <p>Shipping</p>
-                    <p>${shippingCost.toFixed(2)}</p>
+                    <p>
+                      {shippingQuote === null
+                        ? 'Enter PIN code'
+                        : shippingQuote.serviceable
+                          ? `$${shippingCost.toFixed(2)} (${shippingQuote.etaMinDays}-${shippingQuote.etaMaxDays} days)`
+                          : 'Not deliverable'}
+                    </p>
                   </div>
                   <div className="flex justify-between font-bold text-xl text-white">
                     <p>Total</p>
@@ -315,7 +376,7 @@ export default function CheckoutPage() {
               type="submit" 
               size="lg" 
               className="w-full backdrop-blur-md mt-8 text-lg font-bold bg-red-600 hover:bg-red-700 text-white shadow-lg shadow-red-900/20"
-              disabled={isProcessing}
+              disabled={isProcessing || cartQuote === null}
             >
               {isProcessing ? (
                 <>
@@ -325,7 +386,7 @@ export default function CheckoutPage() {
               ) : (
                 <>
                   <Lock className="mr-2 h-5 w-5" />
-                  Pay ₹{(cartTotal + 15).toLocaleString('en-IN', { minimumFractionDigits: 2 })}
+                  Pay ₹{orderTotal.toLocaleString('en-IN', { minimumFractionDigits: 2 })}
                 </>
               )}
             </Button>
@@ -3,6 +3,7 @@
 import type { CartItem, Product } from '@/lib/types';
 import React, { createContext, useContext, useState, ReactNode, useEffect } from 'react';
 import { useToast } from "@/hooks/use-toast";
+import { fetchProductsByIds } from '@/lib/api';
 
 interface CartContextType {
   cartItems: CartItem[];
@@ -16,33 +17,40 @@ interface CartContextType {
 
 const CartContext = createContext<CartContextType | undefined>(undefined);
 
-// Map old product IDs to new prod_X format
-const productIdMap: Record<string, string> = {
-  'turbocharger': 'prod_1',
-  'brake-kit': 'prod_2',
-  'suspension': 'prod_3',
-  'exhaust': 'prod_4',
-  'racing-seat': 'prod_5',
-  'carbon-hood': 'prod_6',
-  'intercooler': 'prod_7',
-  'racing-wheel': 'prod_8',
-};
-
 export const CartProvider = ({ children }: { children: ReactNode }) => {
   const [cartItems, setCartItems] = useState<CartItem[]>([]);
   const { toast } = useToast();
 
   useEffect(() => {
     const storedCart = localStorage.getItem('cart');
-    if (storedCart) {
-      try {
-        const parsedCart = JSON.parse(storedCart) as CartItem[];
-        setCartItems(parsedCart);
-      } catch (error) {
-        console.error('Error loading cart:', error);
-        localStorage.removeItem('cart');
-      }
+    if (!storedCart) return;
+    let parsedCart: CartItem[];
+    try {
+      parsedCart = JSON.parse(storedCart) as CartItem[];
+    } catch (error) {
+      console.error('Error loading cart:', error);
+      localStorage.removeItem('cart');
+      return;
     }
+    setCartItems(parsedCart);
+    if (parsedCart.length === 0) return;
+
+    // Stored products go stale (price, stock, old slug IDs); refresh them all in one request.
+    fetchProductsByIds(parsedCart.map(item => item.product.id))
+      .then(({ items, aliases }) => {
+        const current = new Map(items.map(product => [product.id, product]));
+        setCartItems(prevItems => {
+          const refreshed = new Map<string, CartItem>();
+          for (const item of prevItems) {
+            const product = current.get(aliases[item.product.id] ?? item.product.id);
+            if (!product) continue; // deleted since it was added
+            const quantity = (refreshed.get(product.id)?.quantity ?? 0) + item.quantity;
+            refreshed.set(product.id, { product, quantity });
+          }
+          return Array.from(refreshed.values());
+        });
+      })
+      .catch(error => console.error('Error refreshing cart:', error));
   }, []);
 
   useEffect(() => {
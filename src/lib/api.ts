@@ -86,6 +86,83 @@ export async function fetchProductById(productId: string): Promise<Product> {
   return response.json();
 }
 
+export async function fetchProductsByIds(productIds: string[]): Promise<{ items: Product[]; missing: string[]; aliases: Record<string, string> }> {
+  // POST keeps long ID lists out of the URL; at most 300 IDs per call.
+  const response = await fetch(`${API_BASE_URL}/products:batch`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({ ids: productIds }),
+  });
+
+  if (!response.ok) {
+    throw new Error(`Failed to fetch products: ${response.statusText}`);
+  }
+
+  return response.json();
+}
+
+export interface CartQuoteLine {
+  productId: string;
+  product: Product;
+  quantity: number;
+  unitPrice: number;
+  discount: number | null;
+  effectivePrice: number;
+  lineTotal: number;
+  available: boolean;
+  stock: number | null;
+}
+
+export interface CartQuote {
+  items: CartQuoteLine[];
+  subtotal: number;
+  discountTotal: number;
+  total: number;
+  available: boolean;
+  catalogVersion: number;
+}
+
+export async function fetchCartQuote(items: { productId: string; quantity: number }[]): Promise<CartQuote> {
+  // Priced by the same engine as POST /orders, so `total` is what the order will cost before shipping.
+  const response = await fetch(`${API_BASE_URL}/cart/quote`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({ items }),
+  });
+
+  if (!response.ok) {
+    throw new Error(`Failed to quote cart: ${response.statusText}`);
+  }
+
+  return response.json();
+}
+
+export interface ShippingQuote {
+  pin: string;
+  serviceable: boolean;
+  zone: string | null;
+  region: string | null;
+  etaMinDays: number | null;
+  etaMaxDays: number | null;
+  cost: number | null;
+  freeAbove: number;
+}
+
+export async function fetchShippingQuote(pin: string, subtotal: number, units: number): Promise<ShippingQuote> {
+  const params = new URLSearchParams({ pin, subtotal: String(subtotal), units: String(units) });
+  const response = await fetch(`${API_BASE_URL}/shipping/quote?${params}`);
+
+  if (!response.ok) {
+    throw new Error(`Failed to fetch shipping quote: ${response.statusText}`);
+  }
+
+  return response.json();
+}
+
 export async function fetchBrands(): Promise<Brand[]> {
   const response = await fetch(`${API_BASE_URL}/brands`, {
     headers: {